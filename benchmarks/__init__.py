@@ -0,0 +1 @@
+"""Benchmarks of the monitoring strategies against a fake Synapse"""
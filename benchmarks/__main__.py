@@ -0,0 +1,146 @@
+"""Command line of the benchmarks"""
+import argparse
+import json
+import sys
+
+from . import suite
+
+
+def build_parser():
+    """Set up argument parser and returns"""
+    parser = argparse.ArgumentParser(
+        description="Measure the wall time, REST calls and peak memory of each "
+        "monitoring strategy on a synthetic hierarchy served by a fake Synapse."
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=3,
+        help="Levels of Folders below the Project. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fanout",
+        type=int,
+        default=4,
+        help="Child Folders of each container. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=100,
+        help="File entities of each container. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--modified_rate",
+        type=float,
+        default=0.01,
+        help="Fraction of File entities modified in the last day. "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=5,
+        help="Users modifying the File entities. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic hierarchy. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--latency",
+        metavar="seconds",
+        type=float,
+        default=0.005,
+        help="Seconds each REST call takes. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--throttle_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of REST calls throttled with a 429 response and retried "
+        "by the request governor. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=[strategy.name for strategy in suite.STRATEGIES],
+        help="Strategies measured. (default: all)",
+    )
+    parser.add_argument(
+        "--json",
+        metavar="file",
+        help="Write the scenario and the measures to this JSON file, ie. to "
+        "update the baseline. (default: None)",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="file",
+        help="Fail when REST calls or found entities differ from this JSON "
+        "file, or wall time or peak memory grow beyond the tolerances. "
+        "(default: None)",
+    )
+    parser.add_argument(
+        "--time_tolerance",
+        type=float,
+        help="Fraction by which wall time may grow over the baseline. "
+        "(default: not compared)",
+    )
+    parser.add_argument(
+        "--memory_tolerance",
+        type=float,
+        default=0.5,
+        help="Fraction by which peak memory may grow over the baseline. "
+        "(default: %(default)s)",
+    )
+    return parser
+
+
+def main():
+    """Invoke"""
+    args = build_parser().parse_args()
+    scenario = {
+        "depth": args.depth,
+        "fanout": args.fanout,
+        "files": args.files,
+        "modified_rate": args.modified_rate,
+        "users": args.users,
+        "seed": args.seed,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["scenario"] != scenario:
+            raise ValueError(
+                f"Baseline scenario {baseline['scenario']} differs from {scenario}"
+            )
+
+    results = suite.run_suite(
+        scenario,
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        strategies=args.strategies,
+    )
+    sys.stdout.write(suite.format_results(results))
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"scenario": scenario, "results": results}, json_file, indent=2)
+
+    if baseline is not None:
+        regressions = suite.compare(
+            results,
+            baseline["results"],
+            time_tolerance=args.time_tolerance,
+            memory_tolerance=args.memory_tolerance,
+        )
+        for regression in regressions:
+            sys.stderr.write(f"Regression: {regression}\n")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
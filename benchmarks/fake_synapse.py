@@ -0,0 +1,420 @@
+"""In-process fake of a Synapse connection serving a synthetic hierarchy"""
+import collections
+from datetime import datetime, timedelta
+import json
+import random
+import re
+import threading
+import time
+import typing
+
+import pandas as pd
+import requests
+from synapseclient.core.exceptions import SynapseHTTPError
+from synapseclient.core.utils import from_unix_epoch_time
+from synapseclient.entity import Entity
+
+# Entity headers returned by a page of the children listing
+CHILDREN_PAGE_SIZE = 50
+# Synapse ID of the root of Synapse, first entity of every path
+ROOT_ID = "syn4489"
+# DATE columns of the fake File View
+DATE_COLUMNS = ["createdOn", "modifiedOn"]
+# Columns of the fake File View and the entity field holding them
+VIEW_COLUMNS = {
+    "id": "id",
+    "name": "name",
+    "parentId": "parentId",
+    "etag": "etag",
+    "currentVersion": "versionNumber",
+    "createdOn": "createdOn",
+    "modifiedOn": "modifiedOn",
+    "modifiedBy": "modifiedBy",
+    "type": "type",
+}
+# Logged in user of the fake connection
+OWNER_ID = "100"
+
+
+def _timestamp(when: datetime) -> str:
+    """Format a time as a Synapse timestamp"""
+    return when.strftime("%Y-%m-%dT%H:%M:%S.") + f"{when.microsecond // 1000:03d}Z"
+
+
+def _epoch_ms(timestamp: str) -> int:
+    """Milliseconds since epoch of a Synapse timestamp"""
+    when = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ")
+    return int((when - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+class SyntheticTree:
+    """Synthetic hierarchy of a Project.  The Project and each Folder above
+    the deepest level have fanout child Folders, and every container holds
+    files File entities.  A fraction modified_rate of the File entities
+    were modified an hour ago, the others a month ago.  A File View scoped
+    to the Project is stored in it.
+
+    Args:
+        depth: Number of levels of Folders below the Project
+        fanout: Number of child Folders of each container
+        files: Number of File entities of each container
+        modified_rate: Fraction of File entities modified an hour ago
+        users: Number of users modifying the File entities
+        seed: Seed of the random choice of modified File entities
+        now: Time of the generation, defaults to now
+
+    Attributes:
+        root_id: Synapse ID of the Project
+        view_id: Synapse ID of the File View
+        file_ids: Synapse IDs of the File entities
+        modified_ids: Synapse IDs of the File entities modified an hour ago
+    """
+
+    def __init__(
+        self,
+        depth: int = 3,
+        fanout: int = 4,
+        files: int = 100,
+        modified_rate: float = 0.01,
+        users: int = 5,
+        seed: int = 0,
+        now: datetime = None,
+    ) -> None:
+        self.depth = depth
+        self.fanout = fanout
+        self.files = files
+        self.modified_rate = modified_rate
+        self.users = users
+        self.entities = {}
+        self.children = collections.defaultdict(list)
+        self.modified_ids = set()
+
+        now = now or datetime.utcnow()
+        self._recent = _timestamp(now - timedelta(hours=1))
+        self._old = _timestamp(now - timedelta(days=30))
+        self._rng = random.Random(seed)
+        self._ids = iter(range(1, 10**9))
+
+        self.root_id = self._add(None, "project", "Project", "Project")
+        containers = [(self.root_id, 0)]
+        while containers:
+            container_id, level = containers.pop()
+            for index in range(files):
+                self._add(container_id, f"file{index}.txt", "FileEntity", "file")
+            if level < depth:
+                for index in range(fanout):
+                    folder_id = self._add(container_id, f"folder{index}", "Folder")
+                    containers.append((folder_id, level + 1))
+        self.view_id = self._add(self.root_id, "view", "table.EntityView", "entityview")
+        self.entities[self.view_id]["scopeIds"] = [self.root_id.replace("syn", "")]
+        self.file_ids = [
+            syn_id
+            for syn_id, entity in self.entities.items()
+            if entity["type"] == "file"
+        ]
+        # Timestamps of the File View rows are only parsed once
+        self._epoch_ms = {
+            timestamp: _epoch_ms(timestamp) for timestamp in [self._recent, self._old]
+        }
+
+    def _add(
+        self, parent_id: str, name: str, concrete_type: str, entity_type: str = None
+    ) -> str:
+        """Add an entity, File entities are modified at random"""
+        syn_id = f"syn{next(self._ids)}"
+        modified_on = self._old
+        if entity_type == "file" and self._rng.random() < self.modified_rate:
+            modified_on = self._recent
+            self.modified_ids.add(syn_id)
+        self.entities[syn_id] = {
+            "id": syn_id,
+            "name": name,
+            "parentId": parent_id,
+            "concreteType": f"org.sagebionetworks.repo.model.{concrete_type}",
+            "type": entity_type or concrete_type.lower(),
+            "etag": f"etag-{syn_id}",
+            "versionNumber": 1,
+            "createdOn": self._old,
+            "modifiedOn": modified_on,
+            "modifiedBy": str(1000 + self._rng.randrange(self.users)),
+            "dataFileSizeBytes": 1024 if entity_type == "file" else 0,
+        }
+        if parent_id is not None:
+            self.children[parent_id].append(syn_id)
+        return syn_id
+
+    def header(self, syn_id: str) -> dict:
+        """Entity header of an entity, as returned by the children listing"""
+        entity = self.entities[syn_id]
+        return {
+            "id": syn_id,
+            "name": entity["name"],
+            "type": entity["concreteType"],
+            "versionNumber": entity["versionNumber"],
+            "createdOn": entity["createdOn"],
+            "modifiedOn": entity["modifiedOn"],
+            "modifiedBy": entity["modifiedBy"],
+        }
+
+    def view_row(self, syn_id: str, columns: typing.List[str]) -> list:
+        """Values of a File View row"""
+        entity = self.entities[syn_id]
+        values = []
+        for column in columns:
+            value = entity.get(VIEW_COLUMNS.get(column, column))
+            if column in ["createdOn", "modifiedOn"]:
+                value = self._epoch_ms[value]
+            values.append(value)
+        return values
+
+    def view_dataframe(self) -> pd.DataFrame:
+        """All rows of the File View, without making REST calls"""
+        columns = list(VIEW_COLUMNS)
+        return pd.DataFrame(
+            [self.view_row(syn_id, columns) for syn_id in self.file_ids],
+            columns=columns,
+        )
+
+
+class _QueryResult:
+    """Result of a fake table query, iterated as a rowset or as the typed
+    values of the rows of a CSV result, or read as a data frame
+    """
+
+    def __init__(
+        self,
+        columns: typing.List[str],
+        rows: typing.List[list],
+        row_ids: typing.List[int],
+        results_as: str,
+    ) -> None:
+        self.columns = columns
+        self.rows = rows
+        self.row_ids = row_ids
+        self.results_as = results_as
+
+    def __iter__(self) -> typing.Iterator[typing.Union[dict, list]]:
+        for row_id, row in zip(self.row_ids, self.rows):
+            if self.results_as == "rowset":
+                # Rowset values are strings
+                yield {
+                    "rowId": row_id,
+                    "values": [None if value is None else str(value) for value in row],
+                }
+            else:
+                # CSV rows are cast to the column types, DATE columns to
+                # UTC datetimes
+                yield [
+                    (
+                        from_unix_epoch_time(value)
+                        if column in DATE_COLUMNS and value is not None
+                        else value
+                    )
+                    for column, value in zip(self.columns, row)
+                ]
+
+    def asDataFrame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.rows, columns=self.columns)
+
+
+class FakeSynapse:
+    """In-process stand-in for a Synapse connection serving a synthetic
+    hierarchy.  The high level methods used by synapsemonitor are built on
+    restGET and restPOST like in the Synapse client, so that a
+    RequestGovernor can be installed on it.  Every REST call is counted per
+    endpoint, delayed by latency seconds and throttled with a 429 response
+    at a rate of throttle_rate.  A table query counts as a single call,
+    while the Synapse client makes several calls for an asynchronous job.
+
+    Args:
+        tree: Synthetic hierarchy served
+        latency: Seconds each REST call takes
+        throttle_rate: Fraction of REST calls throttled
+        seed: Seed of the random choice of throttled calls
+        sleep: Function sleeping a number of seconds
+    """
+
+    def __init__(
+        self,
+        tree: SyntheticTree,
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        seed: int = 0,
+        sleep: typing.Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.tree = tree
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = collections.Counter()
+        self.throttled = 0
+        self.messages = []
+        self._sleep = sleep
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _serve(self, method: str, uri: str) -> None:
+        """Count, delay and maybe throttle a REST call"""
+        endpoint = f"{method} " + re.sub(r"syn\d+|\d+", "{id}", uri.split("?")[0])
+        with self._lock:
+            self.calls[endpoint] += 1
+            throttled = self._rng.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+        if self.latency:
+            self._sleep(self.latency)
+        if throttled:
+            response = requests.Response()
+            response.status_code = 429
+            raise SynapseHTTPError(
+                "429 Client Error: Too Many Requests", response=response
+            )
+
+    def restGET(self, uri: str, **kwargs) -> dict:
+        self._serve("GET", uri)
+        match = re.fullmatch(r"/entity/(syn\d+)(/path)?", uri)
+        if match is not None:
+            if match.group(2) is None:
+                return dict(self.tree.entities[match.group(1)])
+            path = []
+            syn_id = match.group(1)
+            while syn_id is not None:
+                path.insert(
+                    0, {"id": syn_id, "name": self.tree.entities[syn_id]["name"]}
+                )
+                syn_id = self.tree.entities[syn_id]["parentId"]
+            return {"path": [{"id": ROOT_ID, "name": "root"}] + path}
+        match = re.fullmatch(r"/userProfile(?:/(\w+))?", uri)
+        if match is not None:
+            user = match.group(1) or OWNER_ID
+            owner_id = user if user.isdigit() else str(1000 + int(user[4:]))
+            return {"ownerId": owner_id, "userName": f"user{int(owner_id) - 1000}"}
+        raise ValueError(f"Unsupported fake GET {uri}")
+
+    def restPOST(self, uri: str, body: str = None, **kwargs) -> dict:
+        self._serve("POST", uri)
+        request = json.loads(body) if body else {}
+        if uri == "/entity/children":
+            return self._children_page(request)
+        if uri == "/entity/header":
+            return {
+                "results": [
+                    self.tree.header(reference["targetId"])
+                    for reference in request["references"]
+                    if reference["targetId"] in self.tree.entities
+                ]
+            }
+        if uri == "/message":
+            self.messages.append(request)
+            return {"id": str(len(self.messages))}
+        match = re.fullmatch(r"/entity/(syn\d+)/table/query", uri)
+        if match is not None:
+            return self._query(request["sql"])
+        raise ValueError(f"Unsupported fake POST {uri}")
+
+    def restPUT(self, uri: str, body: str = None, **kwargs) -> dict:
+        self._serve("PUT", uri)
+        raise ValueError(f"Unsupported fake PUT {uri}")
+
+    def restDELETE(self, uri: str, **kwargs) -> None:
+        self._serve("DELETE", uri)
+        raise ValueError(f"Unsupported fake DELETE {uri}")
+
+    def _children_page(self, request: dict) -> dict:
+        """Page of the children listing, newest first when requested"""
+        include_types = request.get("includeTypes", ["file", "folder"])
+        children = [
+            syn_id
+            for syn_id in self.tree.children.get(request["parentId"], [])
+            if self.tree.entities[syn_id]["type"] in include_types
+        ]
+        if request.get("sortDirection") == "DESC":
+            children.reverse()
+        offset = int(request.get("nextPageToken") or 0)
+        page = children[offset : offset + CHILDREN_PAGE_SIZE]
+        response = {"page": [self.tree.header(syn_id) for syn_id in page]}
+        if offset + CHILDREN_PAGE_SIZE < len(children):
+            response["nextPageToken"] = str(offset + CHILDREN_PAGE_SIZE)
+        if request.get("includeTotalChildCount"):
+            response["totalChildCount"] = len(children)
+        if request.get("includeSumFileSizes"):
+            response["sumFileSizesBytes"] = sum(
+                self.tree.entities[syn_id]["dataFileSizeBytes"] for syn_id in children
+            )
+        return response
+
+    def _query(self, sql: str) -> dict:
+        """Run a File View query.  Only the modifiedOn and ROW_ID conditions
+        of the where clause are applied, the ROW_ID of a row is the number
+        of its Synapse ID.
+        """
+        match = re.fullmatch(
+            r"select (?P<columns>.+?) from (?P<view>syn\d+)"
+            r"(?: where (?P<where>.+?))?(?: order by ROW_ID)?"
+            r"(?: limit (?P<limit>\d+))?",
+            sql,
+        )
+        if match is None:
+            raise ValueError(f"Unsupported fake query {sql}")
+        columns = [column.strip() for column in match.group("columns").split(",")]
+        after, last_row_id = -1, -1
+        where = match.group("where") or ""
+        since = re.search(r"modifiedOn >=? (\d+)", where)
+        if since is not None:
+            after = int(since.group(1)) - (1 if ">=" in since.group(0) else 0)
+        last = re.search(r"ROW_ID > (\d+)", where)
+        if last is not None:
+            last_row_id = int(last.group(1))
+        row_ids = [
+            int(syn_id[3:])
+            for syn_id in self.tree.file_ids
+            if int(syn_id[3:]) > last_row_id
+            and self.tree.view_row(syn_id, ["modifiedOn"])[0] > after
+        ]
+        if match.group("limit") is not None:
+            row_ids = row_ids[: int(match.group("limit"))]
+        return {
+            "headers": columns,
+            "rows": [self.tree.view_row(f"syn{row_id}", columns) for row_id in row_ids],
+            "rowIds": row_ids,
+        }
+
+    def getChildren(
+        self, parent: str, includeTypes: typing.List[str] = None, **kwargs
+    ) -> typing.Iterator[dict]:
+        request = {"parentId": parent, "includeTypes": includeTypes}
+        while True:
+            response = self.restPOST("/entity/children", body=json.dumps(request))
+            yield from response["page"]
+            if response.get("nextPageToken") is None:
+                return
+            request["nextPageToken"] = response["nextPageToken"]
+
+    def get(self, entity: str, downloadFile: bool = True, **kwargs) -> Entity:
+        return Entity.create(self.restGET(f"/entity/{entity}"))
+
+    def getUserProfile(self, id: str = None, **kwargs) -> dict:
+        return self.restGET("/userProfile" if id is None else f"/userProfile/{id}")
+
+    def sendMessage(
+        self,
+        userIds: list,
+        messageSubject: str,
+        messageBody: str,
+        contentType: str = "text/plain",
+    ) -> dict:
+        body = {
+            "recipients": userIds,
+            "subject": messageSubject,
+            "body": messageBody,
+            "contentType": contentType,
+        }
+        return self.restPOST("/message", body=json.dumps(body))
+
+    def tableQuery(self, query: str, resultsAs: str = "csv", **kwargs) -> _QueryResult:
+        view_id = re.search(r" from (syn\d+)", query).group(1)
+        response = self.restPOST(
+            f"/entity/{view_id}/table/query", body=json.dumps({"sql": query})
+        )
+        return _QueryResult(
+            response["headers"], response["rows"], response["rowIds"], resultsAs
+        )
@@ -0,0 +1,281 @@
+"""Monitoring strategies measured against a fake Synapse"""
+import time
+import tracemalloc
+import typing
+
+from synapsemonitor import actions, monitor
+from synapsemonitor.governor import RequestGovernor
+from synapsemonitor.snapshot import HierarchySnapshot
+
+from .fake_synapse import FakeSynapse, SyntheticTree
+
+# Threads of the concurrent strategies
+MAX_WORKERS = 8
+# Rows per page of the paged File View query
+PAGE_SIZE = 1000
+# Megabytes by which peak memory may grow regardless of the tolerance
+MEMORY_SLACK_MB = 1.0
+
+
+class Strategy:
+    """Benchmarked monitoring strategy.  The REST calls made by setup are
+    not measured.
+
+    Args:
+        name: Name of the strategy
+        run: Function of the fake Synapse connection, the synthetic tree
+             and the state returned by setup, returning the entities found
+        setup: Function of the fake Synapse connection and the synthetic
+               tree returning the state of run
+        finds_modified: Whether run returns the modified File entities
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: typing.Callable,
+        setup: typing.Callable = None,
+        finds_modified: bool = True,
+    ) -> None:
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda syn, tree: None)
+        self.finds_modified = finds_modified
+
+
+def _warm_snapshot(syn, tree):
+    snapshot = HierarchySnapshot(":memory:")
+    monitor._find_modified_entities_container(syn, tree.root_id, snapshot=snapshot)
+    return snapshot
+
+
+STRATEGIES = [
+    Strategy(
+        "traverse",
+        lambda syn, tree, state: monitor._traverse(syn, tree.root_id),
+        finds_modified=False,
+    ),
+    Strategy(
+        "walk",
+        lambda syn, tree, state: monitor._find_modified_entities_container(
+            syn, tree.root_id
+        ),
+    ),
+    Strategy(
+        "walk_concurrent",
+        lambda syn, tree, state: monitor._find_modified_entities_container(
+            syn, tree.root_id, max_workers=MAX_WORKERS
+        ),
+    ),
+    Strategy(
+        "snapshot_cold",
+        lambda syn, tree, state: monitor._find_modified_entities_container(
+            syn, tree.root_id, snapshot=state
+        ),
+        setup=lambda syn, tree: HierarchySnapshot(":memory:"),
+    ),
+    Strategy(
+        "snapshot_warm",
+        lambda syn, tree, state: monitor._find_modified_entities_container(
+            syn, tree.root_id, snapshot=state
+        ),
+        setup=_warm_snapshot,
+    ),
+    Strategy(
+        "fileview",
+        lambda syn, tree, state: monitor._find_modified_entities_fileview(
+            syn, tree.view_id
+        ),
+    ),
+    Strategy(
+        "fileview_paged",
+        lambda syn, tree, state: monitor._find_modified_entities_fileview(
+            syn, tree.view_id, page_size=PAGE_SIZE, max_workers=MAX_WORKERS
+        ),
+    ),
+    Strategy(
+        "render_fileview",
+        lambda syn, tree, state: monitor._render_fileview(
+            syn, state, max_workers=MAX_WORKERS
+        )["id"].tolist(),
+        setup=lambda syn, tree: tree.view_dataframe(),
+        finds_modified=False,
+    ),
+    Strategy(
+        "email",
+        lambda syn, tree, state: actions.EmailAction(syn, tree.root_id)._action(state),
+        setup=lambda syn, tree: monitor._find_modified_entities_container(
+            syn, tree.root_id
+        ),
+    ),
+]
+
+
+def _measure(
+    strategy: Strategy,
+    tree: SyntheticTree,
+    latency: float,
+    throttle_rate: float,
+    trace_memory: bool,
+) -> dict:
+    """Run a strategy once on a fresh fake Synapse connection"""
+    syn = FakeSynapse(tree, latency=latency, throttle_rate=throttle_rate)
+    governor = RequestGovernor(max_concurrency=MAX_WORKERS, base_delay=latency)
+    governor.install(syn)
+    state = strategy.setup(syn, tree)
+    syn.calls.clear()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        found = strategy.run(syn, tree, state)
+        wall_seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return {
+        "found": found,
+        "wall_seconds": wall_seconds,
+        "peak_memory_mb": None if peak is None else peak / 2**20,
+        "rest_calls": sum(syn.calls.values()),
+        "endpoints": dict(syn.calls),
+        "throttled": syn.throttled,
+    }
+
+
+def run_strategy(
+    strategy: Strategy,
+    tree: SyntheticTree,
+    latency: float = 0.0,
+    throttle_rate: float = 0.0,
+) -> dict:
+    """Measure a strategy.  Wall time and REST calls are measured with the
+    latency and throttling, peak memory in a second run without them, so
+    that tracing memory doesn't slow down the timed run.
+
+    Args:
+        strategy: Benchmarked strategy
+        tree: Synthetic hierarchy
+        latency: Seconds each REST call takes
+        throttle_rate: Fraction of REST calls throttled
+
+    Returns:
+        Dict with wall_seconds, rest_calls, endpoints (REST calls per
+        endpoint), throttled, peak_memory_mb, found (number of entities
+        found) and correct (whether exactly the modified File entities were
+        found, None if the strategy doesn't find them)
+    """
+    timed = _measure(strategy, tree, latency, throttle_rate, trace_memory=False)
+    traced = _measure(strategy, tree, 0.0, 0.0, trace_memory=True)
+    found = timed.pop("found")
+    timed["peak_memory_mb"] = traced["peak_memory_mb"]
+    timed["found"] = len(found)
+    timed["correct"] = (
+        set(found) == tree.modified_ids if strategy.finds_modified else None
+    )
+    return timed
+
+
+def run_suite(
+    scenario: dict,
+    latency: float = 0.0,
+    throttle_rate: float = 0.0,
+    strategies: typing.List[str] = None,
+) -> dict:
+    """Measure the strategies on a synthetic hierarchy
+
+    Args:
+        scenario: Keyword arguments of SyntheticTree
+        latency: Seconds each REST call takes
+        throttle_rate: Fraction of REST calls throttled
+        strategies: Names of the strategies measured, all if None
+
+    Returns:
+        Dict mapping each strategy name to its measures, see run_strategy
+    """
+    tree = SyntheticTree(**scenario)
+    return {
+        strategy.name: run_strategy(strategy, tree, latency, throttle_rate)
+        for strategy in STRATEGIES
+        if strategies is None or strategy.name in strategies
+    }
+
+
+def compare(
+    results: dict,
+    baseline: dict,
+    time_tolerance: float = None,
+    memory_tolerance: float = 0.5,
+) -> typing.List[str]:
+    """Compare measures to a baseline.  REST calls and found entities are
+    deterministic without throttling and must not change, wall time and
+    peak memory may grow by a fraction of the baseline.  Peak memory may
+    also grow by MEMORY_SLACK_MB, as small peaks vary between runs.
+
+    Args:
+        results: Measures of run_suite
+        baseline: Measures of run_suite on the same scenario
+        time_tolerance: Fraction by which wall time may grow, not compared
+                        if None
+        memory_tolerance: Fraction by which peak memory may grow, not
+                          compared if None
+
+    Returns:
+        Descriptions of the regressions
+    """
+    regressions = []
+    for name, measures in results.items():
+        if measures["correct"] is False:
+            regressions.append(f"{name}: found {measures['found']} wrong entities")
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if measures["rest_calls"] > expected["rest_calls"]:
+            regressions.append(
+                f"{name}: {measures['rest_calls']} REST calls, "
+                f"baseline {expected['rest_calls']}"
+            )
+        if measures["found"] != expected["found"]:
+            regressions.append(
+                f"{name}: found {measures['found']} entities, "
+                f"baseline {expected['found']}"
+            )
+        limits = [
+            ("wall_seconds", time_tolerance, 0, "s"),
+            ("peak_memory_mb", memory_tolerance, MEMORY_SLACK_MB, " MB"),
+        ]
+        for measure, tolerance, slack, unit in limits:
+            if tolerance is None:
+                continue
+            if measures[measure] > expected[measure] * (1 + tolerance) + slack:
+                regressions.append(
+                    f"{name}: {measure} {measures[measure]:.3f}{unit}, "
+                    f"baseline {expected[measure]:.3f}{unit}"
+                )
+    return regressions
+
+
+def format_results(results: dict) -> str:
+    """Format measures as a table"""
+    rows = [["strategy", "wall_s", "rest_calls", "throttled", "peak_mb", "found"]]
+    for name, measures in results.items():
+        found = str(measures["found"])
+        if measures["correct"] is False:
+            found += " (wrong)"
+        rows.append(
+            [
+                name,
+                f"{measures['wall_seconds']:.3f}",
+                str(measures["rest_calls"]),
+                str(measures["throttled"]),
+                f"{measures['peak_memory_mb']:.2f}",
+                found,
+            ]
+        )
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    lines = [
+        "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        for row in rows
+    ]
+    return "\n".join(lines) + "\n"
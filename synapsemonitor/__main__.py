@@ -1,49 +1,294 @@
 #!/usr/bin/env python
 """Command line client"""
 import argparse
+from datetime import datetime, timedelta
 import logging
 import json
 import os
 import sys
+import typing
 
-import pandas as pd
-import synapseclient
-from synapseclient.core.exceptions import (
-    SynapseAuthenticationError,
-    SynapseNoCredentialsError,
+# Modules importing synapseclient are only imported by the commands, so
+# that the command line is parsed, and --help printed, without loading it
+from . import planner, sinks
+from .snapshot import HierarchySnapshot
+from .state import (
+    FeedCache,
+    NotificationStore,
+    TraversalCheckpoint,
+    ViewRegistry,
+    WatermarkStore,
 )
 
-from . import actions, monitor
+if typing.TYPE_CHECKING:
+    from . import monitor
+
+
+def _read_targets(args) -> list:
+    """Read the monitored entities from the command line and targets file
+
+    Args:
+        args: Parsed monitor command line arguments
+
+    Returns:
+        List of targets, dicts with synapse_id, users and email_subject
+    """
+    targets = [{"synapse_id": synapse_id} for synapse_id in args.synapse_id]
+    if args.targets:
+        with open(args.targets) as targets_file:
+            targets.extend(json.load(targets_file))
+    if not targets:
+        raise ValueError("Specify at least one synapse_id or a --targets file")
+    for target in targets:
+        target.setdefault("users", args.users)
+        target.setdefault("email_subject", args.email_subject)
+    return targets
+
+
+def _traversal_rules(args) -> "monitor.TraversalRules":
+    """Traversal rules of the command line arguments, None if not used"""
+    from . import monitor
+
+    if args.max_depth is None and not args.include and not args.exclude:
+        return None
+    return monitor.TraversalRules(
+        max_depth=args.max_depth, include=args.include, exclude=args.exclude
+    )
+
+
+def _hierarchy_snapshot(args) -> HierarchySnapshot:
+    """Hierarchy snapshot of the command line arguments, None if not used"""
+    from . import monitor
+
+    if not args.snapshot:
+        return None
+    snapshot = HierarchySnapshot(
+        args.snapshot, max_age=timedelta(hours=args.snapshot_max_age)
+    )
+    # Listings are reused at most until the changes they hide would leave
+    # the {value} {unit} window of the next run
+    snapshot.fit_window(
+        datetime.utcnow() - monitor._get_modified_cutoff(args.value, args.unit)
+    )
+    return snapshot
+
+
+def _view_registry(args) -> ViewRegistry:
+    """File View registry of the command line arguments, None if not used"""
+    if args.views is None:
+        return None
+    return ViewRegistry(args.views, min_entities=args.view_threshold)
+
+
+def _view_query(args, columns: list = None) -> "monitor.ViewQuery":
+    """File View query of the command line arguments, None if not used"""
+    from . import monitor
+
+    if not args.filter and not columns:
+        return None
+    return monitor.ViewQuery(
+        columns=columns,
+        filters=[
+            monitor.ViewQuery.parse_filter(expression) for expression in args.filter
+        ],
+    )
 
 
 def monitor_cli(syn, args):
     """Monitor cli"""
+    from . import actions, monitor
+    from .metrics import RunMetrics
+
+    targets = _read_targets(args)
+    snapshot = _hierarchy_snapshot(args)
+    watermarks = (
+        WatermarkStore(args.watermark, lag=timedelta(minutes=args.watermark_lag))
+        if args.watermark
+        else None
+    )
+    notifications = (
+        NotificationStore(args.notifications) if args.notifications else None
+    )
+    rules = _traversal_rules(args)
+    views = _view_registry(args)
+    # Output columns are selected from File Views with the filters
+    query = _view_query(args, (args.columns or []) + (args.view_columns or []))
+    if args.resume and not args.checkpoint:
+        raise ValueError("--resume requires a --checkpoint file")
+    metrics = RunMetrics(args.metrics, governor=args.governor)
+    checkpoint = (
+        TraversalCheckpoint(
+            args.checkpoint, resume=args.resume, interval=args.checkpoint_interval
+        )
+        if args.checkpoint
+        else None
+    )
+    try:
+        syn_ids = [target["synapse_id"] for target in targets]
+        plans, planning_calls = monitor.plan_targets(
+            syn=syn,
+            syn_ids=syn_ids,
+            snapshot=snapshot,
+            page_size=args.page_size,
+            rules=rules,
+            views=views,
+            estimate=args.explain,
+        )
+        if args.explain:
+            sys.stdout.write(planner.format_plans(list(plans.values()), planning_calls))
+            return
+        # Modified entities are output as soon as they are found, entities in
+        # overlapping targets are only output once
+        modified_entities = {target["synapse_id"]: [] for target in targets}
+        with sinks.open_sink(
+            output=args.output,
+            output_format=args.format,
+            columns=args.columns,
+            view_columns=args.view_columns,
+        ) as sink:
+            found = monitor.iter_modified_entities_targets(
+                syn=syn,
+                syn_ids=syn_ids,
+                value=args.value,
+                unit=args.unit,
+                max_workers=args.max_workers,
+                snapshot=snapshot,
+                watermarks=watermarks,
+                page_size=args.page_size,
+                rules=rules,
+                views=views,
+                plans=plans,
+                checkpoint=checkpoint,
+                query=query,
+                metrics=metrics,
+            )
+            for syn_id, entity in found:
+                modified_entities[syn_id].append(entity)
+                # Entities already notified aren't output again
+                if notifications is None or notifications.filter(syn_id, [entity]):
+                    sink.write(entity)
+    except BaseException:
+        # The failed monitored entities are exported
+        metrics.save()
+        raise
+    finally:
+        # Traversals interrupted by an error are resumed from their last state
+        if checkpoint is not None:
+            checkpoint.save()
+        if snapshot is not None:
+            snapshot.close()
+
+    # Recipients shared by several targets are resolved once
+    user_ids = {}
+    try:
+        for target in targets:
+            syn_id = target["synapse_id"]
+            pipeline = actions.ActionPipeline(
+                syn=syn,
+                syn_id=syn_id,
+                watermarks=watermarks,
+                notifications=notifications,
+                views=views,
+            )
+            email = pipeline.register(
+                actions.EmailAction(
+                    syn=syn,
+                    syn_id=syn_id,
+                    email_subject=target["email_subject"],
+                    users=target["users"],
+                    user_ids=user_ids,
+                )
+            )
+            with metrics.measure([syn_id]):
+                pipeline.run(modified_entities=modified_entities[syn_id])
+            metrics.record(
+                syn_id,
+                modified=len(modified_entities[syn_id]),
+                notifications=email.messages_sent,
+            )
+    finally:
+        metrics.save()
+
+
+def watch_cli(syn, args):
+    """Watch cli"""
+    from . import watch
+    from .metrics import RunMetrics
 
-    email_action = actions.EmailAction(
+    targets = _read_targets(args)
+    for target in targets:
+        target.setdefault("interval", args.interval)
+    # Watermarks and notifications are kept in memory between polls when
+    # they aren't persisted, the snapshot is only used with --snapshot
+    snapshot = _hierarchy_snapshot(args)
+    watermarks = WatermarkStore(
+        args.watermark, lag=timedelta(minutes=args.watermark_lag)
+    )
+    notifications = NotificationStore(args.notifications)
+    watcher = watch.Watcher(
         syn=syn,
-        syn_id=args.synapse_id,
-        email_subject=args.email_subject,
-        users=args.users,
+        targets=targets,
         value=args.value,
         unit=args.unit,
+        max_workers=args.max_workers,
+        snapshot=snapshot,
+        watermarks=watermarks,
+        page_size=args.page_size,
+        notifications=notifications,
+        rules=_traversal_rules(args),
+        views=_view_registry(args),
+        query=_view_query(args),
+        metrics=RunMetrics(args.metrics, governor=args.governor),
     )
-    action_results = actions.synapse_action(action_cls=email_action)
-    ids = pd.DataFrame({"syn_id": action_results})
-    if args.output:
-        pd.DataFrame(ids).to_csv(args.output, index=False, header=False)
-    else:
-        sys.stdout.write(pd.DataFrame(ids).to_csv(index=False, header=False))
+    try:
+        watcher.run()
+    finally:
+        if snapshot is not None:
+            snapshot.close()
 
 
 def create_file_view_cli(syn, args):
     """Create file view cli"""
+    from . import monitor
+
     fileview = monitor.create_file_view(
-        syn, name=args.name, project_id=args.project_id, scope_ids=args.scope_ids
+        syn,
+        name=args.name,
+        project_id=args.project_id,
+        scope_ids=args.scope_ids,
+        annotation_columns=args.annotation_columns,
     )
 
     logging.info(f"Synapse ID of new file view = {fileview['id']}")
 
 
+def feed_cli(syn, args):
+    """Activity feed cli"""
+    import dateutil.parser
+
+    from . import feed
+
+    cache = FeedCache(args.cache)
+    summaries = feed.update_feed(
+        syn,
+        project_id=args.project_id,
+        cache=cache,
+        interval=args.interval,
+        earliest=dateutil.parser.parse(args.earliest),
+        view_id=args.view,
+        max_workers=args.max_workers,
+    )
+    cache.save()
+    markdown = feed.format_feed(summaries, interval=args.interval)
+    if args.output == "-":
+        sys.stdout.write(markdown)
+    elif args.output is not None:
+        with open(args.output, "w") as output_file:
+            output_file.write(markdown)
+    elif feed.update_wiki(syn, args.project_id, markdown, wiki_id=args.wiki):
+        logging.info(f"Updated the activity feed of {args.project_id}")
+
+
 def build_parser():
     """Set up argument parser and returns"""
     parser = argparse.ArgumentParser(
@@ -58,8 +303,7 @@ def build_parser():
         "--synapse_config",
         metavar="file",
         type=str,
-        default=synapseclient.client.CONFIG_FILE,
-        help="Synapse config file with user credentials: (default %(default)s)",
+        help="Synapse config file with user credentials: " "(default ~/.synapseConfig)",
     )
     parser.add_argument(
         "--log",
@@ -69,40 +313,69 @@ def build_parser():
         default="error",
         help="Set logging output level " "(default: %(default)s)",
     )
+    parser.add_argument(
+        "--rate",
+        "-r",
+        metavar="rate",
+        type=float,
+        help="Maximum number of Synapse REST calls per second. Concurrent calls "
+        "are halved when Synapse throttles requests and throttled calls are "
+        "retried with backoff. (default: no limit)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Profile the Synapse REST calls per endpoint: number of calls, "
+        "errors, latency and bytes. At exit, prints a table to stderr. "
+        "(default: no profiling)",
+    )
+    parser.add_argument(
+        "--stats_file",
+        metavar="file",
+        type=str,
+        help="Profile the Synapse REST calls per endpoint like --stats and "
+        "write them to this JSON file at exit. (default: None)",
+    )
 
     subparsers = parser.add_subparsers(
         title="commands",
         description="The following commands are available:",
         help='For additional help: "synapsemonitor <COMMAND> -h"',
     )
-    parser_monitor = subparsers.add_parser(
-        "monitor", help="Find new or modified File entities."
-    )
-    parser_monitor.add_argument(
+    # Options shared by the monitor and watch commands
+    monitor_options = argparse.ArgumentParser(add_help=False)
+    monitor_options.add_argument(
         "synapse_id",
         metavar="synapse_id",
         type=str,
-        help="Synapse ID of entity to be monitored.",
+        nargs="*",
+        help="Synapse IDs of entities to be monitored. Folders and Projects "
+        "nested in other monitored Folders or Projects are only traversed once.",
     )
-    parser_monitor.add_argument(
+    monitor_options.add_argument(
+        "--targets",
+        metavar="file",
+        type=str,
+        help="JSON file listing entities to be monitored, in addition to "
+        "synapse_id: "
+        '[{"synapse_id": ..., "users": [...], "email_subject": ...}]. '
+        "users and email_subject default to --users and --email_subject. "
+        "(default: None)",
+    )
+    monitor_options.add_argument(
         "--users",
         "-u",
         nargs="+",
         help="User Id or username of individuals to send report. "
         "If not specified, defaults to logged in Synapse user.",
     )
-    parser_monitor.add_argument(
-        "--output",
-        "-o",
-        help="Output modified entities into this csv file. (default: None)",
-    )
-    parser_monitor.add_argument(
+    monitor_options.add_argument(
         "--email_subject",
         "-e",
         default="New Synapse Files",
         help="Sets the subject heading of the email sent out. (default: %(default)s)",
     )
-    parser_monitor.add_argument(
+    monitor_options.add_argument(
         "--value",
         "-v",
         metavar="value",
@@ -111,18 +384,240 @@ def build_parser():
         help="Find modifications to File entities in the last {value} {unit}. "
         "(default: %(default)s)",
     )
-    parser_monitor.add_argument(
+    monitor_options.add_argument(
         "--unit",
         "-t",
         metavar="unit",
         type=str,
-        choices=["day", "hour"],
+        choices=["day", "hour", "minute"],
         default="day",
         help="Find modifications to File entities in the last {value} {unit}. "
         "(default: '%(default)s')",
     )
+    monitor_options.add_argument(
+        "--max_workers",
+        "-w",
+        metavar="workers",
+        type=int,
+        default=1,
+        help="Number of threads used to list Folders concurrently. Above 1, the "
+        "next File View page is queried while the current one is read. "
+        "(default: %(default)s)",
+    )
+    monitor_options.add_argument(
+        "--snapshot",
+        "-s",
+        metavar="file",
+        type=str,
+        help="Local hierarchy snapshot (SQLite) of the monitored Project or "
+        "Folder. Created if it doesn't exist. Later runs only list the Folders "
+        "whose children changed. (default: None)",
+    )
+    monitor_options.add_argument(
+        "--snapshot_max_age",
+        metavar="hours",
+        type=float,
+        default=24,
+        help="Folders listed in the --snapshot longer ago than this are listed "
+        "again. Changes that keep the number of children and their file "
+        "sizes, ie. renamed, annotated or same-size replaced entities, are only "
+        "found then unless they are among the newest children of their Folder, "
+        "so it is lowered to the {value} {unit} window minus the time since "
+        "the snapshot was last used, or since the last poll of watch. "
+        "(default: %(default)s)",
+    )
+    monitor_options.add_argument(
+        "--watermark",
+        metavar="file",
+        type=str,
+        help="File storing the latest modifiedOn reported for each monitored "
+        "File View. Only File entities modified since the last run are "
+        "reported and {value} {unit} is only used on the first run. "
+        "(default: None)",
+    )
+    monitor_options.add_argument(
+        "--watermark_lag",
+        metavar="minutes",
+        type=float,
+        default=10,
+        help="File Views index changes asynchronously, so changes made this "
+        "long before the --watermark are queried again to find the ones "
+        "indexed late. Changes already reported aren't reported again. "
+        "(default: %(default)s)",
+    )
+    monitor_options.add_argument(
+        "--max_depth",
+        metavar="depth",
+        type=int,
+        help="Only traverse Folders and Projects this many levels deep. The "
+        "children of a monitored entity are at depth 1. (default: no limit)",
+    )
+    monitor_options.add_argument(
+        "--include",
+        metavar="pattern",
+        nargs="+",
+        help="Only report entities whose name or path from the monitored "
+        "Folder or Project matches one of these glob patterns, ie. '*.bam'. "
+        "(default: None)",
+    )
+    monitor_options.add_argument(
+        "--exclude",
+        metavar="pattern",
+        nargs="+",
+        help="Skip entities whose name or path from the monitored Folder or "
+        "Project matches one of these glob patterns, ie. 'raw/*'. Matching "
+        "Folders are not listed. (default: None)",
+    )
+    monitor_options.add_argument(
+        "--views",
+        metavar="file",
+        type=str,
+        help="File registering the File Views that monitor big Folders and "
+        "Projects. A Folder or Project estimated to hold more than "
+        "--view_threshold entities is monitored with a File View of its "
+        "Project scoped to it, which is created if there is none, instead of "
+        "being traversed. The estimates of smaller ones are stored for a week. "
+        "Not used with --max_depth, --include or --exclude. "
+        "(default: None)",
+    )
+    monitor_options.add_argument(
+        "--view_threshold",
+        metavar="entities",
+        type=int,
+        default=10000,
+        help="Estimated number of entities from which a Folder or Project is "
+        "monitored with a File View when --views is set. "
+        "(default: %(default)s)",
+    )
+    monitor_options.add_argument(
+        "--notifications",
+        "-n",
+        metavar="file",
+        type=str,
+        help="File storing the changes already reported for each monitored "
+        "entity, so that a change staying in the {value} {unit} window of "
+        "several runs is only reported once. Changes are forgotten after 30 "
+        "days. (default: None)",
+    )
+    monitor_options.add_argument(
+        "--metrics",
+        metavar="file",
+        type=str,
+        help="Prometheus textfile, ie. /var/lib/node_exporter/synapsemonitor.prom, "
+        "exporting the duration, visited entities, modified entities, REST "
+        "calls, retries and notifications of each monitored entity. It is "
+        "written atomically at the end of a run, or after each poll when "
+        "watching. (default: None)",
+    )
+    monitor_options.add_argument(
+        "--filter",
+        metavar="expression",
+        nargs="+",
+        default=[],
+        help="Only report entities matching all these filters, ie. "
+        "'fileFormat=bam', 'name~%%.bam' or 'versionNumber>1'. Operators are "
+        "=, !=, <, <=, >, >= and ~ (SQL LIKE). Filters are added to the SQL "
+        "query of File Views, whose missing annotation columns are added. "
+        "Folders and Projects can only be filtered on annotations when they are "
+        "monitored with a File View, ie. registered in --views or estimated "
+        "over --view_threshold entities, and are otherwise only filtered on "
+        "entity fields: id, name, type, versionNumber, createdBy, modifiedBy. "
+        "Check the strategy with --explain. (default: None)",
+    )
+    monitor_options.add_argument(
+        "--page_size",
+        metavar="rows",
+        type=int,
+        help="Query File Views in pages of this many rows instead of loading "
+        "all results at once. (default: None)",
+    )
+
+    parser_monitor = subparsers.add_parser(
+        "monitor",
+        parents=[monitor_options],
+        help="Find new or modified File entities.",
+    )
+    parser_monitor.add_argument(
+        "--output",
+        "-o",
+        help="Output modified entities into this file instead of the standard "
+        "output. Entities are written as each monitored entity is processed. "
+        "(default: None)",
+    )
+    parser_monitor.add_argument(
+        "--format",
+        "-f",
+        type=str,
+        choices=sinks.OUTPUT_FORMATS,
+        default="csv",
+        help="Output format. parquet requires pyarrow and an --output file. "
+        "(default: %(default)s)",
+    )
+    parser_monitor.add_argument(
+        "--columns",
+        nargs="+",
+        choices=list(sinks.METADATA_COLUMNS),
+        help="Metadata columns output after the Synapse ID, when known. A CSV "
+        "header is written when columns are output. (default: None)",
+    )
+    parser_monitor.add_argument(
+        "--view_columns",
+        metavar="column",
+        nargs="+",
+        help="File View columns output after the --columns, ie. annotations. "
+        "They are selected by the SQL query of File Views and missing "
+        "annotation columns are added to the File View. Empty for Folders and "
+        "Projects that are traversed. (default: None)",
+    )
+    parser_monitor.add_argument(
+        "--explain",
+        action="store_true",
+        help="Print the strategy chosen for each monitored entity and the "
+        "estimated number of REST calls, without monitoring. Folders and "
+        "Projects are probed to estimate their size.",
+    )
+    parser_monitor.add_argument(
+        "--checkpoint",
+        metavar="file",
+        type=str,
+        help="File where the Folders left to list and the entities found by "
+        "Folder and Project traversals are saved at intervals, and when the "
+        "run fails. Completed traversals are removed from it. (default: None)",
+    )
+    parser_monitor.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the traversals saved in the --checkpoint file instead of "
+        "starting them again. Folders already listed are not listed again. Use "
+        "the same options as the interrupted run.",
+    )
+    parser_monitor.add_argument(
+        "--checkpoint_interval",
+        metavar="seconds",
+        type=float,
+        default=60,
+        help="Minimum number of seconds between two saves of the --checkpoint "
+        "file. (default: %(default)s)",
+    )
     parser_monitor.set_defaults(func=monitor_cli)
 
+    parser_watch = subparsers.add_parser(
+        "watch",
+        parents=[monitor_options],
+        help="Keep monitoring entities, polling each of them on its own "
+        "interval with a single Synapse session.",
+    )
+    parser_watch.add_argument(
+        "--interval",
+        "-i",
+        metavar="minutes",
+        type=float,
+        default=5,
+        help="Minutes between two polls of a monitored entity. A targets file "
+        'can set an "interval" per entity. (default: %(default)s)',
+    )
+    parser_watch.set_defaults(func=watch_cli)
+
     parser_create_view = subparsers.add_parser(
         "create",
         help="Creates a File View that will list all the File entities under "
@@ -140,12 +635,81 @@ def build_parser():
     parser_create_view.add_argument(
         "--scope_ids", nargs="+", required=True, help="Synapse Folder / Project Ids"
     )
+    parser_create_view.add_argument(
+        "--annotation_columns",
+        action="store_true",
+        help="Add a column for each annotation of the scoped File entities. "
+        "Otherwise annotation columns are added when monitoring uses them.",
+    )
     parser_create_view.set_defaults(func=create_file_view_cli)
 
+    parser_feed = subparsers.add_parser(
+        "feed",
+        help="Write the File entities added or updated in a Project each week "
+        "or month to a wiki page. Interval summaries are cached, so that only "
+        "the current interval is queried again.",
+    )
+    parser_feed.add_argument("project_id", help="Synapse Project Id")
+    parser_feed.add_argument(
+        "--wiki",
+        metavar="wikiId",
+        type=str,
+        help="Id of the sub-page of the Project wiki where the feed is "
+        "written. (default: root page of the Project wiki)",
+    )
+    parser_feed.add_argument(
+        "--interval",
+        "-i",
+        type=str,
+        choices=["week", "month"],
+        default="week",
+        help="Divide changes into week or month long intervals. "
+        "(default: %(default)s)",
+    )
+    parser_feed.add_argument(
+        "--earliest",
+        metavar="date",
+        type=str,
+        default="1-Jan-2014",
+        help="Start date of the feed. (default: %(default)s)",
+    )
+    parser_feed.add_argument(
+        "--cache",
+        metavar="file",
+        type=str,
+        help="File storing the summary of each interval and the File View of "
+        "the Project. Intervals that ended before they were cached are not "
+        "queried again. (default: None, every interval is queried)",
+    )
+    parser_feed.add_argument(
+        "--view",
+        metavar="synapse_id",
+        type=str,
+        help="File View scoped to the Project to query. (default: a File View "
+        "of the Project scoped to it, which is created if there is none)",
+    )
+    parser_feed.add_argument(
+        "--max_workers",
+        "-w",
+        metavar="workers",
+        type=int,
+        default=1,
+        help="Number of intervals queried concurrently. (default: %(default)s)",
+    )
+    parser_feed.add_argument(
+        "--output",
+        "-o",
+        metavar="file",
+        type=str,
+        help="Write the markdown into this file, or the standard output if -, "
+        "instead of the wiki. (default: None)",
+    )
+    parser_feed.set_defaults(func=feed_cli)
+
     return parser
 
 
-def synapse_login(synapse_config=synapseclient.client.CONFIG_FILE):
+def synapse_login(synapse_config=None):
     """Login to Synapse.  Looks first for secrets.
 
     Args:
@@ -155,8 +719,17 @@ def synapse_login(synapse_config=synapseclient.client.CONFIG_FILE):
     Returns:
         Synapse connection
     """
+    import synapseclient
+    from synapseclient.core.exceptions import (
+        SynapseAuthenticationError,
+        SynapseNoCredentialsError,
+    )
+
     try:
-        syn = synapseclient.Synapse(skip_checks=True, configPath=synapse_config)
+        syn = synapseclient.Synapse(
+            skip_checks=True,
+            configPath=synapse_config or synapseclient.client.CONFIG_FILE,
+        )
         if os.getenv("SCHEDULED_JOB_SECRETS") is not None:
             secrets = json.loads(os.getenv("SCHEDULED_JOB_SECRETS"))
             syn.login(silent=True, authToken=secrets["SYNAPSE_AUTH_TOKEN"])
@@ -175,14 +748,32 @@ def main():
     parser = build_parser()
     args = parser.parse_args()
 
+    from .governor import RequestGovernor
+    from .stats import RestStats
+
     numeric_level = getattr(logging, args.log.upper(), None)
     if not isinstance(numeric_level, int):
         raise ValueError("Invalid log level: %s" % args.log)
     logging.basicConfig(level=numeric_level)
 
     syn = synapse_login(synapse_config=args.synapse_config)
+    governor = RequestGovernor(
+        rate=args.rate, max_concurrency=max(getattr(args, "max_workers", 1), 1)
+    )
+    governor.install(syn)
+    # Commands exporting metrics read the REST calls counted by the governor
+    args.governor = governor
+    stats = RestStats() if args.stats or args.stats_file else None
+    if stats is not None:
+        stats.install(syn)
 
-    args.func(syn, args)
+    try:
+        args.func(syn, args)
+    finally:
+        if args.stats:
+            sys.stderr.write(stats.format_table())
+        if args.stats_file:
+            stats.save(args.stats_file)
 
 
 if __name__ == "__main__":
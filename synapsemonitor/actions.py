@@ -1,9 +1,23 @@
 from abc import ABC, abstractmethod
-from typing import Type
+from concurrent.futures import ThreadPoolExecutor
+import html
+from typing import List, Type
 
 from synapseclient import Synapse
 
 from . import monitor
+from .snapshot import HierarchySnapshot
+from .state import NotificationStore, ViewRegistry, WatermarkStore
+
+
+def _view_ids(syn_id: str, views: ViewRegistry = None) -> List[str]:
+    """File Views whose watermarks move with a monitored entity: the entity
+    itself when it is a File View, and the File View registered for it
+    """
+    view_ids = [syn_id]
+    if views is not None and views.get(syn_id) is not None:
+        view_ids.append(views.get(syn_id))
+    return view_ids
 
 
 class SynapseAction(ABC):
@@ -16,30 +30,79 @@ class SynapseAction(ABC):
         value: int = 1,
         unit: str = "day",
         verbose: bool = False,
+        max_workers: int = 1,
+        snapshot: HierarchySnapshot = None,
+        watermarks: WatermarkStore = None,
+        page_size: int = None,
+        notifications: NotificationStore = None,
+        rules: monitor.TraversalRules = None,
+        views: ViewRegistry = None,
+        query: monitor.ViewQuery = None,
     ) -> None:
         self.syn = syn
         self.syn_id = syn_id
         self.value = value
         self.unit = unit
         self.verbose = verbose
+        self.max_workers = max_workers
+        self.snapshot = snapshot
+        self.watermarks = watermarks
+        self.page_size = page_size
+        self.notifications = notifications
+        self.rules = rules
+        self.views = views
+        self.query = query
 
     @abstractmethod
     def _action(self, modified_entities: list) -> None:
         pass
 
-    def action(self):
-        """Do action on list modified entities"""
-        modified_entities = monitor.find_modified_entities(
-            syn=self.syn, syn_id=self.syn_id, value=self.value, unit=self.unit
-        )
+    def action(self, modified_entities: list = None):
+        """Do action on list modified entities
+
+        Args:
+            modified_entities: Modified entities of syn_id when they were
+                               already found, for instance together with
+                               other monitored entities.
+        """
+        if modified_entities is None:
+            modified_entities = monitor.find_modified_entities(
+                syn=self.syn,
+                syn_id=self.syn_id,
+                value=self.value,
+                unit=self.unit,
+                max_workers=self.max_workers,
+                snapshot=self.snapshot,
+                watermarks=self.watermarks,
+                page_size=self.page_size,
+                rules=self.rules,
+                views=self.views,
+                query=self.query,
+            )
+        if self.notifications is not None:
+            modified_entities = self.notifications.filter(
+                self.syn_id, modified_entities
+            )
         action_result = self._action(modified_entities)
+        # Only move the watermarks once the action succeeded
+        if self.watermarks is not None:
+            self.watermarks.save(_view_ids(self.syn_id, self.views))
+        if self.notifications is not None:
+            self.notifications.mark(self.syn_id, modified_entities)
+            self.notifications.save()
         if self.verbose:
             print(action_result)
         return action_result
 
 
 class EmailAction(SynapseAction):
-    """This action emails specified users with modified entities"""
+    """This action emails specified users with modified entities.  Modified
+    entities are grouped by parent folder and digests longer than
+    max_message_length characters are split into several messages.
+
+    Attributes:
+        messages_sent: Number of messages sent by the action
+    """
 
     def __init__(
         self,
@@ -50,38 +113,246 @@ class EmailAction(SynapseAction):
         verbose: bool = False,
         users: list = None,
         email_subject: str = "New Synapse Files",
+        max_workers: int = 1,
+        snapshot: HierarchySnapshot = None,
+        watermarks: WatermarkStore = None,
+        page_size: int = None,
+        max_message_length: int = 100000,
+        notifications: NotificationStore = None,
+        rules: monitor.TraversalRules = None,
+        views: ViewRegistry = None,
+        query: monitor.ViewQuery = None,
+        user_ids: dict = None,
     ):
         self.users = users
         self.email_subject = email_subject
+        self.max_message_length = max_message_length
+        # Resolved recipients can be shared by the actions of a run
+        self._resolved_users = user_ids if user_ids is not None else {}
+        self._user_ids = None
+        self.messages_sent = 0
         super().__init__(
-            syn=syn, syn_id=syn_id, value=value, unit=unit, verbose=verbose
+            syn=syn,
+            syn_id=syn_id,
+            value=value,
+            unit=unit,
+            verbose=verbose,
+            max_workers=max_workers,
+            snapshot=snapshot,
+            watermarks=watermarks,
+            page_size=page_size,
+            notifications=notifications,
+            rules=rules,
+            views=views,
+            query=query,
         )
 
+    def _get_user_ids(self) -> list:
+        """Resolve the recipients once per action"""
+        if self._user_ids is None:
+            self._user_ids = monitor._get_user_ids(
+                self.syn, self.users, user_ids=self._resolved_users
+            )
+        return self._user_ids
+
     def _action(self, modified_entities: list) -> list:
         # get user ids
-        user_ids = monitor._get_user_ids(self.syn, self.users)
-
-        # TODO: Add function to beautify email message
+        user_ids = self._get_user_ids()
 
-        # Prepare and send Message
-        if modified_entities:
+        # Prepare and send Messages, each to all recipients at once
+        messages = _format_digest(modified_entities, self.max_message_length)
+        for number, message in enumerate(messages, start=1):
+            email_subject = self.email_subject
+            if len(messages) > 1:
+                email_subject = f"{email_subject} ({number}/{len(messages)})"
             self.syn.sendMessage(
                 user_ids,
-                self.email_subject,
-                ", ".join(modified_entities),
+                email_subject,
+                message,
                 contentType="text/html",
             )
+            self.messages_sent += 1
         return modified_entities
 
 
-def synapse_action(action_cls: Type[SynapseAction]):
+def _format_entity_link(syn_id: str, name: str = None) -> str:
+    """Format a html link to a Synapse entity"""
+    link = f'<a href="https://www.synapse.org/#!Synapse:{syn_id}">{syn_id}</a>'
+    if name:
+        return f"{html.escape(name)} ({link})"
+    return link
+
+
+def _format_digest(modified_entities: list, max_message_length: int = 100000) -> list:
+    """Format modified entities as html messages listing them by parent
+    folder.  A message is only longer than max_message_length when a single
+    entity doesn't fit in it.
+
+    Args:
+        modified_entities: Synapse ids, or monitor.ModifiedEntity
+        max_message_length: Maximum number of characters of a message
+
+    Returns:
+        List of html messages
+    """
+    groups = {}
+    for entity in modified_entities:
+        groups.setdefault(getattr(entity, "parent_id", None), []).append(entity)
+
+    messages = []
+    message = ""
+    for parent_id, entities in groups.items():
+        opening = "<ul>"
+        if parent_id is not None:
+            opening = f"<p>In {_format_entity_link(parent_id)}:</p><ul>"
+        group = opening
+        for entity in entities:
+            item = (
+                f"<li>{_format_entity_link(entity, getattr(entity, 'name', None))}</li>"
+            )
+            too_long = (
+                len(message) + len(group) + len(item) + len("</ul>")
+                > max_message_length
+            )
+            if too_long and (message or group != opening):
+                # Send what fits and continue the group in the next message
+                if group != opening:
+                    message += group + "</ul>"
+                messages.append(message)
+                message = ""
+                group = opening
+            group += item
+        message += group + "</ul>"
+    if message:
+        messages.append(message)
+    return messages
+
+
+class ActionPipeline:
+    """Finds the modified entities of a monitored entity once and sends them
+    to any number of actions, which run concurrently.  The scan cost doesn't
+    depend on the number of actions.  Watermarks and delivered changes are
+    only saved once every action succeeded.
+
+    Args:
+        syn: Synapse connection
+        syn_id: Synapse Entity Id
+        value: number of time units
+        unit: time unit
+        max_workers: Number of threads listing folders or querying File View
+                     pages concurrently
+        snapshot: Local hierarchy snapshot
+        watermarks: High-watermarks of monitored File Views
+        page_size: Query File Views in pages of this many rows
+        actions: Actions to send the modified entities to
+        notifications: Changes already delivered, which aren't sent to the
+                       actions again
+        rules: Depth limit and name or path patterns pruning the traversal
+               of Folders and Projects
+        views: Registry of File Views monitoring big Folders and Projects
+        query: Columns selected and filters pushed down into File View
+               queries
+    """
+
+    def __init__(
+        self,
+        syn: Synapse,
+        syn_id: str,
+        value: int = 1,
+        unit: str = "day",
+        max_workers: int = 1,
+        snapshot: HierarchySnapshot = None,
+        watermarks: WatermarkStore = None,
+        page_size: int = None,
+        actions: List[SynapseAction] = None,
+        notifications: NotificationStore = None,
+        rules: monitor.TraversalRules = None,
+        views: ViewRegistry = None,
+        query: monitor.ViewQuery = None,
+    ) -> None:
+        self.syn = syn
+        self.syn_id = syn_id
+        self.value = value
+        self.unit = unit
+        self.max_workers = max_workers
+        self.snapshot = snapshot
+        self.watermarks = watermarks
+        self.page_size = page_size
+        self.actions = list(actions) if actions is not None else []
+        self.notifications = notifications
+        self.rules = rules
+        self.views = views
+        self.query = query
+
+    def register(self, action: SynapseAction) -> SynapseAction:
+        """Add an action to the pipeline
+
+        Args:
+            action: Takes in any class that extends SynapseAction
+
+        Returns:
+            The registered action
+        """
+        self.actions.append(action)
+        return action
+
+    def run(self, modified_entities: list = None) -> list:
+        """Find the modified entities and run every action on them
+
+        Args:
+            modified_entities: Modified entities of syn_id when they were
+                               already found, for instance together with
+                               other monitored entities.
+
+        Returns:
+            List of action results, in the order the actions were registered
+        """
+        if modified_entities is None:
+            modified_entities = monitor.find_modified_entities(
+                syn=self.syn,
+                syn_id=self.syn_id,
+                value=self.value,
+                unit=self.unit,
+                max_workers=self.max_workers,
+                snapshot=self.snapshot,
+                watermarks=self.watermarks,
+                page_size=self.page_size,
+                rules=self.rules,
+                views=self.views,
+                query=self.query,
+            )
+        if self.notifications is not None:
+            modified_entities = self.notifications.filter(
+                self.syn_id, modified_entities
+            )
+        if not self.actions:
+            return []
+
+        with ThreadPoolExecutor(max_workers=len(self.actions)) as executor:
+            futures = [
+                executor.submit(action.action, modified_entities=modified_entities)
+                for action in self.actions
+            ]
+        # Raises the error of the first failed action
+        action_results = [future.result() for future in futures]
+        if self.watermarks is not None:
+            self.watermarks.save(_view_ids(self.syn_id, self.views))
+        if self.notifications is not None:
+            self.notifications.mark(self.syn_id, modified_entities)
+            self.notifications.save()
+        return action_results
+
+
+def synapse_action(action_cls: Type[SynapseAction], modified_entities: list = None):
     """synapse action helper function
 
     Args:
         action_cls: Takes in any class that extends SynapseAction
+        modified_entities: Modified entities already found for the
+                           monitored entity of action_cls
 
     Returns:
         User defined return
     """
-    action_results = action_cls.action()
+    action_results = action_cls.action(modified_entities=modified_entities)
     return action_results
@@ -0,0 +1,327 @@
+"""Activity feed of a Synapse Project rendered as wiki markdown"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import logging
+import typing
+
+from synapseclient import Synapse
+
+from . import monitor
+from .state import FeedCache, UserNameCache
+
+INTERVALS = ["week", "month"]
+# Files of a parent listed one by one, more files are summarized by counts
+MAX_FOR_SUMMARY = 4
+# File Views are indexed asynchronously, so an interval is only final, and
+# never queried again, when it was queried this long after it ended
+SETTLE_TIME = timedelta(hours=1)
+
+
+def _interval_start(when: datetime, interval: str) -> datetime:
+    """Start of the week (Monday) or month holding a time, at midnight UTC"""
+    day = datetime(when.year, when.month, when.day, tzinfo=timezone.utc)
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _next_start(start: datetime, interval: str) -> datetime:
+    """Start of the interval following the interval starting at start"""
+    if interval == "week":
+        return start + timedelta(days=7)
+    year, month = divmod(start.month, 12)
+    return start.replace(year=start.year + year, month=month + 1)
+
+
+def iter_intervals(
+    interval: str, earliest: datetime, now: datetime
+) -> typing.Iterator[typing.Tuple[datetime, datetime]]:
+    """Intervals from the one holding earliest to the one holding now
+
+    Args:
+        interval: Length of the intervals, week or month
+        earliest: Earliest time, UTC if it has no time zone
+        now: Current time
+
+    Yields:
+        Start and end of each interval, oldest first
+    """
+    if earliest.tzinfo is None:
+        earliest = earliest.replace(tzinfo=timezone.utc)
+    start = _interval_start(earliest, interval)
+    while start <= now:
+        end = _next_start(start, interval)
+        yield start, end
+        start = end
+
+
+def _epoch_ms(when: datetime) -> int:
+    return int(when.timestamp() * 1000)
+
+
+def _is_final(summary: typing.Optional[dict]) -> bool:
+    """Whether a cached summary was queried after its interval settled"""
+    if summary is None:
+        return False
+    queried_on = datetime.fromisoformat(summary["queriedOn"])
+    return queried_on >= datetime.fromisoformat(summary["end"]) + SETTLE_TIME
+
+
+def _get_project_view(syn: Synapse, project_id: str) -> str:
+    """Get a File View of a Project scoped to the Project, created if there
+    is none
+
+    Args:
+        syn: Synapse connection
+        project_id: Synapse Project Id
+
+    Returns:
+        Synapse ID of File View
+    """
+    view_id = monitor._find_file_view(syn, project_id, project_id)
+    if view_id is None:
+        view_id = monitor.create_file_view(
+            syn,
+            name=f"synapsemonitor {project_id}",
+            project_id=project_id,
+            scope_ids=[project_id],
+        ).id
+        logging.info(f"Created File View {view_id} of {project_id}")
+    return view_id
+
+
+def summarize_interval(
+    syn: Synapse,
+    view_id: str,
+    start: datetime,
+    end: datetime,
+    max_workers: int = 1,
+    user_names: UserNameCache = None,
+    now: datetime = None,
+) -> dict:
+    """Summarize the File entities added or updated in an interval, grouped
+    by parent.  The files of parents with more than MAX_FOR_SUMMARY changes
+    are only counted, the others are listed with the user who changed them.
+
+    Args:
+        syn: Synapse connection
+        view_id: Synapse ID of File View of the Project
+        start: Start of the interval
+        end: End of the interval, excluded
+        max_workers: Number of user profiles requested concurrently
+        user_names: Cache of user names
+        now: Time of the query
+
+    Returns:
+        JSON serializable summary with start, end, queriedOn and parents
+    """
+    now = now or datetime.now(timezone.utc)
+    results = syn.tableQuery(
+        f"select id, name, parentId, currentVersion, modifiedBy from {view_id} "
+        f"where modifiedOn >= {_epoch_ms(start)} and modifiedOn < {_epoch_ms(end)}"
+    )
+    rows_by_parent = collections.defaultdict(list)
+    for row in results:
+        rows_by_parent[row[2]].append(row)
+
+    parent_names = {
+        header["id"]: header["name"]
+        for header in monitor._get_entity_headers(syn, list(rows_by_parent))
+    }
+    listed = [
+        row
+        for rows in rows_by_parent.values()
+        if len(rows) <= MAX_FOR_SUMMARY
+        for row in rows
+    ]
+    users = monitor._get_user_names(
+        syn,
+        [str(row[4]) for row in listed],
+        max_workers=max_workers,
+        user_names=user_names,
+    )
+
+    parents = []
+    for parent_id, rows in rows_by_parent.items():
+        parent = {
+            "id": parent_id,
+            "name": parent_names.get(parent_id, parent_id),
+            "new": sum(int(row[3]) == 1 for row in rows),
+            "updated": sum(int(row[3]) > 1 for row in rows),
+            "files": None,
+        }
+        if len(rows) <= MAX_FOR_SUMMARY:
+            parent["files"] = [
+                {
+                    "id": row[0],
+                    "name": row[1],
+                    "version": int(row[3]),
+                    "userId": str(row[4]),
+                    "userName": users[str(row[4])],
+                }
+                for row in sorted(rows, key=lambda row: row[1])
+            ]
+        parents.append(parent)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "queriedOn": now.isoformat(),
+        "parents": sorted(parents, key=lambda parent: parent["name"]),
+    }
+
+
+def update_feed(
+    syn: Synapse,
+    project_id: str,
+    cache: FeedCache = None,
+    interval: str = "week",
+    earliest: datetime = datetime(2014, 1, 1, tzinfo=timezone.utc),
+    view_id: str = None,
+    max_workers: int = 1,
+    user_names: UserNameCache = None,
+    now: datetime = None,
+) -> typing.List[dict]:
+    """Update the cached summaries of the changes to a Project in each
+    interval since earliest.  Only the intervals that aren't cached yet or
+    weren't final when they were cached, ie. the current one, are queried,
+    concurrently.  A File View only holds the current version of each file,
+    so the cached summaries keep changes which later versions would hide.
+
+    Args:
+        syn: Synapse connection
+        project_id: Synapse Project Id
+        cache: Cached interval summaries, kept in memory if None
+        interval: Length of the intervals, week or month
+        earliest: Start of the feed, UTC if it has no time zone
+        view_id: Synapse ID of File View of the Project. A File View scoped to
+                 the Project is found or created if None.
+        max_workers: Number of intervals queried concurrently
+        user_names: Cache of user names
+        now: Current time
+
+    Returns:
+        Summaries of the intervals, newest first
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {INTERVALS}")
+    cache = cache or FeedCache()
+    now = now or datetime.now(timezone.utc)
+    view_id = view_id or cache.get_view(project_id)
+    if view_id is None:
+        view_id = _get_project_view(syn, project_id)
+    cache.set_view(project_id, view_id)
+
+    intervals = list(iter_intervals(interval, earliest, now))
+    due = [
+        (start, end)
+        for start, end in intervals
+        if not _is_final(cache.get(project_id, interval, start))
+    ]
+    logging.info(f"{project_id}: querying {len(due)} of {len(intervals)} intervals")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summaries = executor.map(
+            lambda start_end: summarize_interval(
+                syn,
+                view_id,
+                *start_end,
+                max_workers=max_workers,
+                user_names=user_names,
+                now=now,
+            ),
+            due,
+        )
+        for (start, _), summary in zip(due, summaries):
+            cache.set(project_id, interval, start, summary)
+    return [cache.get(project_id, interval, start) for start, _ in reversed(intervals)]
+
+
+def _escape_markdown(text: str) -> str:
+    for character in "\\*_[]":
+        text = text.replace(character, f"\\{character}")
+    return text
+
+
+def _count_files(count: int, singular: str, plural: str) -> str:
+    return f"{count} {singular}" if count == 1 else f"{count} {plural}"
+
+
+def format_feed(summaries: typing.List[dict], interval: str = "week") -> str:
+    """Render interval summaries as the wiki markdown of an activity feed.
+    Intervals without changes are left out.
+
+    Args:
+        summaries: Summaries of the intervals, newest first
+        interval: Length of the intervals, week or month
+
+    Returns:
+        Markdown
+    """
+    lines = []
+    for summary in summaries:
+        if not summary["parents"]:
+            continue
+        start = datetime.fromisoformat(summary["start"])
+        if interval == "week":
+            lines.append(f"## Week of {start.strftime('%d-%B-%Y')}")
+        else:
+            lines.append(f"## {start.strftime('%B-%Y')}")
+        for parent in summary["parents"]:
+            if parent["files"] is None:
+                changes = []
+                if parent["updated"]:
+                    changes.append(
+                        _count_files(
+                            parent["updated"],
+                            "file was updated",
+                            "files were updated",
+                        )
+                    )
+                if parent["new"]:
+                    changes.append(
+                        _count_files(
+                            parent["new"], "new file was added", "new files were added"
+                        )
+                    )
+                lines.append(
+                    f"* {' and '.join(changes)} to "
+                    f"[{_escape_markdown(parent['name'])}](#!Synapse:{parent['id']})"
+                )
+                continue
+            for file in parent["files"]:
+                user = (
+                    f"[{_escape_markdown(file['userName'])}]"
+                    f"(https://www.synapse.org/#!Profile:{file['userId']})"
+                )
+                change = (
+                    "was added"
+                    if file["version"] == 1
+                    else f"was updated to version {file['version']}"
+                )
+                lines.append(
+                    f"* [{_escape_markdown(file['name'])}](#!Synapse:{file['id']}) "
+                    f"{change} by {user}"
+                )
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def update_wiki(
+    syn: Synapse, project_id: str, markdown: str, wiki_id: str = None
+) -> bool:
+    """Overwrite the markdown of a wiki page, unless it is unchanged
+
+    Args:
+        syn: Synapse connection
+        project_id: Synapse Project Id owning the wiki
+        markdown: Markdown of the page
+        wiki_id: Id of the sub-page, the root page of the Project if None
+
+    Returns:
+        Whether the page was updated
+    """
+    wiki = syn.getWiki(project_id, wiki_id)
+    if wiki.markdown == markdown:
+        return False
+    wiki.markdown = markdown
+    syn.store(wiki)
+    return True
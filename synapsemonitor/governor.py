@@ -0,0 +1,170 @@
+"""Rate limiting and retries of Synapse REST calls"""
+import functools
+import itertools
+import logging
+import random
+import threading
+import time
+import typing
+
+import requests
+from synapseclient import Synapse
+from synapseclient.core.exceptions import SynapseHTTPError
+
+# Status codes of responses that are retried
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+# Connection errors and timeouts that are retried
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+# Status codes of responses that mean Synapse is throttling requests
+THROTTLE_STATUS_CODES = [429, 503]
+# Synapse connection methods through which every REST call goes
+REST_METHODS = ["restGET", "restPOST", "restPUT", "restDELETE"]
+
+
+class RequestGovernor:
+    """Governs the REST calls made to Synapse.  Calls are rate limited with a
+    token bucket and the number of concurrent calls is adapted to throttling:
+    it grows by one after a window of successful calls (additive increase)
+    and is halved when Synapse throttles a call (multiplicative decrease).
+    Throttled and failed calls, and calls that lost their connection or
+    timed out, are retried with jittered exponential backoff.
+
+    Args:
+        rate: Maximum number of calls per second. Not limited if None.
+        max_concurrency: Maximum number of concurrent calls
+        min_concurrency: Minimum number of concurrent calls
+        max_retries: Number of times a call is retried
+        base_delay: Backoff delay in seconds of the first retry
+        max_delay: Maximum backoff delay in seconds
+        clock: Monotonic clock in seconds
+        sleep: Function sleeping a number of seconds
+    """
+
+    def __init__(
+        self,
+        rate: float = None,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 60,
+        clock: typing.Callable[[], float] = time.monotonic,
+        sleep: typing.Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clock = clock
+        self._sleep = sleep
+
+        self.concurrency = float(max_concurrency)
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        # Bucket holds up to one second of calls
+        self._capacity = max(1.0, rate or 0.0)
+        self._tokens = self._capacity
+        self._updated = clock()
+        self._bucket_lock = threading.Lock()
+
+    def install(self, syn: Synapse) -> Synapse:
+        """Route all REST calls of a Synapse connection through the
+        governor.  The retries of the Synapse client are turned off so that
+        every throttled response is seen by the governor, which retries
+        connection errors and timeouts in their place.
+
+        Args:
+            syn: Synapse connection
+
+        Returns:
+            The Synapse connection
+        """
+        for method in REST_METHODS:
+            rest_call = getattr(syn, method)
+
+            @functools.wraps(rest_call)
+            def _governed(*args, rest_call=rest_call, **kwargs):
+                kwargs.setdefault("retryPolicy", {"retries": 0})
+                return self.call(rest_call, *args, **kwargs)
+
+            setattr(syn, method, _governed)
+        return syn
+
+    def call(self, func: typing.Callable, *args, **kwargs) -> typing.Any:
+        """Call a function making a REST call to Synapse
+
+        Args:
+            func: Function making a single REST call
+            *args: Positional arguments of func
+            **kwargs: Keyword arguments of func
+
+        Returns:
+            Return value of func
+        """
+        for attempt in itertools.count():
+            self._acquire()
+            throttled = False
+            retry_after = None
+            try:
+                return func(*args, **kwargs)
+            except SynapseHTTPError as ex:
+                status_code = getattr(ex.response, "status_code", None)
+                throttled = status_code in THROTTLE_STATUS_CODES
+                if status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    raise
+                retry_after = ex.response.headers.get("Retry-After")
+                reason = f"a {status_code} response"
+            except RETRY_EXCEPTIONS as ex:
+                if attempt >= self.max_retries:
+                    raise
+                reason = type(ex).__name__
+            finally:
+                self._release(throttled)
+
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            logging.debug(f"Retrying in {delay:.2f}s after {reason}")
+            with self._condition:
+                self.retries += 1
+            self._sleep(delay)
+
+    def _acquire(self) -> None:
+        """Wait for a free concurrent call and a token"""
+        with self._condition:
+            while self._in_flight >= int(self.concurrency):
+                self._condition.wait()
+            self._in_flight += 1
+            self.calls += 1
+
+        if self.rate is None:
+            return
+        with self._bucket_lock:
+            now = self._clock()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Tokens can go negative, which reserves them for waiting calls
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            self._sleep(wait)
+
+    def _release(self, throttled: bool) -> None:
+        """Free a concurrent call and adapt the concurrency"""
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            else:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency
+                )
+            self._condition.notify_all()
@@ -0,0 +1,235 @@
+"""Metrics of monitoring runs exported as a Prometheus textfile"""
+import contextlib
+import threading
+import time
+import typing
+
+from .governor import RequestGovernor
+from .state import _write_text_atomic
+
+# Metrics of each target: name, help, TargetMetrics attribute
+TARGET_METRICS = [
+    (
+        "synapsemonitor_target_duration_seconds",
+        "Seconds spent finding and acting on the modified entities",
+        "seconds",
+    ),
+    (
+        "synapsemonitor_target_descendants_visited",
+        "Entity headers or File View rows visited",
+        "visited",
+    ),
+    (
+        "synapsemonitor_target_modified_entities",
+        "Modified entities found",
+        "modified",
+    ),
+    ("synapsemonitor_target_api_calls", "Synapse REST calls made", "api_calls"),
+    (
+        "synapsemonitor_target_api_retries",
+        "Synapse REST calls retried after an error or throttling",
+        "retries",
+    ),
+    (
+        "synapsemonitor_target_notifications_sent",
+        "Notifications sent",
+        "notifications",
+    ),
+    (
+        "synapsemonitor_target_success",
+        "Whether the target was monitored without error",
+        "success",
+    ),
+    (
+        "synapsemonitor_target_last_success_timestamp_seconds",
+        "Time the target was last monitored without error",
+        "last_success",
+    ),
+]
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value, integers without a fraction"""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape_label(value: str) -> str:
+    """Escape a label value of the text exposition format"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class TargetMetrics:
+    """Metrics of the last run or poll of a monitored entity
+
+    Attributes:
+        strategy: Strategy monitoring the entity, see planner.Plan
+        seconds: Seconds spent finding and acting on the modified entities
+        visited: Entity headers or File View rows visited
+        modified: Modified entities found
+        api_calls: REST calls made, including retries
+        retries: REST calls retried
+        notifications: Notifications sent
+        success: Whether the entity was monitored without error, None while
+                 it is monitored
+        last_success: Epoch seconds of the last run without error
+    """
+
+    def __init__(self) -> None:
+        self.strategy = None
+        self.last_success = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Reset the metrics of the last run, before a new run"""
+        self.seconds = 0.0
+        self.visited = 0
+        self.modified = 0
+        self.api_calls = 0
+        self.retries = 0
+        self.notifications = 0
+        self.success = None
+
+
+class Measurement:
+    """Work measured by RunMetrics.measure
+
+    Attributes:
+        visited: Entity headers or File View rows visited
+    """
+
+    def __init__(self) -> None:
+        self.visited = 0
+        self._lock = threading.Lock()
+
+    def visit(self, header: dict = None) -> None:
+        """Count a visited entity header, called concurrently by traversals"""
+        with self._lock:
+            self.visited += 1
+
+
+class RunMetrics:
+    """Per target metrics of monitoring runs, written to a textfile in the
+    Prometheus text format, which the textfile collector of the node
+    exporter scrapes.  Work shared by several targets, ie. a nested
+    traversal or a batched entity header request, is split evenly between
+    them, so that sums over the targets are the totals of the run.
+
+    Args:
+        path: Path of the textfile, ending in .prom. Not written if None.
+        governor: Request governor counting the REST calls and retries
+        clock: Monotonic clock in seconds
+        wall_clock: Epoch time in seconds
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        governor: RequestGovernor = None,
+        clock: typing.Callable[[], float] = time.monotonic,
+        wall_clock: typing.Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.governor = governor
+        self.targets = {}
+        self._clock = clock
+        self._wall_clock = wall_clock
+
+    def target(self, syn_id: str) -> TargetMetrics:
+        """Metrics of a target, created when it wasn't measured yet"""
+        if syn_id not in self.targets:
+            self.targets[syn_id] = TargetMetrics()
+        return self.targets[syn_id]
+
+    def _counters(self) -> typing.Tuple[int, int]:
+        if self.governor is None:
+            return 0, 0
+        return self.governor.calls, self.governor.retries
+
+    @contextlib.contextmanager
+    def measure(self, syn_ids: typing.List[str]) -> typing.Iterator[Measurement]:
+        """Measure the duration, REST calls, retries and visited entities of
+        work done for targets.  The targets fail when the work raises.
+
+        Args:
+            syn_ids: Synapse Ids of the targets sharing the work
+
+        Yields:
+            Measurement counting the visited entities
+        """
+        measurement = Measurement()
+        started = self._clock()
+        calls, retries = self._counters()
+        try:
+            yield measurement
+        except BaseException:
+            for syn_id in syn_ids:
+                self.target(syn_id).success = False
+            raise
+        finally:
+            seconds = self._clock() - started
+            ended_calls, ended_retries = self._counters()
+            share = 1 / len(syn_ids)
+            for syn_id in syn_ids:
+                target = self.target(syn_id)
+                target.seconds += seconds * share
+                target.visited += measurement.visited * share
+                target.api_calls += (ended_calls - calls) * share
+                target.retries += (ended_retries - retries) * share
+
+    def record(self, syn_id: str, modified: int, notifications: int = 0) -> None:
+        """Record a target monitored without error
+
+        Args:
+            syn_id: Synapse Id of the target
+            modified: Number of modified entities found
+            notifications: Number of notifications sent
+        """
+        target = self.target(syn_id)
+        target.modified = modified
+        target.notifications += notifications
+        if target.success is None:
+            target.success = True
+            target.last_success = self._wall_clock()
+
+    def format(self) -> str:
+        """Format the metrics in the Prometheus text format, which is also
+        valid OpenMetrics
+
+        Returns:
+            Metrics
+        """
+        lines = []
+        for name, description, attribute in TARGET_METRICS:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            for syn_id, target in sorted(self.targets.items()):
+                value = getattr(target, attribute)
+                if value is None:
+                    continue
+                lines.append(
+                    f'{name}{{target="{_escape_label(syn_id)}"}} {_format_value(value)}'
+                )
+        name = "synapsemonitor_target_info"
+        lines.append(f"# HELP {name} Strategy monitoring the target")
+        lines.append(f"# TYPE {name} gauge")
+        for syn_id, target in sorted(self.targets.items()):
+            if target.strategy is None:
+                continue
+            lines.append(
+                f'{name}{{target="{_escape_label(syn_id)}",'
+                f'strategy="{_escape_label(target.strategy)}"}} 1'
+            )
+        name = "synapsemonitor_last_run_timestamp_seconds"
+        lines.append(f"# HELP {name} Time the metrics were written")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_value(self._wall_clock())}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def save(self) -> None:
+        """Write the textfile atomically, so that the node exporter never
+        scrapes a partial file
+        """
+        if self.path is not None:
+            _write_text_atomic(self.path, self.format(), mode=0o644)
@@ -1,16 +1,140 @@
 """Monitor Synapse Project"""
-from datetime import datetime, timedelta
+import collections
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 from dateutil import tz
+import fnmatch
+import hashlib
+import json
 import logging
+import math
+import re
 import typing
 
-import pandas as pd
 import synapseclient
 from synapseclient import EntityViewSchema, EntityViewType, Synapse
+from synapseclient.core.exceptions import SynapseHTTPError
+
+from . import planner
+from .metrics import RunMetrics
+from .snapshot import HierarchySnapshot
+from .state import TraversalCheckpoint, UserNameCache, ViewRegistry, WatermarkStore
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+# Maximum number of references accepted by one POST /entity/header request
+ENTITY_HEADER_BATCH_SIZE = 1000
+# Operators of File View filters and their SQL
+FILTER_OPERATORS = {
+    "=": "=",
+    "!=": "<>",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+    "~": "LIKE",
+}
+# File View columns of the entity header fields named differently
+VIEW_COLUMNS = {"versionNumber": "currentVersion"}
+# Entity header fields of the children listing that can be filtered on
+HEADER_COLUMNS = ["id", "name", "type", "versionNumber", "createdBy", "modifiedBy"]
+
+
+class ModifiedEntity(str):
+    """Synapse ID of a modified entity.  It carries the metadata that was
+    known when the entity was found, and otherwise behaves as the Synapse
+    ID string.
+
+    Args:
+        syn_id: Synapse ID
+        parent_id: Synapse ID of parent
+        name: Entity name
+        modified_on: UTC modifiedOn formatted as 2021-01-01T00:00:00.000Z
+        etag: Entity etag
+        version: Entity version number
+        values: Other File View column values, ie. annotations
+    """
+
+    def __new__(
+        cls,
+        syn_id: str,
+        parent_id: str = None,
+        name: str = None,
+        modified_on: str = None,
+        etag: str = None,
+        version: int = None,
+        values: dict = None,
+    ) -> "ModifiedEntity":
+        entity = super().__new__(cls, syn_id)
+        entity.parent_id = parent_id
+        entity.name = name
+        entity.modified_on = modified_on
+        entity.etag = etag
+        entity.version = version
+        entity.values = values or {}
+        return entity
+
+    @classmethod
+    def from_header(cls, header: dict) -> "ModifiedEntity":
+        """Create from an entity header
+
+        Args:
+            header: Entity header (id, name, parentId, modifiedOn, ...)
+
+        Returns:
+            Modified entity
+        """
+        return cls(
+            header["id"],
+            parent_id=header.get("parentId"),
+            name=header.get("name"),
+            modified_on=header.get("modifiedOn"),
+            etag=header.get("etag"),
+            version=header.get("versionNumber"),
+        )
+
+
+def _parse_epoch_ms(modified_on: typing.Union[int, str, datetime]) -> int:
+    """Epoch milliseconds of a File View DATE value.  Rowset query results
+    hold it as a string, while the rows of CSV query results are cast to
+    UTC datetimes, which are rounded back to the millisecond.
+
+    Args:
+        modified_on: Epoch milliseconds, as a number or a string, or datetime
+
+    Returns:
+        Milliseconds since epoch
+    """
+    if isinstance(modified_on, datetime):
+        if modified_on.tzinfo is None:
+            modified_on = modified_on.replace(tzinfo=timezone.utc)
+        epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        microseconds = (modified_on - epoch) // timedelta(microseconds=1)
+        return (microseconds + 500) // 1000
+    return int(modified_on)
+
+
+def _format_epoch_ms(epoch_ms: int) -> str:
+    """Format a File View modifiedOn (epoch milliseconds) as a Synapse
+    timestamp
+
+    Args:
+        epoch_ms: Milliseconds since epoch
+
+    Returns:
+        UTC timestamp formatted as 2021-01-01T00:00:00.000Z
+    """
+    timestamp = datetime.utcfromtimestamp(epoch_ms / 1000)
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.") + f"{epoch_ms % 1000:03d}Z"
 
 
 def create_file_view(
-    syn: Synapse, name: str, project_id: str, scope_ids: typing.List[str]
+    syn: Synapse,
+    name: str,
+    project_id: str,
+    scope_ids: typing.List[str],
+    annotation_columns: bool = False,
 ) -> EntityViewSchema:
     """Creates a file view that will list all the File entities under
     the specified scopes (Synapse Folders or Projects). This will
@@ -23,6 +147,9 @@ def create_file_view(
         name: File view name
         project_id: Synapse project id to store your file view
         scope_ids: List of Folder or Project synapse Ids
+        annotation_columns: Add a column for each annotation of the scoped
+                            File entities. Otherwise annotation columns are
+                            added when a ViewQuery uses them.
 
     Returns:
         Synapse file view
@@ -33,14 +160,57 @@ def create_file_view(
         scopes=scope_ids,
         includeEntityTypes=[EntityViewType.FILE],
         add_default_columns=True,
-        addAnnotationColumns=False,
+        addAnnotationColumns=annotation_columns,
     )
     return syn.store(view)
 
 
+def _get_user_names(
+    syn: Synapse,
+    principal_ids: typing.Iterable,
+    max_workers: int = 1,
+    user_names: UserNameCache = None,
+) -> dict:
+    """Resolve the user names of Synapse principals.  Every principal is only
+    resolved once and principals missing from the cache are resolved
+    concurrently.
+
+    Args:
+        syn: Synapse connection
+        principal_ids: Synapse principal Ids, may contain duplicates
+        max_workers: Number of user profiles requested concurrently
+        user_names: Cache of user names
+
+    Returns:
+        Dict mapping each principal Id to its user name
+    """
+    if user_names is None:
+        user_names = UserNameCache()
+
+    resolved = {}
+    missing = []
+    for principal_id in set(principal_ids):
+        user_name = user_names.get(principal_id)
+        if user_name is None:
+            missing.append(principal_id)
+        else:
+            resolved[principal_id] = user_name
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        profiles = executor.map(syn.getUserProfile, missing)
+        for principal_id, profile in zip(missing, profiles):
+            resolved[principal_id] = profile["userName"]
+            user_names.set(principal_id, profile["userName"])
+    return resolved
+
+
 def _render_fileview(
-    syn: Synapse, viewdf: pd.DataFrame, tz_name="US/Pacific"
-) -> pd.DataFrame:
+    syn: Synapse,
+    viewdf: "pd.DataFrame",
+    tz_name="US/Pacific",
+    max_workers: int = 1,
+    user_names: UserNameCache = None,
+) -> "pd.DataFrame":
     """Renders file view values such as changing modifiedOn from
     Epoch time to US/Pacific datetime and Synapse userids to usernames
 
@@ -49,11 +219,16 @@ def _render_fileview(
         viewdf: File view dataframe
         tz_name: Timezone database name
                  https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
+        max_workers: Number of user profiles requested concurrently
+        user_names: Cache of user names shared between renders
 
     Returns:
         Rendered File view dataframe
 
     """
+    # Only rendering needs pandas, which is slow to import
+    import pandas as pd
+
     viewdf["createdOn"] = (
         pd.to_datetime(viewdf["createdOn"], unit="ms")
         .dt.tz_localize("utc")
@@ -64,21 +239,215 @@ def _render_fileview(
         .dt.tz_localize("utc")
         .dt.tz_convert(tz_name)
     )
-    users = [syn.getUserProfile(user)["userName"] for user in viewdf["modifiedBy"]]
-    viewdf["modifiedBy"] = users
+    users = _get_user_names(
+        syn,
+        viewdf["modifiedBy"].unique(),
+        max_workers=max_workers,
+        user_names=user_names,
+    )
+    viewdf["modifiedBy"] = viewdf["modifiedBy"].map(users)
     return viewdf
 
 
+def _at_watermark(
+    watermark: typing.Optional[dict], entity_id: str, modified_on: int
+) -> bool:
+    """Whether a File View row is a change already reported, at the
+    watermark or within the lag before it.  An entity modified again since
+    is reported again.
+
+    Args:
+        watermark: Watermark of the File View, see WatermarkStore
+        entity_id: Synapse ID of the row
+        modified_on: modifiedOn of the row (epoch ms)
+
+    Returns:
+        True if the row was already reported
+    """
+    return watermark is not None and watermark["ids"].get(entity_id) == modified_on
+
+
+def _watermark_lag(watermarks: WatermarkStore) -> int:
+    """Lag of the watermarks in epoch ms"""
+    return int(watermarks.lag.total_seconds() * 1000)
+
+
+def _move_watermark(
+    watermarks: WatermarkStore,
+    syn_id: str,
+    watermark: typing.Optional[dict],
+    reported: typing.Dict[str, int],
+) -> None:
+    """Stage the watermark of a fileview at the latest change reported,
+    keeping the changes reported within the lag before it
+
+    Args:
+        watermarks: High-watermarks of monitored fileviews
+        syn_id: Synapse Fileview Id
+        watermark: Watermark the fileview was queried from, or None
+        reported: modifiedOn (epoch ms) of the reported Synapse IDs
+    """
+    modified_on = max(reported.values())
+    if watermark is not None:
+        modified_on = max(modified_on, watermark["modifiedOn"])
+        reported = {**watermark["ids"], **reported}
+    since = modified_on - _watermark_lag(watermarks)
+    watermarks.set(
+        syn_id,
+        modified_on,
+        {
+            entity_id: entity_modified_on
+            for entity_id, entity_modified_on in reported.items()
+            if entity_modified_on >= since
+        },
+    )
+
+
+def _iter_fileview_rows(
+    syn: Synapse,
+    syn_id: str,
+    columns: typing.List[str],
+    where: str,
+    page_size: int = 10000,
+    max_workers: int = 1,
+) -> typing.Iterator[list]:
+    """Query a fileview page by page in ROW_ID order.  Each page starts
+    after the last ROW_ID of the previous page rather than at an offset, so
+    rows that enter or leave the results while paging don't shift the pages
+    and are neither skipped nor read twice.  Only up to two pages are in
+    memory at a time.
+
+    Args:
+        syn: Synapse connection
+        syn_id: Synapse Fileview Id
+        columns: Columns to select
+        where: SQL where clause
+        page_size: Number of rows per page
+        max_workers: The next page is queried while the rows of the current
+                     page are yielded when above 1
+
+    Yields:
+        Row values in the order of columns
+    """
+    query = f"select {', '.join(columns)} from {syn_id} where"
+
+    def _query_page(last_row_id):
+        page_where = where
+        if last_row_id is not None:
+            page_where = f"({where}) AND ROW_ID > {last_row_id}"
+        results = syn.tableQuery(
+            f"{query} {page_where} order by ROW_ID limit {page_size}",
+            resultsAs="rowset",
+        )
+        return list(results)
+
+    rows = _query_page(None)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            last_page = len(rows) < page_size
+            if not last_page and max_workers > 1:
+                next_page = executor.submit(_query_page, rows[-1]["rowId"])
+            yield from (row["values"] for row in rows)
+            if last_page:
+                return
+            if max_workers > 1:
+                rows = next_page.result()
+            else:
+                rows = _query_page(rows[-1]["rowId"])
+
+
+def _iter_modified_entities_fileview(
+    syn: Synapse,
+    syn_id: str,
+    value: int = 1,
+    unit: str = "day",
+    watermarks: WatermarkStore = None,
+    page_size: int = 10000,
+    max_workers: int = 1,
+    query: "ViewQuery" = None,
+) -> typing.Iterator[str]:
+    """Streams the entities scoped in a fileview modified in the past
+    {value} {unit}, or since the lag before the watermark of the fileview,
+    page by page.  The watermark is moved once all pages were read.
+
+    Args:
+        syn: Synapse connection
+        syn_id: Synapse Fileview Id
+        value: number of time units
+        unit: time unit
+        watermarks: High-watermarks of monitored fileviews
+        page_size: Number of rows per page
+        max_workers: Query the next page while the current page is read
+                     when above 1
+        query: Columns selected and filters added to the SQL query
+
+    Yields:
+        Synapse ids
+    """
+    query = query or ViewQuery()
+    watermark = watermarks.get(syn_id) if watermarks is not None else None
+    if watermark is None:
+        # The cutoff is computed once, the same for every page
+        cutoff = _parse_epoch_ms(_get_modified_cutoff(value, unit))
+        where = f"modifiedOn > {cutoff}"
+    else:
+        # Changes indexed late by the File View are found within the lag
+        where = f"modifiedOn >= {watermark['modifiedOn'] - _watermark_lag(watermarks)}"
+
+    max_modified_on = None
+    # Only the changes within the lag of the latest one are kept
+    reported = {}
+    rows = _iter_fileview_rows(
+        syn,
+        syn_id,
+        columns=query.select(),
+        where=query.where(where),
+        page_size=page_size,
+        max_workers=max_workers,
+    )
+    for row in rows:
+        entity_id, modified_on = row[0], _parse_epoch_ms(row[1])
+        if _at_watermark(watermark, entity_id, modified_on):
+            continue
+        if max_modified_on is None or modified_on > max_modified_on:
+            max_modified_on = modified_on
+        if watermarks is not None and (
+            modified_on >= max_modified_on - _watermark_lag(watermarks)
+        ):
+            reported[entity_id] = modified_on
+        yield query.entity(row)
+
+    if reported:
+        _move_watermark(watermarks, syn_id, watermark, reported)
+
+
 def _find_modified_entities_fileview(
-    syn: Synapse, syn_id: str, value: int = 1, unit: str = "day"
+    syn: Synapse,
+    syn_id: str,
+    value: int = 1,
+    unit: str = "day",
+    watermarks: WatermarkStore = None,
+    page_size: int = None,
+    max_workers: int = 1,
+    query: "ViewQuery" = None,
 ) -> list:
-    """Finds entities scoped in a fileview modified in the past {value} {unit}
+    """Finds entities scoped in a fileview modified in the past {value} {unit}.
+    When watermarks are used, only the changes since the lag before the
+    watermark of the fileview not reported yet are returned and
+    {value} {unit} is only used the first time the fileview is monitored.
 
     Args:
         syn: Synapse connection
         syn_id: Synapse Fileview Id
         value: number of time units
         unit: time unit
+        watermarks: High-watermarks of monitored fileviews
+        page_size: Query the fileview in pages of this many rows instead
+                   of loading all results into a single data frame
+        max_workers: Query the next page while the current page is read
+                     when above 1
+        query: Columns selected and filters added to the SQL query, so
+               that only the rows and columns needed are returned
 
     Returns:
         List of synapse ids
@@ -86,13 +455,87 @@ def _find_modified_entities_fileview(
     # Update the view
     # _force_update_view(syn, view_id)
 
-    query = (
-        f"select id from {syn_id} where "
-        f"modifiedOn > unix_timestamp(NOW() - INTERVAL {value} {unit})*1000"
+    if page_size is not None:
+        return list(
+            _iter_modified_entities_fileview(
+                syn=syn,
+                syn_id=syn_id,
+                value=value,
+                unit=unit,
+                watermarks=watermarks,
+                page_size=page_size,
+                max_workers=max_workers,
+                query=query,
+            )
+        )
+
+    query = query or ViewQuery()
+    watermark = watermarks.get(syn_id) if watermarks is not None else None
+    if watermark is None:
+        cutoff = _parse_epoch_ms(_get_modified_cutoff(value, unit))
+        where = f"modifiedOn > {cutoff}"
+    else:
+        # Changes before the watermark may not all have been indexed yet, so
+        # the lag before it is queried again and filtered below
+        where = f"modifiedOn >= {watermark['modifiedOn'] - _watermark_lag(watermarks)}"
+    results = syn.tableQuery(
+        f"select {', '.join(query.select())} from {syn_id} where {query.where(where)}"
     )
-    results = syn.tableQuery(query)
-    resultsdf = results.asDataFrame()
-    return resultsdf["id"].tolist()
+    # Rows are read from the downloaded CSV without a data frame, their
+    # values in the order of the selected columns and cast to the column
+    # types, ie. modifiedOn to a datetime
+    rows = [
+        row
+        for row in results
+        if not _at_watermark(watermark, row[0], _parse_epoch_ms(row[1]))
+    ]
+
+    if watermarks is not None and rows:
+        _move_watermark(
+            watermarks,
+            syn_id,
+            watermark,
+            {row[0]: _parse_epoch_ms(row[1]) for row in rows},
+        )
+    # modifiedOn tells later changes of an entity apart, see NotificationStore
+    return [query.entity(row) for row in rows]
+
+
+def _get_modified_cutoff(value: int = 1, unit: str = "day") -> datetime:
+    """Get the UTC time after which an entity is considered modified
+
+    Args:
+        value: number of time units
+        unit: time unit
+
+    Returns:
+        UTC datetime of {value} {unit} ago
+    """
+    valid_units = ["day", "hour", "minute"]
+    if unit not in valid_units:
+        raise ValueError(
+            f"'{unit}' is not an accepted time unit. Accepted units: {valid_units}."
+        )
+
+    if unit == "day":
+        td = timedelta(days=value)
+    elif unit == "hour":
+        td = timedelta(hours=value)
+    elif unit == "minute":
+        td = timedelta(minutes=value)
+    return datetime.utcnow() - td
+
+
+def _parse_modified_on(modified_on: str) -> datetime:
+    """Parse a Synapse modifiedOn timestamp (UTC)
+
+    Args:
+        modified_on: Timestamp formatted as 2021-01-01T00:00:00.000Z
+
+    Returns:
+        UTC datetime
+    """
+    return datetime.strptime(modified_on, "%Y-%m-%dT%H:%M:%S.%fZ")
 
 
 def _find_modified_entities_file(
@@ -110,31 +553,360 @@ def _find_modified_entities_file(
     Returns:
         List of synapse ids
     """
+    cutoff = _get_modified_cutoff(value, unit)
 
-    valid_units = ["day", "hour"]
-    if unit not in valid_units:
-        raise ValueError(
-            f"'{unit}' is not an accepted time unit. Accepted units: {valid_units}."
+    entity = syn.get(syn_id, downloadFile=False)
+    if _parse_modified_on(entity["modifiedOn"]) > cutoff:
+        return [
+            ModifiedEntity(
+                syn_id,
+                parent_id=entity.get("parentId"),
+                name=entity.get("name"),
+                modified_on=entity["modifiedOn"],
+                etag=entity.get("etag"),
+                version=entity.get("versionNumber"),
+            )
+        ]
+    return []
+
+
+def _entity_type(concrete_type: str) -> str:
+    """Convert a Synapse concrete type into an entity type
+
+    Args:
+        concrete_type: Synapse concrete type
+            (ie. "org.sagebionetworks.repo.model.FileEntity")
+
+    Returns:
+        Entity type (ie. "file")
+    """
+    return concrete_type.split(".")[-1].lower().replace("entity", "")
+
+
+def _list_children(
+    syn: Synapse,
+    synid_parent: str,
+    include_types: typing.List[str],
+    snapshot: HierarchySnapshot = None,
+) -> list:
+    """List the children of a container.  When a snapshot is used, the
+    first page of children (newest first) is requested together with the
+    total child count and file sizes of the container.  This signature,
+    which includes the modifiedOn of every child of the first page, is
+    compared to the snapshot and the stored listing is reused when the
+    children haven't changed, so only changed containers are listed in
+    full.
+
+    Children can only be listed by name or creation date, so a change to a
+    child older than the first page that keeps the child count and file
+    sizes, ie. a rename, an annotation edit or a same-size replacement, is
+    only found once the stored listing is older than the max_age of the
+    snapshot and the container is listed again.
+
+    Args:
+        syn: Synapse connection
+        synid_parent: Synapse ID of container
+        include_types: Must be a list of entity types (ie. [“folder”,”file”])
+        snapshot: Local hierarchy snapshot
+
+    Returns:
+        List of child entity headers
+    """
+    if snapshot is None:
+        children = list(
+            syn.getChildren(parent=synid_parent, includeTypes=include_types)
         )
+        return _set_parent_id(children, synid_parent)
 
-    entity = syn.get(syn_id, downloadFile=False)
-    utc_mod = datetime.strptime(entity["modifiedOn"], "%Y-%m-%dT%H:%M:%S.%fZ")
-    utc_now = datetime.utcnow()
+    request = {
+        "parentId": synid_parent,
+        "includeTypes": include_types,
+        "sortBy": "CREATED_ON",
+        "sortDirection": "DESC",
+        "includeTotalChildCount": True,
+        "includeSumFileSizes": True,
+    }
+    response = syn.restPOST("/entity/children", body=json.dumps(request))
+    page = response.get("page", [])
+    first_page = hashlib.sha1(
+        ",".join(f"{child['id']}@{child.get('modifiedOn')}" for child in page).encode()
+    ).hexdigest()
+    signature = (
+        f"{response.get('totalChildCount')}:"
+        f"{response.get('sumFileSizesBytes')}:{first_page}"
+    )
 
-    if unit == "day":
-        td = timedelta(days=value)
-    elif unit == "hour":
-        td = timedelta(hours=value)
+    if response.get("nextPageToken") is None:
+        # The first page is the complete listing
+        children = page
+    else:
+        children = snapshot.get_children(synid_parent, include_types, signature)
+        if children is not None:
+            return children
+        children = list(
+            syn.getChildren(parent=synid_parent, includeTypes=include_types)
+        )
+    snapshot.put_children(synid_parent, include_types, signature, children)
+    return _set_parent_id(children, synid_parent)
+
+
+def _set_parent_id(children: list, synid_parent: str) -> list:
+    """The children listing doesn't include the parent of the children,
+    add it so that traversed entities can be placed in the hierarchy.
+
+    Args:
+        children: List of child entity headers
+        synid_parent: Synapse ID of container
+
+    Returns:
+        List of child entity headers with parentId
+    """
+    for child in children:
+        child["parentId"] = synid_parent
+    return children
 
-    if utc_mod > utc_now - td:
-        return [syn_id]
-    return []
+
+class TraversalRules:
+    """Rules pruning a traversal before folders are listed.  Glob patterns
+    are matched against the name of an entity and its path from the
+    traversed container (ie. "raw/run1/reads.fastq").
+
+    Args:
+        max_depth: Depth of the deepest entities traversed. The children of
+                   the traversed container are at depth 1. Not limited if
+                   None.
+        include: Glob patterns. Only entities matching one are returned,
+                 folders are traversed regardless.
+        exclude: Glob patterns. Entities matching one are skipped and
+                 folders matching one are not listed.
+    """
+
+    def __init__(
+        self,
+        max_depth: int = None,
+        include: typing.List[str] = None,
+        exclude: typing.List[str] = None,
+    ) -> None:
+        self.max_depth = max_depth
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+
+    @staticmethod
+    def _matches(patterns: typing.List[str], name: str, path: str) -> bool:
+        return any(
+            fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(path, pattern)
+            for pattern in patterns
+        )
+
+    def lists(self, depth: int) -> bool:
+        """Whether a folder at this depth is listed"""
+        return self.max_depth is None or depth < self.max_depth
+
+    def includes(self, name: str, path: str) -> bool:
+        """Whether an entity is returned"""
+        return not self.include or self._matches(self.include, name, path)
+
+    def excludes(self, name: str, path: str) -> bool:
+        """Whether an entity is skipped, with its descendants"""
+        return self._matches(self.exclude, name, path)
+
+
+def _sql_literal(value: typing.Any) -> str:
+    """Format a filter value as a SQL literal, quoting strings"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _compare(actual: typing.Any, operator: str, value: typing.Any) -> bool:
+    """Evaluate a filter on a value as the SQL query would.  Values are
+    compared as numbers when both are numbers.
+    """
+    if actual is None:
+        return False
+    if operator == "~":
+        pattern = "".join(
+            {"%": ".*", "_": "."}.get(char, re.escape(char)) for char in str(value)
+        )
+        return re.fullmatch(pattern, str(actual), flags=re.DOTALL) is not None
+    try:
+        actual, value = float(actual), float(value)
+    except (TypeError, ValueError):
+        actual, value = str(actual), str(value)
+    return {
+        "=": actual == value,
+        "!=": actual != value,
+        "<": actual < value,
+        "<=": actual <= value,
+        ">": actual > value,
+        ">=": actual >= value,
+    }[operator]
+
+
+class ViewQuery:
+    """Column projection and filters pushed down into the SQL query of File
+    Views, so that only the rows and columns needed are returned.  Filters
+    on entity header fields (HEADER_COLUMNS) are also applied to the
+    children listing when Folders and Projects are traversed, also when the
+    listing comes from the hierarchy snapshot.  Filters on annotations
+    require a File View, so a Folder or Project is only filtered on
+    annotations when the plan monitors it with its File View, and traversing
+    it raises ValueError.
+
+    Args:
+        columns: Columns selected in addition to id and modifiedOn. Entity
+                 header fields (name, parentId, etag, versionNumber) are set
+                 on the ModifiedEntity, other columns in its values.
+        filters: (column, operator, value) filters that must all match.
+                 Operators are =, !=, <, <=, >, >= and ~ (SQL LIKE).
+    """
+
+    def __init__(
+        self,
+        columns: typing.List[str] = None,
+        filters: typing.List[tuple] = None,
+    ) -> None:
+        self.columns = list(columns or [])
+        self.filters = [tuple(query_filter) for query_filter in filters or []]
+        for column in self.columns + [column for column, _, _ in self.filters]:
+            if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*", column) is None:
+                raise ValueError(f"Invalid column name: {column}")
+        for _, operator, _ in self.filters:
+            if operator not in FILTER_OPERATORS:
+                raise ValueError(f"Invalid filter operator: {operator}")
+
+    @staticmethod
+    def parse_filter(expression: str) -> tuple:
+        """Parse a filter expression such as fileFormat=bam, name~%.bam or
+        versionNumber>1
+
+        Args:
+            expression: Column, operator and value
+
+        Returns:
+            (column, operator, value)
+        """
+        match = re.fullmatch(r"\s*([^!<>=~\s]+)\s*(!=|<=|>=|=|<|>|~)(.*)", expression)
+        if match is None:
+            raise ValueError(f"Invalid filter: {expression}")
+        return match.group(1), match.group(2), match.group(3).strip()
+
+    def select(self) -> typing.List[str]:
+        """File View columns to select"""
+        columns = ["id", "modifiedOn"]
+        for column in self.columns:
+            column = VIEW_COLUMNS.get(column, column)
+            if column not in columns:
+                columns.append(column)
+        return columns
+
+    def view_columns(self) -> typing.List[str]:
+        """File View columns used by the projection and the filters"""
+        columns = self.select()
+        for column, _, _ in self.filters:
+            column = VIEW_COLUMNS.get(column, column)
+            if column not in columns:
+                columns.append(column)
+        return columns
+
+    def where(self, where: str) -> str:
+        """Add the filters to a SQL where clause"""
+        conditions = [f"({where})"] if self.filters else [where]
+        for column, operator, value in self.filters:
+            column = VIEW_COLUMNS.get(column, column)
+            conditions.append(
+                f"{column} {FILTER_OPERATORS[operator]} {_sql_literal(value)}"
+            )
+        return " AND ".join(conditions)
+
+    def entity(self, row: typing.Sequence) -> ModifiedEntity:
+        """Create a modified entity from the values of a File View row
+
+        Args:
+            row: Values in the order of select()
+
+        Returns:
+            Modified entity
+        """
+        values = dict(zip(self.select(), row))
+        version = values.get("currentVersion")
+        return ModifiedEntity(
+            values["id"],
+            parent_id=values.get("parentId"),
+            name=values.get("name"),
+            modified_on=_format_epoch_ms(_parse_epoch_ms(values["modifiedOn"])),
+            etag=values.get("etag"),
+            version=None if version is None else int(version),
+            values={
+                column: values[VIEW_COLUMNS.get(column, column)]
+                for column in self.columns
+            },
+        )
+
+    def check_headers(self) -> None:
+        """Raise ValueError if a filter can't be applied to entity headers"""
+        columns = [
+            column for column, _, _ in self.filters if column not in HEADER_COLUMNS
+        ]
+        if columns:
+            raise ValueError(
+                f"Filters on {', '.join(columns)} can only be applied to File "
+                "Views, Folders and Projects are only filtered on "
+                f"{', '.join(HEADER_COLUMNS)}"
+            )
+
+    def matches(self, header: dict) -> bool:
+        """Whether an entity header of the children listing matches the
+        filters, see check_headers
+        """
+        for column, operator, value in self.filters:
+            actual = header.get(column)
+            if column == "type" and actual is not None:
+                actual = _entity_type(actual)
+            if not _compare(actual, operator, value):
+                return False
+        return True
+
+
+def _add_view_columns(syn: Synapse, view_id: str, columns: typing.List[str]):
+    """Add the annotation columns used by a ViewQuery that are missing from
+    a File View, so that they are only added on demand
+
+    Args:
+        syn: Synapse connection
+        view_id: Synapse ID of File View
+        columns: File View columns used by the query
+    """
+    view = syn.get(view_id, downloadFile=False)
+    existing = {column["name"] for column in syn.getColumns(view)}
+    missing = [column for column in columns if column not in existing]
+    if not missing:
+        return
+    annotation_columns = {
+        column["name"]: column
+        for column in syn._get_annotation_view_columns(
+            view.scopeIds, "entityview", view_type_mask=view.get("viewTypeMask")
+        )
+    }
+    unknown = [column for column in missing if column not in annotation_columns]
+    if unknown:
+        raise ValueError(
+            f"Columns not found in File View {view_id} nor in the annotations "
+            f"of its scope: {', '.join(unknown)}"
+        )
+    logging.info(f"Adding annotation columns {missing} to File View {view_id}")
+    view.addColumns([annotation_columns[column] for column in missing])
+    syn.store(view)
 
 
 def _traverse(
     syn: Synapse,
     synid_root: str,
     include_types: typing.List = ["file"],
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    rules: TraversalRules = None,
+    checkpoint: TraversalCheckpoint = None,
 ) -> list:
     """Traverse Synapse entity hierarchy to gather all descendant
     entities of a root entity.
@@ -144,36 +916,325 @@ def _traverse(
         include_types: Must be a list of entity types (ie. [“folder”,”file”])
             which can be found here:
             http://docs.synapse.org/rest/org/sagebionetworks/repo/model/EntityType.html
+        max_workers: Number of threads listing folders concurrently.
+            A value of 1 traverses the hierarchy sequentially.
+        snapshot: Local hierarchy snapshot used to only list the
+            containers whose children changed.
+        rules: Depth limit and name or path patterns pruning the traversal.
+        checkpoint: Checkpoint saving the traversal state at intervals.
     Returns:
         List of descendant Synapse IDs without root Synapse ID
     """
+    headers = _iter_traverse_headers(
+        syn=syn,
+        synid_root=synid_root,
+        include_types=include_types,
+        max_workers=max_workers,
+        snapshot=snapshot,
+        rules=rules,
+        checkpoint=checkpoint,
+    )
+    return [header["id"] for header in headers]
+
+
+def _traverse_headers(
+    syn: Synapse,
+    synid_root: str,
+    include_types: typing.List = ["file"],
+    max_workers: int = 1,
+    predicate: typing.Callable[[dict], bool] = None,
+    snapshot: HierarchySnapshot = None,
+    rules: TraversalRules = None,
+    checkpoint: TraversalCheckpoint = None,
+    predicate_params: dict = None,
+) -> list:
+    """Traverse Synapse entity hierarchy to gather the entity headers
+    of all descendant entities of a root entity.  See _iter_traverse_headers.
+
+    Returns:
+        List of descendant entity headers without root entity
+    """
+    return list(
+        _iter_traverse_headers(
+            syn=syn,
+            synid_root=synid_root,
+            include_types=include_types,
+            max_workers=max_workers,
+            predicate=predicate,
+            snapshot=snapshot,
+            rules=rules,
+            checkpoint=checkpoint,
+            predicate_params=predicate_params,
+        )
+    )
+
+
+def _iter_traverse_headers(
+    syn: Synapse,
+    synid_root: str,
+    include_types: typing.List = ["file"],
+    max_workers: int = 1,
+    predicate: typing.Callable[[dict], bool] = None,
+    snapshot: HierarchySnapshot = None,
+    rules: TraversalRules = None,
+    checkpoint: TraversalCheckpoint = None,
+    predicate_params: dict = None,
+) -> typing.Iterator[dict]:
+    """Traverse Synapse entity hierarchy and yield the entity headers
+    returned by the children listing (id, name, type, modifiedOn, ...)
+    of the descendant entities of a root entity as they are listed.
+    Folders left to list are kept on an explicit stack, so the depth of
+    the hierarchy isn't limited by the recursion limit.  With a checkpoint,
+    the stack and the headers found are saved after each listing, and a
+    saved traversal is resumed: its headers are yielded again and only the
+    folders left to list are listed.
 
-    synid_desc = []
+    Args:
+        syn: Synapse connection
+        synid_root: Synapse ID of root entity.
+        include_types: Must be a list of entity types (ie. [“folder”,”file”])
+            which can be found here:
+            http://docs.synapse.org/rest/org/sagebionetworks/repo/model/EntityType.html
+        max_workers: Number of threads listing folders concurrently.
+            A value of 1 traverses the hierarchy sequentially.
+        predicate: Only yield entity headers for which this returns True.
+            Folders are traversed regardless of the predicate.
+        snapshot: Local hierarchy snapshot used to only list the
+            containers whose children changed.
+        rules: Depth limit and name or path patterns pruning the traversal.
+        checkpoint: Checkpoint saving the traversal state at intervals.
+        predicate_params: JSON serializable parameters of the predicate,
+            ie. the time window and filters. A traversal saved with other
+            parameters or rules isn't resumed.
+
+    Yields:
+        Descendant entity headers without root entity
+    """
+    if max_workers > 1:
+        yield from _iter_traverse_concurrent(
+            syn=syn,
+            synid_root=synid_root,
+            include_types=include_types,
+            max_workers=max_workers,
+            predicate=predicate,
+            snapshot=snapshot,
+            rules=rules,
+            checkpoint=checkpoint,
+            predicate_params=predicate_params,
+        )
+        return
 
     # full traverse depends on examining folder entities, even if not requested
-    include_types_mod = set(include_types)
-    include_types_mod.add("folder")
-    include_types_mod = list(include_types_mod)
+    include_types_mod = list(set(include_types) | {"folder"})
+    rules = rules or TraversalRules()
+    params = _traversal_params(rules, predicate_params)
+
+    # Folders to list with their depth and path
+    folders, found = _resume_traversal(checkpoint, synid_root, include_types, params)
+    yield from found
+    while folders:
+        # The folder is kept in the checkpoint until its listing succeeded
+        synid_folder, depth, path = folders[-1]
+        synid_children = _list_children(
+            syn, synid_folder, include_types_mod, snapshot=snapshot
+        )
+        headers, child_folders = _visit_children(
+            synid_children, depth + 1, path, include_types, predicate, rules
+        )
+        folders.pop()
+        # Child folders are listed in the order of the listing
+        folders.extend(reversed(child_folders))
+        if checkpoint is not None:
+            found.extend(headers)
+            checkpoint.update(synid_root, include_types, folders, found, params)
+        yield from headers
+    if checkpoint is not None:
+        checkpoint.clear(synid_root, include_types)
+
 
-    synid_children = syn.getChildren(parent=synid_root, includeTypes=include_types_mod)
+def _traversal_params(rules: TraversalRules, predicate_params: dict = None) -> dict:
+    """Parameters of a traversal saved with its checkpoint, as they are
+    read back from the json file
+    """
+    return {
+        "rules": {
+            "max_depth": rules.max_depth,
+            "include": rules.include,
+            "exclude": rules.exclude,
+        },
+        "predicate": json.loads(json.dumps(predicate_params)),
+    }
+
+
+def _resume_traversal(
+    checkpoint: TraversalCheckpoint,
+    synid_root: str,
+    include_types: typing.List[str],
+    params: dict = None,
+) -> typing.Tuple[list, list]:
+    """Folders left to list and headers already found by a traversal,
+    resumed from the checkpoint when it was saved with the same parameters
+
+    Args:
+        checkpoint: Checkpoint saving the traversal state, or None
+        synid_root: Synapse ID of root entity
+        include_types: Entity types returned by the traversal
+        params: Parameters of the traversal, see _traversal_params
+
+    Returns:
+        (id, depth, path) of the folders to list and the entity headers
+        already found
+    """
+    saved = checkpoint.get(synid_root, include_types, params) if checkpoint else None
+    if saved is None:
+        return [(synid_root, 0, "")], []
+    logging.info(
+        f"Resuming traversal of {synid_root} with {len(saved['folders'])} "
+        "folders left to list"
+    )
+    return [tuple(folder) for folder in saved["folders"]], list(saved["headers"])
+
+
+def _visit_children(
+    synid_children: typing.List[dict],
+    depth: int,
+    path: str,
+    include_types: typing.List[str],
+    predicate: typing.Callable[[dict], bool],
+    rules: TraversalRules,
+) -> typing.Tuple[list, list]:
+    """Apply the traversal filters to the children of a listed folder
+
+    Args:
+        synid_children: Entity headers of the children
+        depth: Depth of the children
+        path: Path of the listed folder from the traversed root
+        include_types: Entity types returned
+        predicate: Only return entity headers for which this returns True
+        rules: Depth limit and name or path patterns pruning the traversal
+
+    Returns:
+        Entity headers to return and (id, depth, path) of the child folders
+        to list
+    """
+    headers = []
+    folders = []
     for synid_child in synid_children:
-        entity_type = synid_child["type"].split(".")[-1].lower().replace("entity", "")
-        if entity_type == "folder":
-            synid_desc.extend(
-                _traverse(
-                    syn=syn, synid_root=synid_child["id"], include_types=include_types
-                )
+        name = synid_child.get("name") or ""
+        child_path = f"{path}/{name}" if path else name
+        if rules.excludes(name, child_path):
+            continue
+        entity_type = _entity_type(synid_child["type"])
+        if entity_type == "folder" and rules.lists(depth):
+            folders.append((synid_child["id"], depth, child_path))
+        if (
+            entity_type in include_types
+            and rules.includes(name, child_path)
+            and (predicate is None or predicate(synid_child))
+        ):
+            headers.append(synid_child)
+    return headers, folders
+
+
+def _iter_traverse_concurrent(
+    syn: Synapse,
+    synid_root: str,
+    include_types: typing.List = ["file"],
+    max_workers: int = 4,
+    predicate: typing.Callable[[dict], bool] = None,
+    snapshot: HierarchySnapshot = None,
+    rules: TraversalRules = None,
+    checkpoint: TraversalCheckpoint = None,
+    predicate_params: dict = None,
+) -> typing.Iterator[dict]:
+    """Traverse Synapse entity hierarchy with a pool of threads.  Folders
+    are listed concurrently and the child folders of each listing are
+    submitted to the pool as soon as it completes.  The order of the
+    yielded entity headers is not deterministic, but the set of entities
+    is the same as the one of the sequential traversal.  Pending listings
+    are cancelled when the consumer stops early or a listing fails.  With a
+    checkpoint, the pending listings are saved as the folders left to list.
+
+    Args:
+        syn: Synapse connection
+        synid_root: Synapse ID of root entity.
+        include_types: Must be a list of entity types (ie. [“folder”,”file”])
+            which can be found here:
+            http://docs.synapse.org/rest/org/sagebionetworks/repo/model/EntityType.html
+        max_workers: Number of threads listing folders concurrently.
+        predicate: Only yield entity headers for which this returns True.
+        snapshot: Local hierarchy snapshot used to only list the
+            containers whose children changed.
+        rules: Depth limit and name or path patterns pruning the traversal.
+        checkpoint: Checkpoint saving the traversal state at intervals.
+        predicate_params: JSON serializable parameters of the predicate,
+            ie. the time window and filters. A traversal saved with other
+            parameters or rules isn't resumed.
+
+    Yields:
+        Descendant entity headers without root entity
+    """
+    include_types_mod = list(set(include_types) | {"folder"})
+    rules = rules or TraversalRules()
+    params = _traversal_params(rules, predicate_params)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Pending listings with the id, depth and path of the listed folder
+        listings = {}
+
+        def _submit(synid_folder, depth, path):
+            listing = executor.submit(
+                _list_children, syn, synid_folder, include_types_mod, snapshot=snapshot
             )
-        if entity_type in include_types:
-            synid_desc.append(synid_child["id"])
+            listings[listing] = (synid_folder, depth, path)
 
-    return synid_desc
+        folders, found = _resume_traversal(
+            checkpoint, synid_root, include_types, params
+        )
+        for folder in folders:
+            _submit(*folder)
+        yield from found
+        try:
+            while listings:
+                done, _ = wait(listings, return_when=FIRST_COMPLETED)
+                for listing in done:
+                    # The folder is kept in the checkpoint until its listing
+                    # succeeded
+                    _, depth, path = listings[listing]
+                    headers, child_folders = _visit_children(
+                        listing.result(),
+                        depth + 1,
+                        path,
+                        include_types,
+                        predicate,
+                        rules,
+                    )
+                    del listings[listing]
+                    for child_folder in child_folders:
+                        _submit(*child_folder)
+                    if checkpoint is not None:
+                        found.extend(headers)
+                        checkpoint.update(
+                            synid_root,
+                            include_types,
+                            listings.values(),
+                            found,
+                            params,
+                        )
+                    yield from headers
+            if checkpoint is not None:
+                checkpoint.clear(synid_root, include_types)
+        finally:
+            for listing in listings:
+                listing.cancel()
 
 
 def _traverse_root(
     syn: Synapse,
     synid_root: str,
     include_types: typing.List = ["file"],
+    max_workers: int = 1,
+    checkpoint: TraversalCheckpoint = None,
 ) -> list:
     """Wrapper for call traverse to include root.
 
@@ -183,42 +1244,271 @@ def _traverse_root(
         include_types (typing.List, optional): Must be a list of entity types (ie. [“folder”,”file”])
             which can be found here:
             http://docs.synapse.org/rest/org/sagebionetworks/repo/model/EntityType.html
+        max_workers (int, optional): Number of threads listing folders concurrently.
+        checkpoint (TraversalCheckpoint, optional): Checkpoint saving the
+            traversal state at intervals, resumed when it was saved.
 
     Returns:
         list: List of descendant Synapse IDs with root Synapse ID
     """
-    synid_desc = _traverse(syn, synid_root, include_types)
+    synid_desc = _traverse(
+        syn,
+        synid_root,
+        include_types,
+        max_workers=max_workers,
+        checkpoint=checkpoint,
+    )
     entity = syn.get(synid_root, downloadFile=False)
-    entity_type = entity["concreteType"].split(".")[-1].lower().replace("entity", "")
+    entity_type = _entity_type(entity["concreteType"])
     if entity_type in include_types:
         synid_desc.append(synid_root)
 
     return synid_desc
 
 
+def _modified_params(value: int, unit: str, query: ViewQuery) -> dict:
+    """Parameters of the predicate selecting modified entities during a
+    traversal.  A resumed traversal keeps the headers found before it was
+    interrupted, so it is only resumed with the same time window and
+    filters.
+    """
+    return {"cutoff": [value, unit], "filters": query.filters}
+
+
 def _find_modified_entities_container(
-    syn: Synapse, syn_id: str, value: int = 1, unit: str = "day"
+    syn: Synapse,
+    syn_id: str,
+    value: int = 1,
+    unit: str = "day",
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    rules: TraversalRules = None,
+    checkpoint: TraversalCheckpoint = None,
+    query: ViewQuery = None,
+    visit: typing.Callable[[dict], None] = None,
 ) -> list:
-    """Finds entities in a folder or project modified in the past {value} {unit}
+    """Finds entities in a folder or project modified in the past {value} {unit}.
+    See _iter_modified_entities_container.
+
+    Returns:
+        List of synapse ids
+    """
+    return list(
+        _iter_modified_entities_container(
+            syn=syn,
+            syn_id=syn_id,
+            value=value,
+            unit=unit,
+            max_workers=max_workers,
+            snapshot=snapshot,
+            rules=rules,
+            checkpoint=checkpoint,
+            query=query,
+            visit=visit,
+        )
+    )
+
+
+def _iter_modified_entities_container(
+    syn: Synapse,
+    syn_id: str,
+    value: int = 1,
+    unit: str = "day",
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    rules: TraversalRules = None,
+    checkpoint: TraversalCheckpoint = None,
+    query: ViewQuery = None,
+    visit: typing.Callable[[dict], None] = None,
+) -> typing.Iterator[ModifiedEntity]:
+    """Yields entities in a folder or project modified in the past
+    {value} {unit} while the hierarchy is traversed
 
     Args:
         syn: Synapse connection
         syn_id: Synapse Folder or Project Id
         value: number of time units
         unit: time unit
+        max_workers: Number of threads listing folders concurrently
+        snapshot: Local hierarchy snapshot used to only list the
+                  containers whose children changed
+        rules: Depth limit and name or path patterns pruning the traversal
+        checkpoint: Checkpoint saving the traversal state at intervals,
+                    resumed when it was saved
+        query: Filters applied to the entity headers of the children
+               listing, see ViewQuery.check_headers
+        visit: Called with the entity header of each File entity visited
+
+    Yields:
+        Modified entities
+    """
+    query = query or ViewQuery()
+    query.check_headers()
+    # The children listing already contains modifiedOn, so the time window
+    # is applied during the walk without fetching every File entity
+    cutoff = _get_modified_cutoff(value, unit)
+
+    def _modified(header):
+        if visit is not None:
+            visit(header)
+        return _parse_modified_on(header["modifiedOn"]) > cutoff and query.matches(
+            header
+        )
+
+    headers = _iter_traverse_headers(
+        syn,
+        syn_id,
+        max_workers=max_workers,
+        predicate=_modified,
+        snapshot=snapshot,
+        rules=rules,
+        checkpoint=checkpoint,
+        predicate_params=_modified_params(value, unit, query),
+    )
+    for header in headers:
+        yield ModifiedEntity.from_header(header)
+
+
+def _estimate_hierarchy(syn: Synapse, syn_id: str, max_listings: int = 10) -> dict:
+    """Estimate the size of the hierarchy of a container by probing at most
+    max_listings folders breadth first.  The child counts of the probed
+    folders are extrapolated to the folders left to probe.
+
+    Args:
+        syn: Synapse connection
+        syn_id: Synapse Folder or Project Id
+        max_listings: Maximum number of folders probed
 
     Returns:
-        List of synapse ids
+        Dict with the estimated number of File and Folder descendants
+        (entities), of folders with the container (folders) and the number
+        of probed folders (listings). Exact when every folder was probed.
+    """
+    folders = collections.deque([syn_id])
+    counted = 0
+    found_folders = 0
+    listings = 0
+    while folders and listings < max_listings:
+        request = {
+            "parentId": folders.popleft(),
+            "includeTypes": ["folder", "file"],
+            "includeTotalChildCount": True,
+        }
+        response = syn.restPOST("/entity/children", body=json.dumps(request))
+        listings += 1
+        counted += response.get("totalChildCount", 0)
+        # Only the folders of the first page are probed further
+        child_folders = [
+            header["id"]
+            for header in response.get("page", [])
+            if _entity_type(header["type"]) == "folder"
+        ]
+        found_folders += len(child_folders)
+        folders.extend(child_folders)
+    return {
+        "entities": counted + round(len(folders) * counted / listings),
+        "folders": 1 + found_folders + round(len(folders) * found_folders / listings),
+        "listings": listings,
+    }
+
+
+def _estimate_descendants(syn: Synapse, syn_id: str, max_listings: int = 10) -> int:
+    """Estimate the number of File and Folder descendants of a container.
+    See _estimate_hierarchy.
+
+    Returns:
+        Estimated number of descendants, exact when every folder was probed
+    """
+    return _estimate_hierarchy(syn, syn_id, max_listings=max_listings)["entities"]
+
+
+def _estimate_registered(syn: Synapse, syn_id: str, views: ViewRegistry) -> dict:
+    """Estimate the size of a container without File View, unless its
+    estimate is stored in the registry.  New estimates are stored, so that
+    containers too small for a File View aren't probed on every run.
+
+    Args:
+        syn: Synapse connection
+        syn_id: Synapse Folder or Project Id
+        views: Registry of the File Views of containers
+
+    Returns:
+        Dict with the estimated number of File and Folder descendants
+        (entities), of folders (folders) and the number of listings made
+    """
+    estimate = views.get_estimate(syn_id)
+    if estimate is not None:
+        return dict(estimate, listings=0)
+    hierarchy = _estimate_hierarchy(syn, syn_id)
+    views.set_estimate(syn_id, hierarchy["entities"], hierarchy["folders"])
+    views.save()
+    return hierarchy
+
+
+def _find_file_view(syn: Synapse, project_id: str, scope_id: str) -> str:
+    """Find a File View of a Project scoped exactly to a container
+
+    Args:
+        syn: Synapse connection
+        project_id: Synapse Project Id
+        scope_id: Synapse Folder or Project Id
+
+    Returns:
+        Synapse ID of File View or None
     """
-    syn_id_mod = []
-    syn_id_children = _traverse_root(syn, syn_id)
+    for child in syn.getChildren(project_id, includeTypes=["entityview"]):
+        view = syn.get(child["id"])
+        scope_ids = [str(scope).replace("syn", "") for scope in view.scopeIds]
+        if (
+            scope_ids == [scope_id.replace("syn", "")]
+            and view.viewTypeMask & EntityViewType.FILE.value
+        ):
+            return view.id
+    return None
+
 
-    for syn_id_child in syn_id_children:
-        syn_id_res = _find_modified_entities_file(syn, syn_id_child, value, unit)
-        if syn_id_res:
-            syn_id_mod.extend(syn_id_res)
+def _get_container_view(
+    syn: Synapse, syn_id: str, views: ViewRegistry, estimate: int = None
+) -> str:
+    """Get the File View monitoring a container when it is big enough to be
+    monitored with a File View.  An existing File View of its Project
+    scoped to the container is reused, otherwise one is created.
+
+    Args:
+        syn: Synapse connection
+        syn_id: Synapse Folder or Project Id
+        views: Registry of the File Views of containers
+        estimate: Estimated number of descendants, estimated if None
 
-    return syn_id_mod
+    Returns:
+        Synapse ID of File View or None if the container is traversed
+    """
+    view_id = views.get(syn_id)
+    if view_id is not None:
+        return view_id
+    if estimate is None:
+        estimate = _estimate_registered(syn, syn_id, views)["entities"]
+    if estimate < views.min_entities:
+        return None
+
+    # The path goes from the root of Synapse to the entity itself
+    project_id = syn.restGET(f"/entity/{syn_id}/path")["path"][1]["id"]
+    view_id = _find_file_view(syn, project_id, syn_id)
+    if view_id is None:
+        try:
+            view_id = create_file_view(
+                syn,
+                name=f"synapsemonitor {syn_id}",
+                project_id=project_id,
+                scope_ids=[syn_id],
+            ).id
+        except SynapseHTTPError as ex:
+            logging.warning(f"Traversing {syn_id}, can't create a File View: {ex}")
+            return None
+    logging.info(f"Monitoring {syn_id} (~{estimate} entities) with {view_id}")
+    views.set(syn_id, view_id)
+    views.save()
+    return view_id
 
 
 def _force_update_view(syn: Synapse, view_id: str):
@@ -234,56 +1524,717 @@ def _force_update_view(syn: Synapse, view_id: str):
     syn.tableQuery(f"select * from {view_id} limit 1")
 
 
-def _get_user_ids(syn: Synapse, users: list = None):
+def _get_user_id(syn: Synapse, user: typing.Union[int, str] = None) -> str:
+    """Get the user id of a user id or username
+
+    Args:
+        syn: Synapse connection
+        user: Synapse user Id or username. Logged in user if None.
+
+    Returns:
+        Synapse user Id
+    """
+    if user is None:
+        return syn.getUserProfile()["ownerId"]
+    return syn.getUserProfile(user)["ownerId"]
+
+
+def _get_user_ids(syn: Synapse, users: list = None, user_ids: dict = None):
     """Get users ids from list of user ids or usernames.  This will also
-    confirm that the users specified exist in the system
+    confirm that the users specified exist in the system.  Every user is
+    only resolved once.
 
     Args:
         syn: Synapse connection
         users: List of Synapse user Ids or usernames
+        user_ids: Resolved user ids by user Id or username, shared between
+                  calls of the same run. Only kept for this call if None.
 
     Returns:
         List of Synapse user Ids.
     """
-    if users is None:
-        user_ids = [syn.getUserProfile()["ownerId"]]
-    else:
-        user_ids = [syn.getUserProfile(user)["ownerId"] for user in users]
-    return user_ids
+    if user_ids is None:
+        user_ids = {}
+    # The logged in user is resolved without a user
+    users = [None] if users is None else users
+    for user in users:
+        if user not in user_ids:
+            user_ids[user] = _get_user_id(syn, user)
+    return [user_ids[user] for user in users]
 
 
 def find_modified_entities(
-    syn: Synapse, syn_id: str, value: int = 1, unit: str = "day"
+    syn: Synapse,
+    syn_id: str,
+    value: int = 1,
+    unit: str = "day",
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    watermarks: WatermarkStore = None,
+    page_size: int = None,
+    rules: TraversalRules = None,
+    views: ViewRegistry = None,
+    checkpoint: TraversalCheckpoint = None,
+    query: ViewQuery = None,
+    visit: typing.Callable[[dict], None] = None,
 ) -> list:
-    """Find modified entities based on the type of the input
+    """Find modified entities based on the type of the input.
+    See iter_modified_entities.
+
+    Returns:
+        List of synapse ids
+    """
+    return list(
+        iter_modified_entities(
+            syn=syn,
+            syn_id=syn_id,
+            value=value,
+            unit=unit,
+            max_workers=max_workers,
+            snapshot=snapshot,
+            watermarks=watermarks,
+            page_size=page_size,
+            rules=rules,
+            views=views,
+            checkpoint=checkpoint,
+            query=query,
+            visit=visit,
+        )
+    )
+
+
+def iter_modified_entities(
+    syn: Synapse,
+    syn_id: str,
+    value: int = 1,
+    unit: str = "day",
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    watermarks: WatermarkStore = None,
+    page_size: int = None,
+    rules: TraversalRules = None,
+    views: ViewRegistry = None,
+    checkpoint: TraversalCheckpoint = None,
+    query: ViewQuery = None,
+    visit: typing.Callable[[dict], None] = None,
+) -> typing.Iterator[ModifiedEntity]:
+    """Yield modified entities based on the type of the input as they are
+    found, so that they can be acted upon before the search completes.
+    Watermarks only move once all modified entities were consumed.
 
     Args:
         syn: Synapse connection
         syn_id: Synapse Entity Id
         value: number of time units
         unit: time unit
+        max_workers: Number of threads listing folders or querying File View
+                     pages concurrently
+        snapshot: Local hierarchy snapshot used to only list the
+                  containers whose children changed
+        watermarks: High-watermarks used to only report entities in a
+                    File View modified since the last run
+        page_size: Query File Views in pages of this many rows
+        rules: Depth limit and name or path patterns pruning the traversal
+               of Folders and Projects
+        views: Registry of File Views monitoring big Folders and Projects
+               instead of traversing them. Not used with rules.
+        checkpoint: Checkpoint saving the traversal of Folders and Projects
+                    at intervals, resumed when it was saved
+        query: Columns selected and filters pushed down into File View
+               queries. Folders and Projects are only filtered on entity
+               header fields, File and Table entities aren't filtered.
+        visit: Called with the entity header of each File entity visited by
+               a traversal. File View rows and File entities are visited
+               without their header.
 
-    Returns:
-        List of synapse ids
+    Yields:
+        Modified entities
     """
 
+    # Entities found without traversal are the only ones visited
+    visit_found = visit if visit is not None else lambda header: None
     entity = syn.get(syn_id, downloadFile=False)
     if isinstance(entity, synapseclient.EntityViewSchema):
-        return _find_modified_entities_fileview(
-            syn=syn, syn_id=syn_id, value=value, unit=unit
+        found = _iter_modified_entities_view(
+            syn=syn,
+            syn_id=syn_id,
+            value=value,
+            unit=unit,
+            watermarks=watermarks,
+            page_size=page_size,
+            max_workers=max_workers,
+            query=query,
         )
+        for modified_entity in found:
+            visit_found(None)
+            yield modified_entity
     elif isinstance(entity, (synapseclient.File, synapseclient.Schema)):
-        return _find_modified_entities_file(
+        visit_found(None)
+        yield from _find_modified_entities_file(
             syn=syn, syn_id=syn_id, value=value, unit=unit
         )
     elif isinstance(entity, (synapseclient.Folder, synapseclient.Project)):
-        return _find_modified_entities_container(
-            syn=syn, syn_id=syn_id, value=value, unit=unit
-        )
+        # Traversal rules can't be applied to a File View
+        view_id = None
+        if views is not None and rules is None:
+            view_id = _get_container_view(syn, syn_id, views)
+        if view_id is not None:
+            found = _iter_modified_entities_view(
+                syn=syn,
+                syn_id=view_id,
+                value=value,
+                unit=unit,
+                watermarks=watermarks,
+                page_size=page_size,
+                max_workers=max_workers,
+                query=query,
+            )
+            for modified_entity in found:
+                visit_found(None)
+                yield modified_entity
+        else:
+            yield from _iter_modified_entities_container(
+                syn=syn,
+                syn_id=syn_id,
+                value=value,
+                unit=unit,
+                max_workers=max_workers,
+                snapshot=snapshot,
+                rules=rules,
+                checkpoint=checkpoint,
+                query=query,
+                visit=visit,
+            )
     else:
         raise ValueError(f"{type(entity)} not supported")
 
 
+def _iter_modified_entities_view(
+    syn: Synapse,
+    syn_id: str,
+    value: int = 1,
+    unit: str = "day",
+    watermarks: WatermarkStore = None,
+    page_size: int = None,
+    max_workers: int = 1,
+    query: ViewQuery = None,
+) -> typing.Iterator[ModifiedEntity]:
+    """Yield entities scoped in a fileview modified in the past {value}
+    {unit}, page by page when a page size is set.  The annotation columns
+    used by the query are added to the fileview when it lacks them.  See
+    _find_modified_entities_fileview.
+    """
+    if query is not None and query.view_columns() != ["id", "modifiedOn"]:
+        _add_view_columns(syn, syn_id, query.view_columns())
+    if page_size is not None:
+        yield from _iter_modified_entities_fileview(
+            syn=syn,
+            syn_id=syn_id,
+            value=value,
+            unit=unit,
+            watermarks=watermarks,
+            page_size=page_size,
+            max_workers=max_workers,
+            query=query,
+        )
+    else:
+        yield from _find_modified_entities_fileview(
+            syn=syn,
+            syn_id=syn_id,
+            value=value,
+            unit=unit,
+            watermarks=watermarks,
+            max_workers=max_workers,
+            query=query,
+        )
+
+
+def _get_entity_headers(syn: Synapse, syn_ids: typing.List[str]) -> list:
+    """Get the entity headers of a list of entities with bulk requests.
+    Entities that do not exist or can't be read are left out of the result.
+
+    Args:
+        syn: Synapse connection
+        syn_ids: List of Synapse Entity Ids
+
+    Returns:
+        List of entity headers (id, name, type, modifiedOn, ...)
+    """
+    headers = []
+    for start in range(0, len(syn_ids), ENTITY_HEADER_BATCH_SIZE):
+        batch = syn_ids[start : start + ENTITY_HEADER_BATCH_SIZE]
+        body = {"references": [{"targetId": syn_id} for syn_id in batch]}
+        response = syn.restPOST("/entity/header", body=json.dumps(body))
+        headers.extend(response["results"])
+    return headers
+
+
+def find_modified_entities_batch(
+    syn: Synapse,
+    syn_ids: typing.List[str],
+    value: int = 1,
+    unit: str = "day",
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    watermarks: WatermarkStore = None,
+    page_size: int = None,
+) -> list:
+    """Find modified entities for a list of entities.  The type and
+    modifiedOn of every entity is resolved with bulk entity header
+    requests, so File and Schema entities don't need to be fetched one by
+    one.  Other entities (File Views, Folders, Projects) are monitored with
+    find_modified_entities.
+
+    Args:
+        syn: Synapse connection
+        syn_ids: List of Synapse Entity Ids
+        value: number of time units
+        unit: time unit
+        max_workers: Number of threads listing folders or querying File View
+                     pages concurrently
+        snapshot: Local hierarchy snapshot used to only list the
+                  containers whose children changed
+        watermarks: High-watermarks used to only report entities in a
+                    File View modified since the last run
+        page_size: Query File Views in pages of this many rows
+
+    Returns:
+        List of synapse ids
+    """
+    cutoff = _get_modified_cutoff(value, unit)
+
+    headers = _get_entity_headers(syn, syn_ids)
+    missing = set(syn_ids) - {header["id"] for header in headers}
+    if missing:
+        logging.warning(f"Entities not found or not accessible: {sorted(missing)}")
+
+    # Schema entities have the "table" entity type
+    leaves = [
+        header
+        for header in headers
+        if _entity_type(header["type"]) in ["file", "table"]
+    ]
+    modified_entities = [
+        ModifiedEntity.from_header(header)
+        for header in leaves
+        if _parse_modified_on(header["modifiedOn"]) > cutoff
+    ]
+
+    leaf_ids = {header["id"] for header in leaves}
+    for syn_id in [header["id"] for header in headers if header["id"] not in leaf_ids]:
+        modified_entities.extend(
+            find_modified_entities(
+                syn=syn,
+                syn_id=syn_id,
+                value=value,
+                unit=unit,
+                max_workers=max_workers,
+                snapshot=snapshot,
+                watermarks=watermarks,
+                page_size=page_size,
+            )
+        )
+    return modified_entities
+
+
+def _find_modified_entities_nested(
+    syn: Synapse,
+    synid_root: str,
+    syn_ids: typing.List[str],
+    value: int = 1,
+    unit: str = "day",
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    checkpoint: TraversalCheckpoint = None,
+    query: ViewQuery = None,
+    visit: typing.Callable[[dict], None] = None,
+) -> dict:
+    """Finds entities modified in the past {value} {unit} in a folder or
+    project and in the folders nested in it with a single traversal.
+
+    Args:
+        syn: Synapse connection
+        synid_root: Synapse Folder or Project Id
+        syn_ids: Synapse Folder Ids nested in the root and the root Id
+        value: number of time units
+        unit: time unit
+        max_workers: Number of threads listing folders concurrently
+        snapshot: Local hierarchy snapshot used to only list the
+                  containers whose children changed
+        checkpoint: Checkpoint saving the traversal state at intervals,
+                    resumed when it was saved
+        query: Filters applied to the entity headers of the children
+               listing, see ViewQuery.check_headers
+        visit: Called with the entity header of each File and Folder entity
+               visited
+
+    Returns:
+        Dict mapping each Synapse Id to its list of modified synapse ids
+    """
+    query = query or ViewQuery()
+    query.check_headers()
+    cutoff = _get_modified_cutoff(value, unit)
+
+    def _folder_or_modified(header):
+        if visit is not None:
+            visit(header)
+        return _entity_type(header["type"]) == "folder" or (
+            _parse_modified_on(header["modifiedOn"]) > cutoff and query.matches(header)
+        )
+
+    headers = _traverse_headers(
+        syn,
+        synid_root,
+        include_types=["file", "folder"],
+        max_workers=max_workers,
+        predicate=_folder_or_modified,
+        snapshot=snapshot,
+        checkpoint=checkpoint,
+        predicate_params=_modified_params(value, unit, query),
+    )
+    folder_parents = {
+        header["id"]: header["parentId"]
+        for header in headers
+        if _entity_type(header["type"]) == "folder"
+    }
+
+    # Monitored containers that each folder is in, computed once per folder
+    containing = {synid_root: [synid_root]}
+
+    def _containing(synid_folder):
+        chain = []
+        while synid_folder not in containing:
+            chain.append(synid_folder)
+            synid_folder = folder_parents[synid_folder]
+        for synid_chain in reversed(chain):
+            containing[synid_chain] = containing[synid_folder] + (
+                [synid_chain] if synid_chain in syn_ids else []
+            )
+            synid_folder = synid_chain
+        return containing[synid_folder]
+
+    modified_entities = {syn_id: [] for syn_id in syn_ids}
+    for header in headers:
+        if _entity_type(header["type"]) == "file":
+            for syn_id in _containing(header["parentId"]):
+                modified_entities[syn_id].append(ModifiedEntity.from_header(header))
+    return modified_entities
+
+
+def plan_targets(
+    syn: Synapse,
+    syn_ids: typing.List[str],
+    snapshot: HierarchySnapshot = None,
+    page_size: int = None,
+    rules: TraversalRules = None,
+    views: ViewRegistry = None,
+    estimate: bool = False,
+) -> typing.Tuple[typing.Dict[str, planner.Plan], int]:
+    """Choose the strategy monitoring each entity.  Entity types come from
+    batched entity headers.  Containers are only probed to estimate their
+    size when estimate is set or when their File View may be used.
+
+    Args:
+        syn: Synapse connection
+        syn_ids: List of Synapse Entity Ids
+        snapshot: Local hierarchy snapshot
+        page_size: Query File Views in pages of this many rows
+        rules: Depth limit and name or path patterns pruning the traversal
+               of Folders and Projects
+        views: Registry of File Views monitoring big Folders and Projects
+        estimate: Estimate the size and REST calls of every container
+
+    Returns:
+        Dict mapping each Synapse Id to its plan, and the number of REST
+        calls made while planning
+    """
+    syn_ids = list(dict.fromkeys(syn_ids))
+    entity_types = {
+        header["id"]: _entity_type(header["type"])
+        for header in _get_entity_headers(syn, syn_ids)
+    }
+    planning_calls = math.ceil(len(syn_ids) / ENTITY_HEADER_BATCH_SIZE)
+
+    plans = {}
+    leaf_ids = [
+        syn_id for syn_id in syn_ids if entity_types.get(syn_id) in ["file", "table"]
+    ]
+    for plan in planner.plan_leaves(
+        leaf_ids, entity_types, batch_size=ENTITY_HEADER_BATCH_SIZE
+    ):
+        plans[plan.syn_id] = plan
+
+    # File Views can't apply traversal rules
+    use_views = views is not None and rules is None
+    for syn_id in syn_ids:
+        entity_type = entity_types.get(syn_id)
+        if entity_type not in ["folder", "project"]:
+            if syn_id not in plans:
+                # File Views and entities without headers, which raise errors
+                plans[syn_id] = planner.plan_fileview(syn_id, entity_type, page_size)
+            continue
+        view_id = views.get(syn_id) if use_views else None
+        hierarchy = {"entities": None, "folders": None, "listings": 0}
+        if use_views and view_id is None:
+            hierarchy = _estimate_registered(syn, syn_id, views)
+        elif estimate:
+            hierarchy = _estimate_hierarchy(syn, syn_id)
+        planning_calls += hierarchy["listings"]
+        plans[syn_id] = planner.plan_container(
+            syn_id,
+            entity_type,
+            entities=hierarchy["entities"],
+            folders=hierarchy["folders"],
+            snapshot_fresh=snapshot.is_fresh(syn_id) if snapshot else None,
+            view_id=view_id,
+            min_view_entities=views.min_entities if use_views else None,
+        )
+
+    # Containers nested in other traversed containers are traversed once
+    # from the outermost one.  Depths and paths are relative to each
+    # monitored container, so they are traversed on their own with rules.
+    traversed_ids = [
+        syn_id
+        for syn_id, plan in plans.items()
+        if plan.strategy in ["snapshot", "walk"]
+    ]
+    if len(traversed_ids) > 1 and rules is None:
+        ancestors = {}
+        for syn_id in traversed_ids:
+            # The path goes from the root of Synapse to the entity itself
+            path = syn.restGET(f"/entity/{syn_id}/path")["path"]
+            ancestors[syn_id] = [header["id"] for header in path[:-1]]
+        planning_calls += len(traversed_ids)
+        for syn_id in traversed_ids:
+            outer_ids = [
+                synid_outer
+                for synid_outer in ancestors[syn_id]
+                if synid_outer in ancestors
+            ]
+            if outer_ids:
+                plans[syn_id] = planner.Plan(
+                    syn_id,
+                    plans[syn_id].entity_type,
+                    "nested",
+                    rest_calls=0,
+                    entities=plans[syn_id].entities,
+                    note=f"traversed with {outer_ids[0]}",
+                    nested_in=outer_ids[0],
+                )
+    return {syn_id: plans[syn_id] for syn_id in syn_ids}, planning_calls
+
+
+def _visited(
+    entities: typing.Iterable[ModifiedEntity], visit: typing.Callable[[dict], None]
+) -> typing.Iterator[ModifiedEntity]:
+    """Visit File View rows as they are yielded, without their header"""
+    for entity in entities:
+        visit(None)
+        yield entity
+
+
+def find_modified_entities_targets(
+    syn: Synapse,
+    syn_ids: typing.List[str],
+    value: int = 1,
+    unit: str = "day",
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    watermarks: WatermarkStore = None,
+    page_size: int = None,
+    rules: TraversalRules = None,
+    views: ViewRegistry = None,
+    plans: typing.Dict[str, planner.Plan] = None,
+    checkpoint: TraversalCheckpoint = None,
+    query: ViewQuery = None,
+    metrics: RunMetrics = None,
+) -> dict:
+    """Find modified entities for many monitored entities at once.
+    See iter_modified_entities_targets.
+
+    Returns:
+        Dict mapping each Synapse Id to its list of modified synapse ids
+    """
+    modified_entities = {syn_id: [] for syn_id in dict.fromkeys(syn_ids)}
+    found = iter_modified_entities_targets(
+        syn=syn,
+        syn_ids=syn_ids,
+        value=value,
+        unit=unit,
+        max_workers=max_workers,
+        snapshot=snapshot,
+        watermarks=watermarks,
+        page_size=page_size,
+        rules=rules,
+        views=views,
+        plans=plans,
+        checkpoint=checkpoint,
+        query=query,
+        metrics=metrics,
+    )
+    for syn_id, entity in found:
+        modified_entities[syn_id].append(entity)
+    return modified_entities
+
+
+def iter_modified_entities_targets(
+    syn: Synapse,
+    syn_ids: typing.List[str],
+    value: int = 1,
+    unit: str = "day",
+    max_workers: int = 1,
+    snapshot: HierarchySnapshot = None,
+    watermarks: WatermarkStore = None,
+    page_size: int = None,
+    rules: TraversalRules = None,
+    views: ViewRegistry = None,
+    plans: typing.Dict[str, planner.Plan] = None,
+    checkpoint: TraversalCheckpoint = None,
+    query: ViewQuery = None,
+    metrics: RunMetrics = None,
+) -> typing.Iterator[typing.Tuple[str, ModifiedEntity]]:
+    """Yield the modified entities of many monitored entities as they are
+    found, with the strategy chosen for each of them by plan_targets.
+    Folders and Projects nested in other monitored Folders or Projects are
+    only traversed once, with the outermost container, and their entities
+    are yielded once that traversal completed.  File and Schema entities
+    are resolved with batched entity header requests.  Watermarks only move
+    once all modified entities were consumed.
+
+    Args:
+        syn: Synapse connection
+        syn_ids: List of Synapse Entity Ids
+        value: number of time units
+        unit: time unit
+        max_workers: Number of threads listing folders or querying File View
+                     pages concurrently
+        snapshot: Local hierarchy snapshot used to only list the
+                  containers whose children changed
+        watermarks: High-watermarks used to only report entities in a
+                    File View modified since the last run
+        page_size: Query File Views in pages of this many rows
+        rules: Depth limit and name or path patterns pruning the traversal
+               of Folders and Projects
+        views: Registry of File Views monitoring big Folders and Projects
+               instead of traversing them. Not used with rules.
+        plans: Plans of the entities, planned if None
+        checkpoint: Checkpoint saving the traversal of Folders and Projects
+                    at intervals, resumed when it was saved
+        query: Columns selected and filters pushed down into File View
+               queries. Folders and Projects are only filtered on entity
+               header fields, File and Table entities aren't filtered.
+        metrics: Metrics measuring the duration, REST calls and visited
+                 entities of each monitored entity
+
+    Yields:
+        Synapse Id of the monitored entity and modified entity
+    """
+    syn_ids = list(dict.fromkeys(syn_ids))
+    if plans is None:
+        plans, _ = plan_targets(
+            syn,
+            syn_ids,
+            snapshot=snapshot,
+            page_size=page_size,
+            rules=rules,
+            views=views,
+        )
+
+    metrics = metrics or RunMetrics()
+    for syn_id in syn_ids:
+        metrics.target(syn_id).strategy = plans[syn_id].strategy
+    leaf_ids = [syn_id for syn_id in syn_ids if plans[syn_id].strategy == "headers"]
+    if leaf_ids:
+        with metrics.measure(leaf_ids) as measurement:
+            # The modified entities carry the etag, modifiedOn and version
+            # of their header, which notifications and output columns use
+            modified_leaves = find_modified_entities_batch(
+                syn=syn, syn_ids=leaf_ids, value=value, unit=unit
+            )
+            measurement.visited += len(leaf_ids)
+        for entity in modified_leaves:
+            yield str(entity), entity
+
+    for syn_id in syn_ids:
+        plan = plans[syn_id]
+        if plan.strategy not in ["fileview", "view", "snapshot", "walk"]:
+            continue
+        nested_ids = [syn_id] + [
+            synid_nested
+            for synid_nested in syn_ids
+            if plans[synid_nested].nested_in == syn_id
+        ]
+        with metrics.measure(nested_ids) as measurement:
+            found = None
+            if plan.strategy == "fileview":
+                found = iter_modified_entities(
+                    syn=syn,
+                    syn_id=syn_id,
+                    value=value,
+                    unit=unit,
+                    max_workers=max_workers,
+                    snapshot=snapshot,
+                    watermarks=watermarks,
+                    page_size=page_size,
+                    rules=rules,
+                    query=query,
+                    visit=measurement.visit,
+                )
+            elif plan.strategy == "view":
+                view_id = _get_container_view(
+                    syn, syn_id, views, estimate=plan.entities
+                )
+                if view_id is not None:
+                    found = _visited(
+                        _iter_modified_entities_view(
+                            syn=syn,
+                            syn_id=view_id,
+                            value=value,
+                            unit=unit,
+                            watermarks=watermarks,
+                            page_size=page_size,
+                            max_workers=max_workers,
+                            query=query,
+                        ),
+                        measurement.visit,
+                    )
+            # Containers that aren't monitored with a File View are traversed
+            if found is None and len(nested_ids) == 1:
+                plan_snapshot = snapshot if plan.strategy != "walk" else None
+                found = _iter_modified_entities_container(
+                    syn=syn,
+                    syn_id=syn_id,
+                    value=value,
+                    unit=unit,
+                    max_workers=max_workers,
+                    snapshot=plan_snapshot,
+                    rules=rules,
+                    checkpoint=checkpoint,
+                    query=query,
+                    visit=measurement.visit,
+                )
+            if found is not None:
+                for entity in found:
+                    yield syn_id, entity
+                continue
+            logging.info(f"Traversing {nested_ids} once from {syn_id}")
+            nested = _find_modified_entities_nested(
+                syn=syn,
+                synid_root=syn_id,
+                syn_ids=nested_ids,
+                value=value,
+                unit=unit,
+                max_workers=max_workers,
+                snapshot=snapshot if plan.strategy == "snapshot" else None,
+                checkpoint=checkpoint,
+                query=query,
+                visit=measurement.visit,
+            )
+            for synid_nested in nested_ids:
+                for entity in nested[synid_nested]:
+                    yield synid_nested, entity
+
+
 def monitoring(
     syn: Synapse,
     syn_id: str,
@@ -291,7 +2242,7 @@ def monitoring(
     email_subject: str = "New Synapse Files",
     value: int = 1,
     unit: str = "day",
-) -> pd.DataFrame:
+) -> list:
     """Monitor the modifications of an entity scoped by a Fileview.
 
     Args:
@@ -305,7 +2256,7 @@ def monitoring(
         unit: time unit
 
     Returns:
-        Dataframe with files modified within past {value} {unit}
+        List of synapse ids of files modified within past {value} {unit}
     """
 
     # get dataframe of files
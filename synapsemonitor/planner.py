@@ -0,0 +1,217 @@
+"""Choice of the strategy monitoring each entity from a cost model"""
+import math
+import typing
+
+# Entity headers returned by a page of the children listing
+CHILDREN_PAGE_SIZE = 50
+# REST calls finding or creating the File View of a container
+VIEW_CREATION_CALLS = 4
+# Strategies of containers, preferred in this order at equal cost
+CONTAINER_STRATEGIES = ["view", "snapshot", "walk"]
+
+
+class Plan:
+    """Strategy monitoring an entity with its estimated cost
+
+    Strategies:
+        headers: File or Table entity, resolved with batched entity headers
+        fileview: File View queried directly
+        view: Folder or Project monitored with a File View
+        snapshot: Folder or Project traversed with the hierarchy snapshot,
+                  only listing the folders whose children changed
+        walk: Folder or Project traversed listing every folder
+        nested: Folder or Project traversed with the monitored container
+                it is nested in
+
+    Args:
+        syn_id: Synapse ID of monitored entity
+        entity_type: Entity type (ie. "folder"), None if unknown
+        strategy: Chosen strategy
+        rest_calls: Estimated number of REST calls, None if not estimated
+        entities: Estimated number of descendants of a container
+        note: Reason of the choice
+        view_id: Synapse ID of the File View of a container
+        nested_in: Synapse ID of the monitored container traversing it
+    """
+
+    def __init__(
+        self,
+        syn_id: str,
+        entity_type: str,
+        strategy: str,
+        rest_calls: int = None,
+        entities: int = None,
+        note: str = "",
+        view_id: str = None,
+        nested_in: str = None,
+    ) -> None:
+        self.syn_id = syn_id
+        self.entity_type = entity_type
+        self.strategy = strategy
+        self.rest_calls = rest_calls
+        self.entities = entities
+        self.note = note
+        self.view_id = view_id
+        self.nested_in = nested_in
+
+
+def _walk_calls(entities: int, folders: int) -> int:
+    """REST calls listing every folder of a container"""
+    return folders + math.ceil(entities / CHILDREN_PAGE_SIZE)
+
+
+def plan_leaves(
+    syn_ids: typing.List[str], entity_types: dict, batch_size: int = 1000
+) -> typing.List[Plan]:
+    """Plan File and Table entities, whose entity headers are requested
+    in batches
+
+    Args:
+        syn_ids: Synapse IDs of File and Table entities
+        entity_types: Entity type of each Synapse ID
+        batch_size: Number of entity headers requested at once
+
+    Returns:
+        List of plans, the batched calls are counted on the first one
+    """
+    batch_calls = math.ceil(len(syn_ids) / batch_size)
+    return [
+        Plan(
+            syn_id,
+            entity_types[syn_id],
+            "headers",
+            rest_calls=batch_calls if index == 0 else 0,
+            note=f"batched with {len(syn_ids)} entities",
+        )
+        for index, syn_id in enumerate(syn_ids)
+    ]
+
+
+def plan_fileview(syn_id: str, entity_type: str, page_size: int = None) -> Plan:
+    """Plan a File View, or an entity that can't be planned
+
+    Args:
+        syn_id: Synapse ID of entity
+        entity_type: Entity type, None if unknown
+        page_size: Query File Views in pages of this many rows
+
+    Returns:
+        Plan
+    """
+    if entity_type != "entityview":
+        return Plan(syn_id, entity_type, "fileview", note="type checked on run")
+    note = "paged query" if page_size is not None else "single query"
+    return Plan(syn_id, entity_type, "fileview", rest_calls=2, note=note)
+
+
+def plan_container(
+    syn_id: str,
+    entity_type: str,
+    entities: int = None,
+    folders: int = None,
+    snapshot_fresh: bool = None,
+    view_id: str = None,
+    min_view_entities: int = None,
+) -> Plan:
+    """Choose the cheapest strategy monitoring a Folder or Project.  When
+    the container size isn't estimated, the strategies are chosen in the
+    order of CONTAINER_STRATEGIES.
+
+    Args:
+        syn_id: Synapse ID of container
+        entity_type: "folder" or "project"
+        entities: Estimated number of descendants, None if not estimated
+        folders: Estimated number of folders, the container included
+        snapshot_fresh: Whether the hierarchy snapshot of the container is
+                        fresh, None without snapshot
+        view_id: Synapse ID of the registered File View of the container
+        min_view_entities: Number of descendants from which a File View is
+                           used, None if File Views can't be used
+
+    Returns:
+        Plan
+    """
+    estimated = entities is not None
+    walk_calls = 1 + _walk_calls(entities, folders) if estimated else None
+    candidates = [
+        Plan(
+            syn_id, entity_type, "walk", walk_calls, entities, "every folder is listed"
+        )
+    ]
+
+    if snapshot_fresh is not None:
+        if snapshot_fresh:
+            calls = 1 + folders if estimated else None
+            note = "fresh snapshot, only changed folders are listed"
+        else:
+            calls = walk_calls
+            note = "stale snapshot, every folder is listed and stored"
+        candidates.append(Plan(syn_id, entity_type, "snapshot", calls, entities, note))
+
+    if min_view_entities is not None:
+        if view_id is not None:
+            candidates.append(
+                Plan(
+                    syn_id,
+                    entity_type,
+                    "view",
+                    2,
+                    entities,
+                    f"registered File View {view_id}",
+                    view_id=view_id,
+                )
+            )
+        elif estimated and entities >= min_view_entities:
+            candidates.append(
+                Plan(
+                    syn_id,
+                    entity_type,
+                    "view",
+                    2 + VIEW_CREATION_CALLS,
+                    entities,
+                    f"over {min_view_entities} entities, File View found or created",
+                )
+            )
+
+    def _cost(plan):
+        rest_calls = plan.rest_calls if estimated else 0
+        return rest_calls, CONTAINER_STRATEGIES.index(plan.strategy)
+
+    return min(candidates, key=_cost)
+
+
+def format_plans(plans: typing.List[Plan], planning_calls: int = 0) -> str:
+    """Format plans as a table with the estimated total of REST calls
+
+    Args:
+        plans: List of plans
+        planning_calls: REST calls made while planning
+
+    Returns:
+        Table
+    """
+    rows = [["synapse_id", "type", "strategy", "entities", "rest_calls", "note"]]
+    for plan in plans:
+        rows.append(
+            [
+                plan.syn_id,
+                plan.entity_type or "?",
+                plan.strategy,
+                "?" if plan.entities is None else f"~{plan.entities}",
+                "?" if plan.rest_calls is None else f"~{plan.rest_calls}",
+                plan.note,
+            ]
+        )
+    # The note is the last column and isn't padded
+    widths = [max(len(row[column]) for row in rows) for column in range(5)] + [0]
+    lines = [
+        "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        for row in rows
+    ]
+    total = sum(plan.rest_calls or 0 for plan in plans)
+    unknown = " (+ unestimated)" if any(p.rest_calls is None for p in plans) else ""
+    lines.append(
+        f"Estimated REST calls: ~{total}{unknown}, "
+        f"{planning_calls} made while planning"
+    )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,215 @@
+"""Streaming outputs of modified entities"""
+from abc import ABC, abstractmethod
+import csv
+import json
+import sys
+import typing
+
+# Metadata columns that can be output and the ModifiedEntity attribute
+# holding them
+METADATA_COLUMNS = {
+    "modifiedOn": "modified_on",
+    "parentId": "parent_id",
+    "name": "name",
+    "etag": "etag",
+    "versionNumber": "version",
+}
+OUTPUT_FORMATS = ["csv", "jsonl", "parquet"]
+
+
+class EntitySink(ABC):
+    """Writes modified entities to a file as soon as they are found.  Each
+    entity is only written once.
+
+    Args:
+        output: Path or file object. Defaults to standard output.
+        columns: Metadata columns written after the Synapse ID
+        view_columns: File View columns selected by a monitor.ViewQuery,
+                      ie. annotations, written after the metadata columns
+    """
+
+    def __init__(
+        self, output: typing.Any = None, columns: list = None, view_columns: list = None
+    ) -> None:
+        columns = list(columns or [])
+        unknown = [column for column in columns if column not in METADATA_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown output columns: {', '.join(unknown)}")
+        self.view_columns = [
+            column for column in view_columns or [] if column not in columns
+        ]
+        self.columns = ["id"] + columns + self.view_columns
+        self._written = set()
+        self._owned = isinstance(output, str)
+        self._file = self._open(output) if self._owned else output or sys.stdout
+
+    def _open(self, path: str) -> typing.IO:
+        return open(path, "w", newline="")
+
+    def __enter__(self) -> "EntitySink":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _row(self, entity: str) -> dict:
+        row = {"id": str(entity)}
+        values = getattr(entity, "values", {})
+        for column in self.columns[1:]:
+            if column in self.view_columns:
+                row[column] = values.get(column)
+            else:
+                row[column] = getattr(entity, METADATA_COLUMNS[column], None)
+        return row
+
+    @abstractmethod
+    def _write_row(self, row: dict) -> None:
+        """Write the row of an entity"""
+
+    def _flush(self) -> None:
+        self._file.flush()
+
+    def write_all(self, modified_entities: typing.Iterable[str]) -> int:
+        """Write modified entities
+
+        Args:
+            modified_entities: Synapse ids, or monitor.ModifiedEntity
+
+        Returns:
+            Number of entities written, not counting those already written
+        """
+        written = 0
+        for entity in modified_entities:
+            if entity in self._written:
+                continue
+            self._written.add(str(entity))
+            self._write_row(self._row(entity))
+            written += 1
+        if written:
+            self._flush()
+        return written
+
+    def write(self, entity: str) -> bool:
+        """Write a modified entity
+
+        Args:
+            entity: Synapse id, or monitor.ModifiedEntity
+
+        Returns:
+            False if the entity was already written
+        """
+        return self.write_all([entity]) == 1
+
+    def close(self) -> None:
+        """Flush the output and close it when it was opened by the sink"""
+        self._flush()
+        if self._owned:
+            self._file.close()
+
+
+class CsvSink(EntitySink):
+    """Writes modified entities as CSV.  Synapse IDs are written without a
+    header, a header is written when metadata columns are output.
+    """
+
+    def __init__(
+        self, output: typing.Any = None, columns: list = None, view_columns: list = None
+    ) -> None:
+        super().__init__(output=output, columns=columns, view_columns=view_columns)
+        self._writer = csv.writer(self._file)
+        if len(self.columns) > 1:
+            self._writer.writerow(self.columns)
+
+    def _write_row(self, row: dict) -> None:
+        self._writer.writerow(
+            ["" if value is None else value for value in row.values()]
+        )
+
+
+class JsonlSink(EntitySink):
+    """Writes modified entities as JSON lines"""
+
+    def _write_row(self, row: dict) -> None:
+        self._file.write(json.dumps(row) + "\n")
+
+
+class ParquetSink(EntitySink):
+    """Writes modified entities as Parquet.  Rows are written in row groups
+    of row_group_size rows so that large exports are never held in memory.
+    Requires pyarrow.  File View columns are written as strings.
+
+    Args:
+        output: Path to the Parquet file
+        columns: Metadata columns written after the Synapse ID
+        view_columns: File View columns written after the metadata columns
+        row_group_size: Number of rows per row group
+    """
+
+    def __init__(
+        self,
+        output: str,
+        columns: list = None,
+        view_columns: list = None,
+        row_group_size: int = 10000,
+    ) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError(
+                "Writing Parquet requires pyarrow: pip install synapsemonitor[parquet]"
+            )
+        if not isinstance(output, str):
+            raise ValueError("Parquet can only be written to a file")
+        self._pa = pyarrow
+        self.row_group_size = row_group_size
+        self._rows = []
+        super().__init__(output=output, columns=columns, view_columns=view_columns)
+
+    def _open(self, path: str) -> typing.Any:
+        string, int64 = self._pa.string(), self._pa.int64()
+        self._schema = self._pa.schema(
+            [
+                (column, int64 if column == "versionNumber" else string)
+                for column in self.columns
+            ]
+        )
+        return self._pa.parquet.ParquetWriter(path, self._schema)
+
+    def _write_row(self, row: dict) -> None:
+        for column in self.view_columns:
+            if row[column] is not None:
+                row[column] = str(row[column])
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._rows:
+            self._file.write_table(
+                self._pa.Table.from_pylist(self._rows, schema=self._schema)
+            )
+            self._rows = []
+
+
+def open_sink(
+    output: str = None,
+    output_format: str = "csv",
+    columns: list = None,
+    view_columns: list = None,
+) -> EntitySink:
+    """Open a sink writing modified entities
+
+    Args:
+        output: Path of the output file. Defaults to standard output.
+        output_format: csv, jsonl or parquet
+        columns: Metadata columns written after the Synapse ID
+        view_columns: File View columns written after the metadata columns
+
+    Returns:
+        Entity sink
+    """
+    sinks = {"csv": CsvSink, "jsonl": JsonlSink, "parquet": ParquetSink}
+    if output_format not in sinks:
+        raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}")
+    return sinks[output_format](output, columns=columns, view_columns=view_columns)
@@ -0,0 +1,214 @@
+"""Local snapshot of a Synapse entity hierarchy"""
+from datetime import datetime, timedelta
+import sqlite3
+import threading
+import typing
+
+# Columns of the entity header fields that ViewQuery filters on, added to
+# the entities table of snapshots created without them
+FILTERED_COLUMNS = {
+    "version_number": "INTEGER",
+    "created_by": "TEXT",
+    "modified_by": "TEXT",
+}
+
+
+class HierarchySnapshot:
+    """On-disk (SQLite) snapshot of the children listings of Synapse
+    containers.  Every listing is stored with a signature of the container
+    so that later traversals only list containers whose children may
+    have changed and reuse the stored listing for the others.  The stored
+    entity headers keep the fields that filters apply to.
+
+    Args:
+        path: Path to the SQLite database. Created if it doesn't exist.
+        max_age: Stored listings older than this are always listed again.
+            Lowered by fit_window to the window of the monitoring runs.
+    """
+
+    def __init__(self, path: str, max_age: timedelta = timedelta(days=1)) -> None:
+        self.path = path
+        self.max_age = max_age
+        self._max_age = max_age
+        # Traversals can list folders from several threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entities ("
+                "id TEXT PRIMARY KEY, parent_id TEXT, name TEXT, type TEXT, "
+                "etag TEXT, modified_on TEXT, version_number INTEGER, "
+                "created_by TEXT, modified_by TEXT)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entities_parent_id "
+                "ON entities (parent_id)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS containers ("
+                "id TEXT PRIMARY KEY, include_types TEXT, signature TEXT, "
+                "listed_on TEXT)"
+            )
+            columns = [
+                row[1] for row in self._conn.execute("PRAGMA table_info(entities)")
+            ]
+            missing = [column for column in FILTERED_COLUMNS if column not in columns]
+            if missing:
+                # Snapshots created before these header fields were stored
+                # are listed again, so that filters can be applied to them
+                for column in missing:
+                    self._conn.execute(
+                        f"ALTER TABLE entities ADD COLUMN {column} "
+                        f"{FILTERED_COLUMNS[column]}"
+                    )
+                self._conn.execute("DELETE FROM containers")
+
+    def __enter__(self) -> "HierarchySnapshot":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the snapshot database"""
+        self._conn.close()
+
+    def fit_window(self, window: timedelta, since: datetime = None) -> None:
+        """Lower max_age so that the containers whose changes are hidden from
+        their signatures are listed again before these changes leave the
+        window of the next run, expected as long after this run as this run
+        after the previous one.
+
+        Args:
+            window: How far back the runs look for modified entities
+            since: UTC time of the previous run. Defaults to the last time a
+                container was listed, which is never after it.
+        """
+        if since is None:
+            with self._lock:
+                listed_on = self._conn.execute(
+                    "SELECT MAX(listed_on) FROM containers"
+                ).fetchone()[0]
+            if listed_on is None:
+                # Nothing stored yet, every container is listed
+                return
+            since = datetime.fromisoformat(listed_on)
+        self.max_age = min(self._max_age, window - (datetime.utcnow() - since))
+
+    def is_fresh(self, parent_id: str) -> bool:
+        """Whether a container was listed less than max_age ago
+
+        Args:
+            parent_id: Synapse ID of container
+
+        Returns:
+            True if the stored listing of the container is fresh
+        """
+        with self._lock:
+            container = self._conn.execute(
+                "SELECT listed_on FROM containers WHERE id = ?", (parent_id,)
+            ).fetchone()
+        return container is not None and (
+            datetime.fromisoformat(container[0]) >= datetime.utcnow() - self.max_age
+        )
+
+    def get_children(
+        self, parent_id: str, include_types: typing.List[str], signature: str
+    ) -> typing.Optional[list]:
+        """Get the stored children listing of a container
+
+        Args:
+            parent_id: Synapse ID of container
+            include_types: Entity types the container was listed with
+            signature: Current signature of the container
+
+        Returns:
+            List of entity headers or None if the stored listing is missing,
+            stale or doesn't match the signature.
+        """
+        with self._lock:
+            container = self._conn.execute(
+                "SELECT include_types, signature, listed_on FROM containers "
+                "WHERE id = ?",
+                (parent_id,),
+            ).fetchone()
+            if container is None:
+                return None
+            stored_types, stored_signature, listed_on = container
+            if (
+                stored_types != _include_types_key(include_types)
+                or stored_signature != signature
+                or datetime.fromisoformat(listed_on) < datetime.utcnow() - self.max_age
+            ):
+                return None
+            rows = self._conn.execute(
+                "SELECT id, parent_id, name, type, etag, modified_on, "
+                "version_number, created_by, modified_by FROM entities "
+                "WHERE parent_id = ?",
+                (parent_id,),
+            ).fetchall()
+        return [
+            {
+                "id": row[0],
+                "parentId": row[1],
+                "name": row[2],
+                "type": row[3],
+                "etag": row[4],
+                "modifiedOn": row[5],
+                "versionNumber": row[6],
+                "createdBy": row[7],
+                "modifiedBy": row[8],
+            }
+            for row in rows
+        ]
+
+    def put_children(
+        self,
+        parent_id: str,
+        include_types: typing.List[str],
+        signature: str,
+        headers: typing.List[dict],
+    ) -> None:
+        """Replace the stored children listing of a container
+
+        Args:
+            parent_id: Synapse ID of container
+            include_types: Entity types the container was listed with
+            signature: Current signature of the container
+            headers: Entity headers of the children of the container
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entities WHERE parent_id = ?", (parent_id,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entities (id, parent_id, name, type, etag, "
+                "modified_on, version_number, created_by, modified_by) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        header["id"],
+                        parent_id,
+                        header.get("name"),
+                        header["type"],
+                        header.get("etag"),
+                        header.get("modifiedOn"),
+                        header.get("versionNumber"),
+                        header.get("createdBy"),
+                        header.get("modifiedBy"),
+                    )
+                    for header in headers
+                ],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO containers VALUES (?, ?, ?, ?)",
+                (
+                    parent_id,
+                    _include_types_key(include_types),
+                    signature,
+                    datetime.utcnow().isoformat(),
+                ),
+            )
+
+
+def _include_types_key(include_types: typing.List[str]) -> str:
+    """Order independent key of a list of entity types"""
+    return ",".join(sorted(include_types))
@@ -0,0 +1,593 @@
+"""Local monitoring state persisted between runs"""
+import collections
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing
+
+
+def _write_text_atomic(path: str, content: str, mode: int = None) -> None:
+    """Write text to a file so that readers never see a partial file
+
+    Args:
+        path: Path of file
+        content: Text
+        mode: Permissions of the file, only readable by its owner if None
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            tmp_file.write(content)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_json_atomic(path: str, content: typing.Any) -> None:
+    """Write json to a file so that readers never see a partial file
+
+    Args:
+        path: Path of json file
+        content: JSON serializable content
+    """
+    _write_text_atomic(path, json.dumps(content))
+
+
+def _change_key(entity: str) -> str:
+    """Identify a change of a modified entity by its Synapse ID and its etag,
+    or modifiedOn or version when the etag isn't known
+
+    Args:
+        entity: Synapse id, or monitor.ModifiedEntity
+
+    Returns:
+        Key of the change
+    """
+    change = (
+        getattr(entity, "etag", None)
+        or getattr(entity, "modified_on", None)
+        or getattr(entity, "version", None)
+        or ""
+    )
+    return f"{entity}:{change}"
+
+
+class WatermarkStore:
+    """High-watermarks of monitored File Views stored in a json file.  The
+    watermark of a File View is the latest modifiedOn (epoch milliseconds)
+    already reported.  File Views index changes asynchronously, so a change
+    can show up after later ones: the lag before the watermark is queried
+    again, and the changes reported within it are kept with the watermark
+    so that they are neither missed nor reported twice.
+
+    Moved watermarks are staged until save is called for their File View,
+    so that a watermark only moves once the modified entities were acted
+    upon, and a failed target doesn't move along with the others.
+
+    Args:
+        path: Path to the json file. Created on save if it doesn't exist.
+              The watermarks are only kept in memory if None.
+        lag: Grace period before the watermark queried again for changes
+             indexed late.
+    """
+
+    def __init__(
+        self, path: str = None, lag: timedelta = timedelta(minutes=10)
+    ) -> None:
+        self.path = path
+        self.lag = lag
+        if path is not None and os.path.exists(path):
+            with open(path) as watermark_file:
+                self._watermarks = json.load(watermark_file)
+        else:
+            self._watermarks = {}
+        self._staged = {}
+
+    def get(self, view_id: str) -> typing.Optional[dict]:
+        """Get the saved watermark of a File View
+
+        Args:
+            view_id: Synapse ID of File View
+
+        Returns:
+            {"modifiedOn": epoch ms, "ids": {synapse id: epoch ms}} or None
+        """
+        watermark = self._watermarks.get(view_id)
+        if watermark is not None and isinstance(watermark["ids"], list):
+            # Watermarks saved without a lag only list the ids at modifiedOn
+            watermark = dict(
+                watermark,
+                ids={
+                    entity_id: watermark["modifiedOn"] for entity_id in watermark["ids"]
+                },
+            )
+        return watermark
+
+    def set(self, view_id: str, modified_on: int, ids: typing.Dict[str, int]) -> None:
+        """Stage moving the watermark of a File View
+
+        Args:
+            view_id: Synapse ID of File View
+            modified_on: Latest modifiedOn (epoch ms) reported
+            ids: modifiedOn (epoch ms) of the Synapse IDs reported within
+                 the lag before modified_on
+        """
+        self._staged[view_id] = {"modifiedOn": modified_on, "ids": ids}
+
+    def save(self, view_ids: typing.List[str] = None) -> None:
+        """Move the staged watermarks of File Views and write the watermarks
+        to disk
+
+        Args:
+            view_ids: Synapse IDs of the File Views whose modified entities
+                      were acted upon. All staged watermarks move if None.
+        """
+        for view_id in list(self._staged) if view_ids is None else view_ids:
+            if view_id in self._staged:
+                self._watermarks[view_id] = self._staged.pop(view_id)
+        if self.path is None:
+            return
+        _write_json_atomic(self.path, self._watermarks)
+
+
+class UserNameCache:
+    """User names of Synapse principals cached for ttl, optionally in a json
+    file so that the cache is shared between runs.
+
+    Args:
+        path: Path to the json file. The cache is only kept in memory if None.
+        ttl: Cached user names older than this are resolved again.
+    """
+
+    def __init__(self, path: str = None, ttl: timedelta = timedelta(days=1)) -> None:
+        self.path = path
+        self.ttl = ttl
+        if path is not None and os.path.exists(path):
+            with open(path) as cache_file:
+                self._user_names = json.load(cache_file)
+        else:
+            self._user_names = {}
+
+    def get(self, principal_id: typing.Union[int, str]) -> typing.Optional[str]:
+        """Get the cached user name of a principal
+
+        Args:
+            principal_id: Synapse principal Id
+
+        Returns:
+            User name or None if it isn't cached or expired
+        """
+        cached = self._user_names.get(str(principal_id))
+        if cached is None:
+            return None
+        if datetime.fromisoformat(cached["cachedOn"]) < datetime.utcnow() - self.ttl:
+            return None
+        return cached["userName"]
+
+    def set(self, principal_id: typing.Union[int, str], user_name: str) -> None:
+        """Cache the user name of a principal
+
+        Args:
+            principal_id: Synapse principal Id
+            user_name: User name
+        """
+        self._user_names[str(principal_id)] = {
+            "userName": user_name,
+            "cachedOn": datetime.utcnow().isoformat(),
+        }
+
+    def save(self) -> None:
+        """Write the unexpired user names to disk"""
+        if self.path is None:
+            return
+        self._user_names = {
+            principal_id: cached
+            for principal_id, cached in self._user_names.items()
+            if self.get(principal_id) is not None
+        }
+        _write_json_atomic(self.path, self._user_names)
+
+
+class NotificationStore:
+    """Changes of monitored entities already delivered by actions, so that
+    each change is only delivered once even when it stays in the time window
+    of several runs.  A change is identified by the monitored entity, the
+    modified entity and its etag, or modifiedOn or version when the etag
+    isn't known.  Entities found without any of them are only delivered once
+    per ttl.
+
+    Deliveries older than ttl are forgotten and only the max_entries latest
+    deliveries are kept, so the store stays small.  It only needs to cover
+    the time window of the monitored entities.
+
+    Args:
+        path: Path to the json file. The deliveries are only kept in memory
+              if None.
+        ttl: Deliveries older than this are forgotten.
+        max_entries: Maximum number of deliveries kept.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        ttl: timedelta = timedelta(days=30),
+        max_entries: int = 100000,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as store_file:
+                self._delivered = json.load(
+                    store_file, object_pairs_hook=collections.OrderedDict
+                )
+        else:
+            self._delivered = collections.OrderedDict()
+
+    @staticmethod
+    def _key(target: str, entity: str) -> str:
+        return f"{target}:{_change_key(entity)}"
+
+    def _expired(self, delivered_on: str) -> bool:
+        return datetime.fromisoformat(delivered_on) < datetime.utcnow() - self.ttl
+
+    def filter(self, target: str, modified_entities: typing.Iterable[str]) -> list:
+        """Get the modified entities whose change wasn't delivered yet
+
+        Args:
+            target: Synapse ID of monitored entity
+            modified_entities: Synapse ids, or monitor.ModifiedEntity
+
+        Returns:
+            List of modified entities not delivered yet
+        """
+        undelivered = {}
+        with self._lock:
+            for entity in modified_entities:
+                key = self._key(target, entity)
+                delivered_on = self._delivered.get(key)
+                if delivered_on is None or self._expired(delivered_on):
+                    undelivered.setdefault(key, entity)
+        return list(undelivered.values())
+
+    def mark(self, target: str, modified_entities: typing.Iterable[str]) -> None:
+        """Record that the changes of modified entities were delivered
+
+        Args:
+            target: Synapse ID of monitored entity
+            modified_entities: Synapse ids, or monitor.ModifiedEntity
+        """
+        delivered_on = datetime.utcnow().isoformat()
+        with self._lock:
+            for entity in modified_entities:
+                key = self._key(target, entity)
+                self._delivered[key] = delivered_on
+                # Keep the deliveries ordered from oldest to latest
+                self._delivered.move_to_end(key)
+            while len(self._delivered) > self.max_entries:
+                self._delivered.popitem(last=False)
+
+    def save(self) -> None:
+        """Write the unexpired deliveries to disk"""
+        if self.path is None:
+            return
+        with self._lock:
+            self._delivered = collections.OrderedDict(
+                (key, delivered_on)
+                for key, delivered_on in self._delivered.items()
+                if not self._expired(delivered_on)
+            )
+            _write_json_atomic(self.path, self._delivered)
+
+
+class ViewRegistry:
+    """File Views monitoring Folders or Projects instead of traversing them,
+    stored in a json file keyed by the Synapse ID of the scope.  Containers
+    estimated to hold at least min_entities descendants are monitored with
+    a File View, which is found in their Project or created.  The estimates
+    of smaller containers are stored too, so that they are only estimated
+    again once ttl elapsed.
+
+    Args:
+        path: Path to the json file. The registry is only kept in memory
+              if None.
+        min_entities: Estimated number of descendants from which a
+                      container is monitored with a File View.
+        ttl: Estimates older than this are estimated again.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        min_entities: int = 10000,
+        ttl: timedelta = timedelta(days=7),
+    ) -> None:
+        self.path = path
+        self.min_entities = min_entities
+        self.ttl = ttl
+        if path is not None and os.path.exists(path):
+            with open(path) as registry_file:
+                self._views = json.load(registry_file)
+        else:
+            self._views = {}
+
+    def get(self, scope_id: str) -> typing.Optional[str]:
+        """Get the File View of a container
+
+        Args:
+            scope_id: Synapse ID of Folder or Project
+
+        Returns:
+            Synapse ID of File View or None
+        """
+        view_id = self._views.get(scope_id)
+        # Containers without File View hold their estimate
+        return view_id if isinstance(view_id, str) else None
+
+    def set(self, scope_id: str, view_id: str) -> None:
+        """Register the File View of a container
+
+        Args:
+            scope_id: Synapse ID of Folder or Project
+            view_id: Synapse ID of File View scoped to the container
+        """
+        self._views[scope_id] = view_id
+
+    def get_estimate(self, scope_id: str) -> typing.Optional[dict]:
+        """Get the estimated size of a container without File View
+
+        Args:
+            scope_id: Synapse ID of Folder or Project
+
+        Returns:
+            {"entities": descendants, "folders": folders} or None if it
+            isn't stored or expired
+        """
+        estimate = self._views.get(scope_id)
+        if not isinstance(estimate, dict):
+            return None
+        if (
+            datetime.fromisoformat(estimate["estimatedOn"])
+            < datetime.utcnow() - self.ttl
+        ):
+            return None
+        return {"entities": estimate["entities"], "folders": estimate["folders"]}
+
+    def set_estimate(self, scope_id: str, entities: int, folders: int) -> None:
+        """Store the estimated size of a container without File View
+
+        Args:
+            scope_id: Synapse ID of Folder or Project
+            entities: Estimated number of descendants
+            folders: Estimated number of folders, the container included
+        """
+        self._views[scope_id] = {
+            "entities": entities,
+            "folders": folders,
+            "estimatedOn": datetime.utcnow().isoformat(),
+        }
+
+    def save(self) -> None:
+        """Write the File Views and the unexpired estimates to disk"""
+        if self.path is None:
+            return
+        self._views = {
+            scope_id: registered
+            for scope_id, registered in self._views.items()
+            if self.get(scope_id) is not None or self.get_estimate(scope_id) is not None
+        }
+        _write_json_atomic(self.path, self._views)
+
+
+class FeedCache:
+    """Summaries of the changes to Projects in each interval of their
+    activity feeds, stored in a json file keyed by the Synapse ID of the
+    Project, so that intervals that are over are only queried once.  The
+    File View queried for each Project is stored too.
+
+    Args:
+        path: Path to the json file. The cache is only kept in memory if None.
+    """
+
+    def __init__(self, path: str = None) -> None:
+        self.path = path
+        if path is not None and os.path.exists(path):
+            with open(path) as cache_file:
+                self._projects = json.load(cache_file)
+        else:
+            self._projects = {}
+
+    def _project(self, project_id: str) -> dict:
+        return self._projects.setdefault(project_id, {"view": None, "intervals": {}})
+
+    def get_view(self, project_id: str) -> typing.Optional[str]:
+        """Get the File View queried for a Project
+
+        Args:
+            project_id: Synapse Project Id
+
+        Returns:
+            Synapse ID of File View or None
+        """
+        return self._projects.get(project_id, {}).get("view")
+
+    def set_view(self, project_id: str, view_id: str) -> None:
+        """Store the File View queried for a Project
+
+        Args:
+            project_id: Synapse Project Id
+            view_id: Synapse ID of File View scoped to the Project
+        """
+        self._project(project_id)["view"] = view_id
+
+    def get(
+        self, project_id: str, interval: str, start: datetime
+    ) -> typing.Optional[dict]:
+        """Get the summary of an interval
+
+        Args:
+            project_id: Synapse Project Id
+            interval: Length of the intervals, week or month
+            start: Start of the interval
+
+        Returns:
+            Summary of the interval or None if it isn't cached
+        """
+        intervals = self._projects.get(project_id, {}).get("intervals", {})
+        return intervals.get(f"{interval} {start.isoformat()}")
+
+    def set(
+        self, project_id: str, interval: str, start: datetime, summary: dict
+    ) -> None:
+        """Cache the summary of an interval
+
+        Args:
+            project_id: Synapse Project Id
+            interval: Length of the intervals, week or month
+            start: Start of the interval
+            summary: JSON serializable summary of the interval
+        """
+        self._project(project_id)["intervals"][
+            f"{interval} {start.isoformat()}"
+        ] = summary
+
+    def save(self) -> None:
+        """Write the cache to disk"""
+        if self.path is None:
+            return
+        _write_json_atomic(self.path, self._projects)
+
+
+class TraversalCheckpoint:
+    """Frontier and partial results of hierarchy traversals saved to a json
+    file at intervals, so that an interrupted traversal is resumed without
+    listing completed folders again.  A traversal is identified by its root
+    and the entity types it returns, and is removed once it completes.  The
+    parameters that select the headers found, ie. the time window, filters
+    and rules, are saved with it, and a traversal saved with other
+    parameters is discarded rather than resumed.
+
+    Args:
+        path: Path to the json file
+        resume: Resume the traversals saved in the file, otherwise they are
+                started again
+        interval: Minimum number of seconds between two saves
+        clock: Monotonic clock in seconds
+    """
+
+    def __init__(
+        self,
+        path: str,
+        resume: bool = False,
+        interval: float = 60,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.path = path
+        self.interval = interval
+        self._clock = clock
+        self._saved = clock()
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self._traversals = json.load(checkpoint_file)
+        else:
+            self._traversals = {}
+
+    @staticmethod
+    def _key(root_id: str, include_types: typing.List[str]) -> str:
+        return f"{root_id}:{','.join(sorted(include_types))}"
+
+    def get(
+        self, root_id: str, include_types: typing.List[str], params: dict = None
+    ) -> typing.Optional[dict]:
+        """Get the saved state of a traversal
+
+        Args:
+            root_id: Synapse ID of traversed container
+            include_types: Entity types returned by the traversal
+            params: JSON serializable parameters of the traversal
+
+        Returns:
+            {"folders": [[synapse id, depth, path]], "headers": [headers],
+            "params": params} with the folders left to list and the headers
+            already found, or None.  None when the traversal was saved with
+            other parameters, in which case it is discarded.
+        """
+        key = self._key(root_id, include_types)
+        with self._lock:
+            saved = self._traversals.get(key)
+            if saved is not None and saved.get("params") != params:
+                logging.warning(
+                    f"Discarding the saved traversal of {root_id}, it was saved "
+                    "with another time window, filters or rules"
+                )
+                del self._traversals[key]
+                return None
+            return saved
+
+    def update(
+        self,
+        root_id: str,
+        include_types: typing.List[str],
+        folders: list,
+        headers: list,
+        params: dict = None,
+    ) -> None:
+        """Update the state of a traversal, saved when interval elapsed.
+        The folders and headers are only read when they are saved, so the
+        traversal keeps updating them in place and only removes a folder
+        once it was listed.
+
+        Args:
+            root_id: Synapse ID of traversed container
+            include_types: Entity types returned by the traversal
+            folders: (synapse id, depth, path) of the folders left to list
+            headers: Entity headers already found
+            params: JSON serializable parameters of the traversal
+        """
+        with self._lock:
+            self._traversals[self._key(root_id, include_types)] = {
+                "folders": folders,
+                "headers": headers,
+                "params": params,
+            }
+            if self._clock() - self._saved >= self.interval:
+                self._save()
+
+    def save(self) -> None:
+        """Save the state of the traversals, ie. when a traversal fails"""
+        with self._lock:
+            self._save()
+
+    def clear(self, root_id: str, include_types: typing.List[str]) -> None:
+        """Remove a completed traversal
+
+        Args:
+            root_id: Synapse ID of traversed container
+            include_types: Entity types returned by the traversal
+        """
+        with self._lock:
+            self._traversals.pop(self._key(root_id, include_types), None)
+            self._save()
+
+    def _save(self) -> None:
+        traversals = {
+            key: {
+                "folders": [list(folder) for folder in traversal["folders"]],
+                "headers": list(traversal["headers"]),
+                "params": traversal.get("params"),
+            }
+            for key, traversal in self._traversals.items()
+        }
+        _write_json_atomic(self.path, traversals)
+        self._saved = self._clock()
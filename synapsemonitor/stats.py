@@ -0,0 +1,257 @@
+"""Profiling of the REST calls made to Synapse"""
+import bisect
+import functools
+import json
+import re
+import threading
+import time
+import typing
+from urllib.parse import urlparse
+
+from synapseclient import Synapse
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket
+# holds the slower calls
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+def _endpoint(method: str, url: str) -> str:
+    """Name the endpoint of a Synapse REST request after its method and path,
+    with the service prefix, Synapse IDs and numbers of the path left out.
+    Other requests, ie. file downloads, are named after the host.
+
+    Args:
+        method: HTTP method
+        url: Requested URL
+
+    Returns:
+        Endpoint, ie. "GET /entity/{id}/bundle2"
+    """
+    parsed = urlparse(url)
+    match = re.match(r"/(repo|file|auth)/v1(/.*)?$", parsed.path)
+    if match is None:
+        return f"{method} {parsed.netloc}"
+    path = re.sub(r"/(syn)?\d+(\.\d+)?(?=/|$)", "/{id}", match.group(2) or "/")
+    return f"{method} {path}"
+
+
+class EndpointStats:
+    """REST calls of an endpoint
+
+    Attributes:
+        calls: Number of calls
+        errors: Number of calls that failed or returned an error status
+        seconds: Total latency in seconds
+        max_seconds: Latency of the slowest call
+        bytes_sent: Total size of the request bodies
+        bytes_received: Total size of the response bodies
+        buckets: Number of calls in each bucket of LATENCY_BUCKETS, followed
+                 by the calls slower than the last bound
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(
+        self, seconds: float, bytes_sent: int, bytes_received: int, error: bool
+    ) -> None:
+        """Record a call"""
+        self.calls += 1
+        self.errors += int(error)
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def percentile(self, fraction: float) -> typing.Optional[float]:
+        """Upper bound of the bucket holding a latency percentile, None if
+        it is in the last bucket
+        """
+        rank = fraction * self.calls
+        counted = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            counted += count
+            if counted >= rank:
+                return bound
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "max_seconds": self.max_seconds,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "latency_buckets": dict(
+                zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.buckets)
+            ),
+        }
+
+
+class RestStats:
+    """Profiles the REST calls of a Synapse connection per endpoint: number
+    of calls, errors, latency histogram and bytes sent and received.  Every
+    HTTP request is recorded, so a call retried by the Synapse client or a
+    RequestGovernor counts once per attempt.
+
+    Args:
+        clock: Monotonic clock in seconds
+    """
+
+    def __init__(self, clock: typing.Callable[[], float] = time.monotonic) -> None:
+        self.endpoints = {}
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def install(self, syn: Synapse) -> Synapse:
+        """Record the requests of the HTTP session of a Synapse connection
+
+        Args:
+            syn: Synapse connection
+
+        Returns:
+            The Synapse connection
+        """
+        session = syn._requests_session
+        send = session.send
+
+        @functools.wraps(send)
+        def _recorded(request, **kwargs):
+            started = self._clock()
+            bytes_sent = len(request.body or b"")
+            try:
+                response = send(request, **kwargs)
+            except Exception:
+                self.record(
+                    _endpoint(request.method, request.url),
+                    self._clock() - started,
+                    bytes_sent=bytes_sent,
+                    error=True,
+                )
+                raise
+            # Streamed responses, ie. downloads, are read after the call
+            if kwargs.get("stream"):
+                bytes_received = int(response.headers.get("Content-Length", 0))
+            else:
+                bytes_received = len(response.content or b"")
+            self.record(
+                _endpoint(request.method, request.url),
+                self._clock() - started,
+                bytes_sent=bytes_sent,
+                bytes_received=bytes_received,
+                error=response.status_code >= 400,
+            )
+            return response
+
+        session.send = _recorded
+        return syn
+
+    def record(
+        self,
+        endpoint: str,
+        seconds: float,
+        bytes_sent: int = 0,
+        bytes_received: int = 0,
+        error: bool = False,
+    ) -> None:
+        """Record a call to an endpoint
+
+        Args:
+            endpoint: Method and path of the endpoint
+            seconds: Latency of the call
+            bytes_sent: Size of the request body
+            bytes_received: Size of the response body
+            error: Whether the call failed or returned an error status
+        """
+        with self._lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = EndpointStats()
+            self.endpoints[endpoint].record(seconds, bytes_sent, bytes_received, error)
+
+    def to_dict(self) -> dict:
+        """Statistics of each endpoint, see EndpointStats"""
+        with self._lock:
+            return {
+                endpoint: stats.to_dict()
+                for endpoint, stats in sorted(self.endpoints.items())
+            }
+
+    def save(self, path: str) -> None:
+        """Write the statistics of each endpoint to a JSON file"""
+        with open(path, "w") as stats_file:
+            json.dump(
+                {"latency_buckets": LATENCY_BUCKETS, "endpoints": self.to_dict()},
+                stats_file,
+                indent=2,
+            )
+
+    def format_table(self) -> str:
+        """Format the statistics as a table of endpoints, the slowest in
+        total first, followed by the totals
+
+        Returns:
+            Table
+        """
+        with self._lock:
+            endpoints = sorted(
+                self.endpoints.items(), key=lambda item: item[1].seconds, reverse=True
+            )
+        rows = [
+            [
+                "endpoint",
+                "calls",
+                "errors",
+                "total_s",
+                "mean_ms",
+                "p95_ms",
+                "max_ms",
+                "sent_kb",
+                "received_kb",
+            ]
+        ]
+        total = EndpointStats()
+        for endpoint, stats in endpoints:
+            p95 = stats.percentile(0.95)
+            rows.append(
+                [
+                    endpoint,
+                    str(stats.calls),
+                    str(stats.errors),
+                    f"{stats.seconds:.2f}",
+                    f"{1000 * stats.seconds / stats.calls:.0f}",
+                    (
+                        f">{LATENCY_BUCKETS[-1] * 1000:.0f}"
+                        if p95 is None
+                        else f"<={p95 * 1000:.0f}"
+                    ),
+                    f"{1000 * stats.max_seconds:.0f}",
+                    f"{stats.bytes_sent / 1024:.1f}",
+                    f"{stats.bytes_received / 1024:.1f}",
+                ]
+            )
+            total.calls += stats.calls
+            total.errors += stats.errors
+            total.seconds += stats.seconds
+            total.bytes_sent += stats.bytes_sent
+            total.bytes_received += stats.bytes_received
+        widths = [
+            max(len(row[column]) for row in rows) for column in range(len(rows[0]))
+        ]
+        lines = [
+            "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+            for row in rows
+        ]
+        lines.append(
+            f"Total: {total.calls} calls, {total.errors} errors, "
+            f"{total.seconds:.2f}s, {total.bytes_sent / 1024:.1f} kB sent, "
+            f"{total.bytes_received / 1024:.1f} kB received"
+        )
+        return "\n".join(lines) + "\n"
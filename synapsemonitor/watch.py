@@ -0,0 +1,191 @@
+"""Long-running monitoring of Synapse entities"""
+from datetime import datetime, timedelta
+import logging
+import math
+import time
+import typing
+
+from synapseclient import Synapse
+
+from . import actions, monitor
+from .metrics import RunMetrics
+from .snapshot import HierarchySnapshot
+from .state import NotificationStore, ViewRegistry, WatermarkStore, _change_key
+
+
+def _messages_sent(pipeline: actions.ActionPipeline) -> int:
+    """Number of messages sent by the actions of a pipeline"""
+    return sum(getattr(action, "messages_sent", 0) for action in pipeline.actions)
+
+
+class Watcher:
+    """Polls monitored entities on their own interval with one Synapse
+    connection.  The first poll of an entity looks back {value} {unit}, the
+    following polls only look back to the start of the previous poll (plus
+    one minute for clock skew) and changes already reported by the
+    previous poll are not reported again.  Entities modified again are
+    reported again.
+
+    Args:
+        syn: Synapse connection
+        targets: List of targets, dicts with synapse_id, users,
+                 email_subject and interval (minutes)
+        value: number of time units of the first poll
+        unit: time unit of the first poll
+        max_workers: Number of threads listing folders or querying File View
+                     pages concurrently
+        snapshot: Local hierarchy snapshot, kept open between polls. Its
+                  max_age is fitted to the window of each poll.
+        watermarks: High-watermarks of monitored File Views
+        page_size: Query File Views in pages of this many rows
+        notifications: Changes already delivered, which aren't reported
+                       again, also across restarts
+        rules: Depth limit and name or path patterns pruning the traversal
+               of Folders and Projects
+        views: Registry of File Views monitoring big Folders and Projects
+        query: Columns selected and filters pushed down into File View
+               queries
+        metrics: Metrics of the last poll of each entity, saved after each
+                 poll
+        clock: Monotonic clock in seconds
+        sleep: Function sleeping a number of seconds
+    """
+
+    def __init__(
+        self,
+        syn: Synapse,
+        targets: typing.List[dict],
+        value: int = 1,
+        unit: str = "day",
+        max_workers: int = 1,
+        snapshot: HierarchySnapshot = None,
+        watermarks: WatermarkStore = None,
+        page_size: int = None,
+        notifications: NotificationStore = None,
+        rules: monitor.TraversalRules = None,
+        views: ViewRegistry = None,
+        query: monitor.ViewQuery = None,
+        metrics: RunMetrics = None,
+        clock: typing.Callable[[], float] = time.monotonic,
+        sleep: typing.Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.syn = syn
+        self.value = value
+        self.unit = unit
+        self.max_workers = max_workers
+        self.snapshot = snapshot
+        self.watermarks = watermarks
+        self.page_size = page_size
+        self.notifications = notifications
+        self.rules = rules
+        self.views = views
+        self.query = query
+        self.metrics = metrics or RunMetrics()
+        self._clock = clock
+        self._sleep = sleep
+        self._targets = [
+            {
+                "synapse_id": target["synapse_id"],
+                "interval": target["interval"],
+                "pipeline": actions.ActionPipeline(
+                    syn=syn,
+                    syn_id=target["synapse_id"],
+                    watermarks=watermarks,
+                    notifications=notifications,
+                    views=views,
+                    actions=[
+                        actions.EmailAction(
+                            syn=syn,
+                            syn_id=target["synapse_id"],
+                            users=target.get("users"),
+                            email_subject=target.get(
+                                "email_subject", "New Synapse Files"
+                            ),
+                        )
+                    ],
+                ),
+                "next_poll": clock(),
+                "last_poll": None,
+                "reported": set(),
+            }
+            for target in targets
+        ]
+
+    def poll(self, target: dict) -> list:
+        """Find and act on the entities modified since the last poll
+
+        Args:
+            target: Watched target
+
+        Returns:
+            List of newly modified synapse ids
+        """
+        started = datetime.utcnow()
+        if target["last_poll"] is None:
+            value, unit = self.value, self.unit
+        else:
+            elapsed = (started - target["last_poll"]).total_seconds()
+            value, unit = math.ceil(elapsed / 60) + 1, "minute"
+            if self.snapshot is not None:
+                # Changes hidden from the stored listings must be found by
+                # the next poll, which only looks back as far
+                self.snapshot.fit_window(
+                    timedelta(minutes=value), since=target["last_poll"]
+                )
+
+        syn_id = target["synapse_id"]
+        self.metrics.target(syn_id).reset()
+        sent = _messages_sent(target["pipeline"])
+        with self.metrics.measure([syn_id]) as measurement:
+            modified_entities = monitor.find_modified_entities(
+                syn=self.syn,
+                syn_id=syn_id,
+                value=value,
+                unit=unit,
+                max_workers=self.max_workers,
+                snapshot=self.snapshot,
+                watermarks=self.watermarks,
+                page_size=self.page_size,
+                rules=self.rules,
+                views=self.views,
+                query=self.query,
+                visit=measurement.visit,
+            )
+            new_entities = [
+                synid_modified
+                for synid_modified in modified_entities
+                if _change_key(synid_modified) not in target["reported"]
+            ]
+            target["pipeline"].run(modified_entities=new_entities)
+        self.metrics.record(
+            syn_id,
+            modified=len(modified_entities),
+            notifications=_messages_sent(target["pipeline"]) - sent,
+        )
+        target["reported"] = {_change_key(entity) for entity in modified_entities}
+        target["last_poll"] = started
+        return new_entities
+
+    def run(self, max_polls: int = None) -> None:
+        """Poll the targets when they are due, forever or max_polls times
+
+        Args:
+            max_polls: Number of polls before returning
+        """
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            target = min(self._targets, key=lambda target: target["next_poll"])
+            delay = target["next_poll"] - self._clock()
+            if delay > 0:
+                self._sleep(delay)
+            target["next_poll"] = self._clock() + target["interval"] * 60
+            try:
+                new_entities = self.poll(target)
+                logging.info(
+                    f"{target['synapse_id']}: {len(new_entities)} modified entities"
+                )
+            except Exception:
+                # Keep watching, the entity is polled again on its next interval
+                logging.exception(f"Failed to poll {target['synapse_id']}")
+            self.metrics.save()
+            polls += 1
@@ -0,0 +1,211 @@
+"""Test actions module"""
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+from synapseclient import EntityViewSchema
+
+from synapsemonitor import actions, monitor
+from synapsemonitor.__main__ import build_parser, monitor_cli
+from synapsemonitor.state import NotificationStore, WatermarkStore
+
+
+class RecordAction(actions.SynapseAction):
+    """Action recording the modified entities it received"""
+
+    def __init__(self, syn, syn_id, fail=False):
+        self.received = None
+        self.fail = fail
+        super().__init__(syn=syn, syn_id=syn_id)
+
+    def _action(self, modified_entities):
+        if self.fail:
+            raise ValueError("action failed")
+        self.received = modified_entities
+        return len(modified_entities)
+
+
+class TestActionPipeline:
+    """Test running many actions on one scan"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.watermarks = Mock()
+
+    def test_run_scans_once(self):
+        """All actions get the result of a single scan"""
+        pipeline = actions.ActionPipeline(self.syn, "syn1", watermarks=self.watermarks)
+        records = [pipeline.register(RecordAction(self.syn, "syn1")) for _ in range(3)]
+        with patch.object(
+            monitor, "find_modified_entities", return_value=["syn2", "syn3"]
+        ) as patch_find:
+            results = pipeline.run()
+        patch_find.assert_called_once()
+        assert results == [2, 2, 2]
+        assert all(record.received == ["syn2", "syn3"] for record in records)
+        self.watermarks.save.assert_called_once_with(["syn1"])
+
+    def test_run_precomputed(self):
+        """Modified entities found beforehand are not searched again"""
+        record = RecordAction(self.syn, "syn1")
+        pipeline = actions.ActionPipeline(self.syn, "syn1", actions=[record])
+        with patch.object(monitor, "find_modified_entities") as patch_find:
+            assert pipeline.run(modified_entities=["syn2"]) == [1]
+        patch_find.assert_not_called()
+
+    def test_run_action_fails(self):
+        """Watermarks don't move when an action fails"""
+        pipeline = actions.ActionPipeline(
+            self.syn,
+            "syn1",
+            watermarks=self.watermarks,
+            actions=[
+                RecordAction(self.syn, "syn1"),
+                RecordAction(self.syn, "syn1", fail=True),
+            ],
+        )
+        with pytest.raises(ValueError, match="action failed"):
+            pipeline.run(modified_entities=["syn2"])
+        self.watermarks.save.assert_not_called()
+
+    def test_run_notifications(self):
+        """Changes are only sent to the actions once"""
+        notifications = NotificationStore()
+        record = RecordAction(self.syn, "syn1")
+        pipeline = actions.ActionPipeline(
+            self.syn, "syn1", actions=[record], notifications=notifications
+        )
+        entities = [monitor.ModifiedEntity("syn2", etag="a"), "syn3"]
+        assert pipeline.run(modified_entities=entities) == [2]
+        entities = [monitor.ModifiedEntity("syn2", etag="b"), "syn3"]
+        assert pipeline.run(modified_entities=entities) == [1]
+        assert record.received == ["syn2"]
+        assert record.received[0].etag == "b"
+
+    def test_run_notifications_action_fails(self):
+        """Changes are delivered again when an action fails"""
+        notifications = NotificationStore()
+        pipeline = actions.ActionPipeline(
+            self.syn,
+            "syn1",
+            actions=[RecordAction(self.syn, "syn1", fail=True)],
+            notifications=notifications,
+        )
+        with pytest.raises(ValueError, match="action failed"):
+            pipeline.run(modified_entities=["syn2"])
+        assert notifications.filter("syn1", ["syn2"]) == ["syn2"]
+
+
+class TestEmailAction:
+    """Test emailing modified entities"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.entities = [
+            monitor.ModifiedEntity("syn2", parent_id="syn1", name="a.txt"),
+            monitor.ModifiedEntity("syn3", parent_id="syn5", name="b.txt"),
+            monitor.ModifiedEntity("syn4", parent_id="syn1", name="c.txt"),
+        ]
+
+    def test_action(self):
+        """Modified entities are emailed grouped by parent"""
+        email = actions.EmailAction(
+            self.syn, "syn1", users=["user"], email_subject="subject"
+        )
+        with patch.object(monitor, "_get_user_ids", return_value=[111]):
+            assert email.action(modified_entities=self.entities) == self.entities
+        self.syn.sendMessage.assert_called_once()
+        user_ids, subject, message = self.syn.sendMessage.call_args[0]
+        assert user_ids == [111]
+        assert subject == "subject"
+        assert message.index("a.txt") < message.index("c.txt") < message.index("syn5")
+        assert message.count("<ul>") == 2
+
+    def test_action_no_entities(self):
+        """No email is sent without modified entities"""
+        email = actions.EmailAction(self.syn, "syn1", users=["user"])
+        with patch.object(monitor, "_get_user_ids", return_value=[111]):
+            assert email.action(modified_entities=[]) == []
+        self.syn.sendMessage.assert_not_called()
+
+    def test_action_chunked(self):
+        """Long digests are split into several messages"""
+        entities = [
+            monitor.ModifiedEntity(f"syn{i}", parent_id="syn1") for i in range(100)
+        ]
+        email = actions.EmailAction(
+            self.syn,
+            "syn1",
+            users=["user"],
+            email_subject="subject",
+            max_message_length=1000,
+        )
+        with patch.object(monitor, "_get_user_ids", return_value=[111]):
+            email.action(modified_entities=entities)
+        calls = self.syn.sendMessage.call_args_list
+        assert len(calls) > 1
+        assert [call[0][1] for call in calls] == [
+            f"subject ({number}/{len(calls)})" for number in range(1, len(calls) + 1)
+        ]
+        messages = [call[0][2] for call in calls]
+        assert all(len(message) <= 1000 for message in messages)
+        assert all(message.startswith("<p>In ") for message in messages)
+        assert sum(message.count("<li>") for message in messages) == 100
+
+    def test_action_recipients_cached(self):
+        """Recipients are only resolved once"""
+        email = actions.EmailAction(self.syn, "syn1", users=["user"])
+        with patch.object(monitor, "_get_user_ids", return_value=[111]) as patch_users:
+            email.action(modified_entities=["syn2"])
+            email.action(modified_entities=["syn3"])
+        patch_users.assert_called_once_with(self.syn, ["user"], user_ids={})
+
+    def test_action_recipients_shared(self):
+        """Recipients shared by several actions are resolved once"""
+        user_ids = {}
+        with patch.object(monitor, "_get_user_id", return_value="111") as patch_user:
+            for syn_id in ["syn1", "syn2"]:
+                email = actions.EmailAction(
+                    self.syn, syn_id, users=["user"], user_ids=user_ids
+                )
+                email.action(modified_entities=["syn3"])
+        patch_user.assert_called_once_with(self.syn, "user")
+        assert user_ids == {"user": "111"}
+
+
+def test__format_digest_plain_ids():
+    """Synapse ids without parents are listed together"""
+    assert actions._format_digest(["syn2"]) == [
+        '<ul><li><a href="https://www.synapse.org/#!Synapse:syn2">syn2</a></li></ul>'
+    ]
+
+
+def test_monitor_cli_failed_target_watermark(tmp_path):
+    """The watermark of a target only moves when its email was sent"""
+    path = str(tmp_path / "watermarks.json")
+    syn = Mock()
+    syn.restPOST.return_value = {
+        "results": [
+            {"id": syn_id, "type": "org.sagebionetworks.repo.model.table.EntityView"}
+            for syn_id in ["syn1", "syn2"]
+        ]
+    }
+    syn.get.side_effect = lambda syn_id, downloadFile: EntityViewSchema(
+        id=syn_id, parent="syn0"
+    )
+    syn.tableQuery.side_effect = lambda query: [
+        [f"syn{query.split()[4][3:]}0", 1000]
+    ]
+    syn.getUserProfile.return_value = {"ownerId": "111"}
+    syn.sendMessage.side_effect = [None, ValueError("send failed")]
+    args = build_parser().parse_args(
+        ["monitor", "syn1", "syn2", "--watermark", path]
+    )
+    args.governor = None
+    with pytest.raises(ValueError, match="send failed"):
+        monitor_cli(syn, args)
+    with open(path) as watermark_file:
+        assert json.load(watermark_file) == {
+            "syn1": {"modifiedOn": 1000, "ids": {"syn10": 1000}}
+        }
+    assert WatermarkStore(path).get("syn2") is None
@@ -0,0 +1,66 @@
+"""Test benchmarks against the fake Synapse"""
+import pytest
+
+from benchmarks import suite
+from benchmarks.fake_synapse import FakeSynapse, SyntheticTree
+
+SCENARIO = {"depth": 2, "fanout": 2, "files": 60, "modified_rate": 0.1}
+
+
+@pytest.fixture(scope="module")
+def results():
+    return suite.run_suite(SCENARIO)
+
+
+def test_synthetic_tree():
+    """Every container holds the File entities and child Folders"""
+    tree = SyntheticTree(**SCENARIO)
+    assert len(tree.file_ids) == 7 * 60
+    assert len(tree.children[tree.root_id]) == 60 + 2 + 1
+    assert tree.modified_ids and tree.modified_ids < set(tree.file_ids)
+
+
+def test_fake_synapse_children_pages():
+    """Children are listed in pages and each call is counted"""
+    tree = SyntheticTree(**SCENARIO)
+    syn = FakeSynapse(tree)
+    children = list(syn.getChildren(tree.root_id, includeTypes=["file", "folder"]))
+    assert len(children) == 62
+    assert syn.calls == {"POST /entity/children": 2}
+
+
+def test_strategies_find_modified_entities(results):
+    """Every strategy finds exactly the modified File entities"""
+    assert all(measures["correct"] is not False for measures in results.values())
+
+
+def test_strategies_rest_calls(results):
+    """REST calls of each strategy are guarded against regressions"""
+    calls = {name: measures["rest_calls"] for name, measures in results.items()}
+    # 7 containers of 62 or 60 children listed in 2 pages each
+    assert calls["walk"] == calls["walk_concurrent"] == calls["traverse"] == 14
+    assert calls["snapshot_warm"] == 7
+    assert calls["fileview"] == 1
+    assert calls["email"] == 2
+
+
+def test_throttled_calls_retried():
+    """Throttled calls are retried by the request governor"""
+    tree = SyntheticTree(**SCENARIO)
+    (strategy,) = [s for s in suite.STRATEGIES if s.name == "walk_concurrent"]
+    measures = suite.run_strategy(strategy, tree, throttle_rate=0.2)
+    assert measures["correct"]
+    assert measures["rest_calls"] == 14 + measures["throttled"]
+
+
+def test_compare(results):
+    """REST calls and found entities must not grow"""
+    baseline = {name: dict(measures) for name, measures in results.items()}
+    assert suite.compare(results, baseline) == []
+    baseline["walk"]["rest_calls"] -= 1
+    baseline["fileview"]["found"] += 1
+    assert suite.compare(results, baseline, time_tolerance=None) == [
+        "walk: 14 REST calls, baseline 13",
+        f"fileview: found {results['fileview']['found']} entities, "
+        f"baseline {results['fileview']['found'] + 1}",
+    ]
@@ -0,0 +1,219 @@
+"""Test feed module"""
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+import pytest
+
+from synapsemonitor import feed, monitor
+from synapsemonitor.state import FeedCache
+
+UTC = timezone.utc
+
+
+def test_iter_intervals_week():
+    """Weeks start on Monday and the last one holds now"""
+    intervals = list(
+        feed.iter_intervals(
+            "week", datetime(2021, 3, 3), datetime(2021, 3, 16, 12, tzinfo=UTC)
+        )
+    )
+    assert intervals == [
+        (datetime(2021, 3, 1, tzinfo=UTC), datetime(2021, 3, 8, tzinfo=UTC)),
+        (datetime(2021, 3, 8, tzinfo=UTC), datetime(2021, 3, 15, tzinfo=UTC)),
+        (datetime(2021, 3, 15, tzinfo=UTC), datetime(2021, 3, 22, tzinfo=UTC)),
+    ]
+
+
+def test_iter_intervals_month():
+    """Months roll over the end of the year"""
+    intervals = list(
+        feed.iter_intervals(
+            "month", datetime(2020, 11, 20), datetime(2021, 1, 5, tzinfo=UTC)
+        )
+    )
+    assert [start.month for start, _ in intervals] == [11, 12, 1]
+    assert intervals[-1][1] == datetime(2021, 2, 1, tzinfo=UTC)
+
+
+class TestFeed:
+    """Test updating the activity feed of a Project"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.now = datetime(2021, 3, 16, 12, tzinfo=UTC)
+        self.cache = FeedCache()
+        self.cache.set_view("syn1", "syn2")
+        self.syn.getUserProfile.side_effect = lambda principal_id: {
+            "userName": f"user{principal_id}"
+        }
+        self.headers = patch.object(
+            monitor,
+            "_get_entity_headers",
+            side_effect=lambda syn, syn_ids: [
+                {"id": syn_id, "name": f"folder_{syn_id}"} for syn_id in syn_ids
+            ],
+        )
+        self.headers.start()
+
+    def teardown_method(self):
+        self.headers.stop()
+
+    def test_summarize_interval(self):
+        """Parents with many changes are summarized, others list their files"""
+        self.syn.tableQuery.return_value = [
+            ["syn10", "a.txt", "syn3", 1, 7],
+            ["syn11", "b.txt", "syn3", 2, 8],
+        ] + [[f"syn2{i}", f"{i}.bam", "syn4", 1, 7] for i in range(5)]
+        summary = feed.summarize_interval(
+            self.syn,
+            "syn2",
+            datetime(2021, 3, 8, tzinfo=UTC),
+            datetime(2021, 3, 15, tzinfo=UTC),
+            now=self.now,
+        )
+        query = self.syn.tableQuery.call_args[0][0]
+        assert "from syn2 where modifiedOn >= 1615161600000" in query
+        assert "modifiedOn < 1615766400000" in query
+        assert summary["parents"][0] == {
+            "id": "syn3",
+            "name": "folder_syn3",
+            "new": 1,
+            "updated": 1,
+            "files": [
+                {
+                    "id": "syn10",
+                    "name": "a.txt",
+                    "version": 1,
+                    "userId": "7",
+                    "userName": "user7",
+                },
+                {
+                    "id": "syn11",
+                    "name": "b.txt",
+                    "version": 2,
+                    "userId": "8",
+                    "userName": "user8",
+                },
+            ],
+        }
+        assert summary["parents"][1]["new"] == 5
+        assert summary["parents"][1]["files"] is None
+        # Users of summarized parents aren't resolved
+        assert self.syn.getUserProfile.call_count == 2
+
+    def test_update_feed_cached(self):
+        """Final intervals are only queried once, the current one each run"""
+        self.syn.tableQuery.return_value = []
+        earliest = datetime(2021, 3, 1, tzinfo=UTC)
+        summaries = feed.update_feed(
+            self.syn, "syn1", cache=self.cache, earliest=earliest, now=self.now
+        )
+        assert [summary["start"][:10] for summary in summaries] == [
+            "2021-03-15",
+            "2021-03-08",
+            "2021-03-01",
+        ]
+        assert self.syn.tableQuery.call_count == 3
+        feed.update_feed(
+            self.syn,
+            "syn1",
+            cache=self.cache,
+            earliest=earliest,
+            now=self.now + timedelta(days=1),
+        )
+        assert self.syn.tableQuery.call_count == 4
+        # Once the week has ended and settled, it is queried one last time
+        # along with the new week
+        feed.update_feed(
+            self.syn,
+            "syn1",
+            cache=self.cache,
+            earliest=earliest,
+            now=datetime(2021, 3, 22, 2, tzinfo=UTC),
+        )
+        assert self.syn.tableQuery.call_count == 6
+        self.syn.getChildren.assert_not_called()
+
+    def test_update_feed_view(self):
+        """A File View of the Project is found when none is cached"""
+        self.syn.tableQuery.return_value = []
+        cache = FeedCache()
+        with patch.object(
+            monitor, "_find_file_view", return_value="syn5"
+        ) as patch_find:
+            feed.update_feed(
+                self.syn, "syn1", cache=cache, earliest=self.now, now=self.now
+            )
+        patch_find.assert_called_once_with(self.syn, "syn1", "syn1")
+        assert cache.get_view("syn1") == "syn5"
+
+    def test_update_feed_interval(self):
+        """Only weeks and months are supported"""
+        with pytest.raises(ValueError):
+            feed.update_feed(self.syn, "syn1", interval="day")
+
+
+def test_format_feed():
+    """Intervals without changes are left out and names are escaped"""
+    summaries = [
+        {
+            "start": "2021-03-15T00:00:00+00:00",
+            "parents": [],
+        },
+        {
+            "start": "2021-03-08T00:00:00+00:00",
+            "parents": [
+                {
+                    "id": "syn4",
+                    "name": "raw_data",
+                    "new": 5,
+                    "updated": 1,
+                    "files": None,
+                },
+                {
+                    "id": "syn3",
+                    "name": "docs",
+                    "new": 1,
+                    "updated": 1,
+                    "files": [
+                        {
+                            "id": "syn10",
+                            "name": "a_b.txt",
+                            "version": 1,
+                            "userId": "7",
+                            "userName": "user7",
+                        },
+                        {
+                            "id": "syn11",
+                            "name": "c.txt",
+                            "version": 2,
+                            "userId": "8",
+                            "userName": "user8",
+                        },
+                    ],
+                },
+            ],
+        },
+    ]
+    assert feed.format_feed(summaries).splitlines() == [
+        "## Week of 08-March-2021",
+        "* 1 file was updated and 5 new files were added to "
+        "[raw\\_data](#!Synapse:syn4)",
+        "* [a\\_b.txt](#!Synapse:syn10) was added by "
+        "[user7](https://www.synapse.org/#!Profile:7)",
+        "* [c.txt](#!Synapse:syn11) was updated to version 2 by "
+        "[user8](https://www.synapse.org/#!Profile:8)",
+    ]
+    assert feed.format_feed(summaries, interval="month").startswith("## March-2021\n")
+    assert feed.format_feed(summaries[:1]) == ""
+
+
+def test_update_wiki():
+    """The wiki page is only stored when its markdown changed"""
+    syn = Mock()
+    syn.getWiki.return_value = Mock(markdown="feed")
+    assert not feed.update_wiki(syn, "syn1", "feed", wiki_id="9")
+    syn.getWiki.assert_called_once_with("syn1", "9")
+    syn.store.assert_not_called()
+    assert feed.update_wiki(syn, "syn1", "new feed")
+    syn.store.assert_called_once()
@@ -0,0 +1,115 @@
+"""Test governor module"""
+from unittest.mock import Mock
+
+import pytest
+import requests
+from synapseclient.core.exceptions import SynapseHTTPError
+
+from synapsemonitor.governor import RequestGovernor
+
+
+def _http_error(status_code, headers=None):
+    response = Mock(status_code=status_code, headers=headers or {})
+    return SynapseHTTPError(f"{status_code} error", response=response)
+
+
+class FakeClock:
+    """Clock advanced by sleep"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRequestGovernor:
+    """Test governing REST calls"""
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.governor = RequestGovernor(
+            max_concurrency=8, clock=self.clock, sleep=self.clock.sleep
+        )
+
+    def test_call_throttled(self):
+        """Throttled calls are retried and halve the concurrency"""
+        func = Mock(side_effect=[_http_error(429), _http_error(503), "result"])
+        assert self.governor.call(func, "uri", body="body") == "result"
+        assert func.call_count == 3
+        func.assert_called_with("uri", body="body")
+        assert self.governor.throttled == 2
+        assert self.governor.retries == 2
+        assert self.governor.concurrency == pytest.approx(2 + 1 / 2)
+
+    def test_call_retry_after(self):
+        """Retry-After headers are respected"""
+        func = Mock(side_effect=[_http_error(429, {"Retry-After": "7"}), "result"])
+        self.governor.call(func)
+        assert self.clock.sleeps == [7.0]
+
+    def test_call_not_retried(self):
+        """Client errors are raised without retrying"""
+        func = Mock(side_effect=_http_error(404))
+        with pytest.raises(SynapseHTTPError):
+            self.governor.call(func)
+        func.assert_called_once()
+        assert self.governor.concurrency == 8
+
+    def test_call_max_retries(self):
+        """Errors are raised once retries are exhausted"""
+        self.governor.max_retries = 2
+        func = Mock(side_effect=_http_error(502))
+        with pytest.raises(SynapseHTTPError):
+            self.governor.call(func)
+        assert func.call_count == 3
+        assert self.governor.throttled == 0
+
+    def test_call_connection_error(self):
+        """Connection errors and timeouts are retried without throttling"""
+        self.governor.max_retries = 2
+        func = Mock(
+            side_effect=[
+                requests.exceptions.ConnectionError(),
+                requests.exceptions.ReadTimeout(),
+                "result",
+            ]
+        )
+        assert self.governor.call(func) == "result"
+        assert self.governor.retries == 2
+        assert self.governor.throttled == 0
+        func = Mock(side_effect=requests.exceptions.ConnectTimeout())
+        with pytest.raises(requests.exceptions.Timeout):
+            self.governor.call(func)
+        assert func.call_count == 3
+
+    def test_concurrency_additive_increase(self):
+        """Successful calls grow the concurrency up to its maximum"""
+        self.governor.concurrency = 2
+        for _ in range(3):
+            self.governor.call(Mock())
+        assert 3 < self.governor.concurrency < 4
+        for _ in range(100):
+            self.governor.call(Mock())
+        assert self.governor.concurrency == 8
+
+    def test_rate_limit(self):
+        """Calls wait for tokens"""
+        governor = RequestGovernor(rate=2, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(4):
+            governor.call(Mock())
+        assert self.clock.now == pytest.approx(1.0)
+
+    def test_install(self):
+        """REST calls of the connection go through the governor"""
+        syn = Mock()
+        rest_get = syn.restGET
+        self.governor.install(syn)
+        syn.restGET("/entity/syn1")
+        rest_get.assert_called_once_with("/entity/syn1", retryPolicy={"retries": 0})
+        assert self.governor.calls == 1
@@ -0,0 +1,28 @@
+"""Test the modules loaded by the command line client"""
+import json
+import subprocess
+import sys
+
+
+def _loaded(code, modules):
+    """Modules among modules loaded after running code in a new interpreter"""
+    check = (
+        f"{code}; import json, sys; "
+        f"print(json.dumps([m for m in {modules!r} if m in sys.modules]))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output)
+
+
+def test_parser_imports():
+    """The command line is parsed without loading synapseclient or pandas"""
+    code = "from synapsemonitor.__main__ import build_parser; build_parser()"
+    assert _loaded(code, ["synapseclient", "pandas"]) == []
+
+
+def test_monitor_imports():
+    """Monitoring doesn't need pandas"""
+    code = "import synapsemonitor.actions, synapsemonitor.sinks, synapsemonitor.watch"
+    assert _loaded(code, ["synapseclient", "pandas"]) == ["synapseclient"]
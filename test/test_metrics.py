@@ -0,0 +1,105 @@
+"""Test metrics module"""
+import os
+from unittest.mock import Mock
+
+import pytest
+
+from synapsemonitor.metrics import RunMetrics
+
+
+class FakeClock:
+    """Clock advanced by hand"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRunMetrics:
+    """Test metrics of monitoring runs"""
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.governor = Mock(calls=0, retries=0)
+        self.metrics = RunMetrics(
+            governor=self.governor, clock=self.clock, wall_clock=lambda: 1600000000.5
+        )
+
+    def test_measure(self):
+        """Shared work is split evenly between the targets"""
+        with self.metrics.measure(["syn1", "syn2"]) as measurement:
+            self.clock.now += 3
+            self.governor.calls += 4
+            self.governor.retries += 2
+            for _ in range(6):
+                measurement.visit({"id": "syn3"})
+        with self.metrics.measure(["syn1"]):
+            self.clock.now += 1
+            self.governor.calls += 1
+        target = self.metrics.targets["syn1"]
+        assert (target.seconds, target.visited, target.api_calls, target.retries) == (
+            2.5, 3, 3, 1
+        )
+        assert self.metrics.targets["syn2"].api_calls == 2
+        assert self.metrics.targets["syn2"].success is None
+
+    def test_measure_failed(self):
+        """Targets fail when the measured work raises"""
+        self.metrics.record("syn1", modified=2)
+        with pytest.raises(ValueError):
+            with self.metrics.measure(["syn1"]):
+                self.clock.now += 1
+                raise ValueError
+        assert self.metrics.targets["syn1"].success is False
+        assert self.metrics.targets["syn1"].seconds == 1
+        # A later success doesn't hide the failure of the run
+        self.metrics.record("syn1", modified=2)
+        assert self.metrics.targets["syn1"].success is False
+
+    def test_reset(self):
+        """Resetting a target keeps the time of its last success"""
+        self.metrics.record("syn1", modified=2, notifications=1)
+        self.metrics.targets["syn1"].reset()
+        target = self.metrics.targets["syn1"]
+        assert (target.modified, target.notifications, target.success) == (0, 0, None)
+        assert target.last_success == 1600000000.5
+
+    def test_format(self):
+        """Metrics are formatted in the Prometheus text format"""
+        self.metrics.target("syn1").strategy = "walk"
+        with self.metrics.measure(["syn1"]):
+            self.clock.now += 0.25
+        self.metrics.record("syn1", modified=3, notifications=1)
+        self.metrics.target('syn"2')
+        lines = self.metrics.format().splitlines()
+        assert lines[:2] == [
+            "# HELP synapsemonitor_target_duration_seconds Seconds spent finding and "
+            "acting on the modified entities",
+            "# TYPE synapsemonitor_target_duration_seconds gauge",
+        ]
+        assert 'synapsemonitor_target_duration_seconds{target="syn1"} 0.25' in lines
+        assert 'synapsemonitor_target_duration_seconds{target="syn\\"2"} 0' in lines
+        assert 'synapsemonitor_target_modified_entities{target="syn1"} 3' in lines
+        assert 'synapsemonitor_target_success{target="syn1"} 1' in lines
+        assert (
+            'synapsemonitor_target_last_success_timestamp_seconds{target="syn1"} '
+            "1600000000.5"
+        ) in lines
+        assert 'synapsemonitor_target_info{target="syn1",strategy="walk"} 1' in lines
+        assert not any('target="syn\\"2"' in line for line in lines[-6:])
+        assert lines[-2:] == [
+            "synapsemonitor_last_run_timestamp_seconds 1600000000.5",
+            "# EOF",
+        ]
+
+    def test_save(self, tmp_path):
+        """The textfile is readable by the node exporter"""
+        path = tmp_path / "synapsemonitor.prom"
+        self.metrics.path = str(path)
+        self.metrics.record("syn1", modified=0)
+        self.metrics.save()
+        assert path.read_text() == self.metrics.format()
+        assert os.stat(path).st_mode & 0o777 == 0o644
+        assert os.listdir(tmp_path) == ["synapsemonitor.prom"]
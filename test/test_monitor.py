@@ -1,14 +1,25 @@
 """Test monitor module"""
 from datetime import datetime, timedelta
 from dateutil import tz
+import json
+import re
 from unittest import mock
 from unittest.mock import Mock, patch
 
 import pandas as pd
 import pytest
 from synapseclient import EntityViewSchema, Project, Folder, File, Entity
+from synapseclient.core.exceptions import SynapseHTTPError
+from synapseclient.table import CsvFileTable, SelectColumn
 
 from synapsemonitor import monitor
+from synapsemonitor.metrics import RunMetrics
+from synapsemonitor.state import (
+    TraversalCheckpoint,
+    UserNameCache,
+    ViewRegistry,
+    WatermarkStore,
+)
 
 
 class TestModifiedEntitiesFileView:
@@ -16,7 +27,6 @@ class TestModifiedEntitiesFileView:
 
     def setup_method(self):
         self.syn = Mock()
-        self.table_query_results = Mock()
         query_results = {
             "id": ["syn23333"],
             "name": ["test"],
@@ -56,29 +66,399 @@ class TestModifiedEntitiesFileView:
             patch_get.assert_called_once_with(333333)
             assert rendereddf.equals(self.expecteddf)
 
+    def test__render_fileview_dedupe(self):
+        """Each distinct user is only resolved once"""
+        viewdf = pd.concat([self.query_resultsdf] * 3, ignore_index=True)
+        viewdf.loc[1, "modifiedBy"] = 444444
+        with patch.object(
+            self.syn, "getUserProfile",
+            side_effect=lambda user: {"userName": f"user{user}"},
+        ) as patch_get:
+            rendereddf = monitor._render_fileview(self.syn, viewdf, max_workers=2)
+        assert patch_get.call_count == 2
+        assert rendereddf["modifiedBy"].tolist() == [
+            "user333333", "user444444", "user333333"
+        ]
+
+    def test__render_fileview_cached(self):
+        """Cached users are not resolved again"""
+        user_names = UserNameCache()
+        user_names.set(333333, "cached")
+        with patch.object(self.syn, "getUserProfile") as patch_get:
+            rendereddf = monitor._render_fileview(
+                self.syn, self.query_resultsdf, user_names=user_names
+            )
+        patch_get.assert_not_called()
+        assert rendereddf["modifiedBy"].tolist() == ["cached"]
+
     def test__find_modified_entities_fileview(self):
         """Patch finding modified entities"""
         with patch.object(
-            self.syn, "tableQuery", return_value=self.table_query_results
+            self.syn, "tableQuery", return_value=[["syn23333", 1000000000]]
         ) as patch_q, patch.object(
-            self.table_query_results, "asDataFrame", return_value=self.query_resultsdf
-        ) as patch_asdf:
+            monitor, "_get_modified_cutoff", return_value=datetime(2021, 3, 8)
+        ):
             # patch.object(monitor, "_render_fileview",
             #              return_value=self.expecteddf) as patch_render:
             modified_list = monitor._find_modified_entities_fileview(
                 self.syn, "syn44444", value=2, unit='day'
             )
             patch_q.assert_called_once_with(
-                "select id from syn44444 where "
-                "modifiedOn > unix_timestamp(NOW() - INTERVAL 2 day)*1000"
+                "select id, modifiedOn from syn44444 where "
+                "modifiedOn > 1615161600000"
             )
-            patch_asdf.assert_called_once_with()
             assert modified_list == ["syn23333"]
+            assert modified_list[0].modified_on == "1970-01-12T13:46:40.000Z"
             # patch_render.assert_called_once_with(
             #     self.syn, viewdf=self.query_resultsdf
             # )
 
 
+class TestModifiedEntitiesFileViewWatermark:
+    """Test monitoring fileviews with high-watermarks"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.watermarks = Mock()
+        self.watermarks.lag = timedelta(milliseconds=10)
+
+    def _query(self, resultsdf):
+        # Query results are iterated as rows of values
+        rows = resultsdf.values.tolist()
+        return patch.object(self.syn, "tableQuery", return_value=rows)
+
+    def test_first_run(self):
+        """The time window is used when there is no watermark"""
+        self.watermarks.get.return_value = None
+        resultsdf = pd.DataFrame(
+            {"id": ["syn1", "syn2", "syn3"], "modifiedOn": [10, 30, 30]}
+        )
+        with self._query(resultsdf) as patch_q, patch.object(
+            monitor, "_get_modified_cutoff", return_value=datetime(2021, 3, 8)
+        ):
+            modified_list = monitor._find_modified_entities_fileview(
+                self.syn, "syn44444", value=2, unit="day", watermarks=self.watermarks
+            )
+        patch_q.assert_called_once_with(
+            "select id, modifiedOn from syn44444 where modifiedOn > 1615161600000"
+        )
+        self.watermarks.set.assert_called_once_with(
+            "syn44444", 30, {"syn2": 30, "syn3": 30}
+        )
+        assert modified_list == ["syn1", "syn2", "syn3"]
+
+    def test_after_watermark(self):
+        """Only entities modified after the watermark are returned"""
+        self.watermarks.get.return_value = {"modifiedOn": 30, "ids": {"syn2": 30}}
+        resultsdf = pd.DataFrame(
+            {"id": ["syn2", "syn3", "syn4"], "modifiedOn": [30, 30, 40]}
+        )
+        with self._query(resultsdf) as patch_q:
+            modified_list = monitor._find_modified_entities_fileview(
+                self.syn, "syn44444", watermarks=self.watermarks
+            )
+        patch_q.assert_called_once_with(
+            "select id, modifiedOn from syn44444 where modifiedOn >= 20"
+        )
+        self.watermarks.set.assert_called_once_with(
+            "syn44444", 40, {"syn2": 30, "syn3": 30, "syn4": 40}
+        )
+        assert modified_list == ["syn3", "syn4"]
+
+    def test_same_watermark(self):
+        """Entities modified at the watermark are added to it"""
+        self.watermarks.get.return_value = {"modifiedOn": 30, "ids": {"syn2": 30}}
+        resultsdf = pd.DataFrame({"id": ["syn2", "syn3"], "modifiedOn": [30, 30]})
+        with self._query(resultsdf):
+            modified_list = monitor._find_modified_entities_fileview(
+                self.syn, "syn44444", watermarks=self.watermarks
+            )
+        self.watermarks.set.assert_called_once_with(
+            "syn44444", 30, {"syn2": 30, "syn3": 30}
+        )
+        assert modified_list == ["syn3"]
+
+    def test_modified_again(self):
+        """Entities at the watermark modified again later are reported"""
+        self.watermarks.get.return_value = {"modifiedOn": 30, "ids": {"syn2": 30}}
+        resultsdf = pd.DataFrame({"id": ["syn2"], "modifiedOn": [50]})
+        with self._query(resultsdf):
+            modified_list = monitor._find_modified_entities_fileview(
+                self.syn, "syn44444", watermarks=self.watermarks
+            )
+        self.watermarks.set.assert_called_once_with("syn44444", 50, {"syn2": 50})
+        assert modified_list == ["syn2"]
+
+    def test_indexed_late(self):
+        """Entities indexed after the watermark moved past their modifiedOn
+        are reported once"""
+        self.watermarks.get.return_value = {
+            "modifiedOn": 30,
+            "ids": {"syn2": 25, "syn3": 30},
+        }
+        resultsdf = pd.DataFrame(
+            {"id": ["syn2", "syn5", "syn3"], "modifiedOn": [25, 22, 30]}
+        )
+        with self._query(resultsdf):
+            modified_list = monitor._find_modified_entities_fileview(
+                self.syn, "syn44444", watermarks=self.watermarks
+            )
+        self.watermarks.set.assert_called_once_with(
+            "syn44444", 30, {"syn2": 25, "syn3": 30, "syn5": 22}
+        )
+        assert modified_list == ["syn5"]
+
+    def test_nothing_new(self):
+        """The watermark doesn't move when nothing was modified"""
+        self.watermarks.get.return_value = {"modifiedOn": 30, "ids": {"syn2": 30}}
+        resultsdf = pd.DataFrame({"id": ["syn2"], "modifiedOn": [30]})
+        with self._query(resultsdf):
+            modified_list = monitor._find_modified_entities_fileview(
+                self.syn, "syn44444", watermarks=self.watermarks
+            )
+        self.watermarks.set.assert_not_called()
+        assert modified_list == []
+
+
+def test__find_modified_entities_fileview_csv(tmp_path):
+    """Rows of CSV query results, whose modifiedOn is cast to a datetime,
+    are read exactly to the millisecond"""
+    path = tmp_path / "query.csv"
+    path.write_text(
+        "ROW_ID,ROW_VERSION,ROW_ETAG,id,modifiedOn,currentVersion\n"
+        "1,1,e1,syn1,1615161600123,1\n"
+        "2,3,e2,syn2,1615161600999,3\n"
+    )
+    results = CsvFileTable(
+        "syn44444",
+        str(path),
+        headers=[
+            SelectColumn(name="id", columnType="ENTITYID"),
+            SelectColumn(name="modifiedOn", columnType="DATE"),
+            SelectColumn(name="currentVersion", columnType="INTEGER"),
+        ],
+    )
+    syn = Mock()
+    syn.tableQuery.return_value = results
+    watermarks = WatermarkStore()
+    modified_list = monitor._find_modified_entities_fileview(
+        syn,
+        "syn44444",
+        watermarks=watermarks,
+        query=monitor.ViewQuery(columns=["versionNumber"]),
+    )
+    assert modified_list == ["syn1", "syn2"]
+    assert modified_list[1].modified_on == "2021-03-08T00:00:00.999Z"
+    assert modified_list[1].version == 3
+    watermarks.save()
+    assert watermarks.get("syn44444") == {
+        "modifiedOn": 1615161600999,
+        "ids": {"syn1": 1615161600123, "syn2": 1615161600999},
+    }
+
+
+class TestModifiedEntitiesFileViewStreaming:
+    """Test paginated fileview queries"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.rows = [[f"syn{i}", i] for i in range(5)]
+
+    def _table_query(self, query, resultsAs):
+        limit = int(query.split()[-1])
+        last = re.search(r"ROW_ID > (\d+)", query)
+        start = 0 if last is None else int(last.group(1)) + 1
+        return [
+            {"rowId": row_id, "values": self.rows[row_id]}
+            for row_id in range(start, min(start + limit, len(self.rows)))
+        ]
+
+    @pytest.mark.parametrize("max_workers", [1, 3])
+    def test__iter_fileview_rows(self, max_workers):
+        """All pages are read in order"""
+        with patch.object(
+            self.syn, "tableQuery", side_effect=self._table_query
+        ) as patch_q:
+            rows = list(
+                monitor._iter_fileview_rows(
+                    self.syn, "syn44444", ["id", "modifiedOn"], "modifiedOn > 0",
+                    page_size=2, max_workers=max_workers,
+                )
+            )
+        assert rows == self.rows
+        assert patch_q.call_count == 3
+        patch_q.assert_any_call(
+            "select id, modifiedOn from syn44444 where modifiedOn > 0 "
+            "order by ROW_ID limit 2",
+            resultsAs="rowset",
+        )
+        patch_q.assert_called_with(
+            "select id, modifiedOn from syn44444 where (modifiedOn > 0) "
+            "AND ROW_ID > 3 order by ROW_ID limit 2",
+            resultsAs="rowset",
+        )
+
+    def test__iter_modified_entities_fileview_cutoff(self):
+        """Every page is queried with the same cutoff"""
+        cutoff = datetime(2021, 3, 8)
+        with patch.object(
+            self.syn, "tableQuery", side_effect=self._table_query
+        ) as patch_q, patch.object(
+            monitor, "_get_modified_cutoff", return_value=cutoff
+        ) as patch_cutoff:
+            list(monitor._iter_modified_entities_fileview(
+                self.syn, "syn44444", value=2, unit="day", page_size=2
+            ))
+        patch_cutoff.assert_called_once_with(2, "day")
+        assert patch_q.call_count == 3
+        for call in patch_q.call_args_list:
+            assert "modifiedOn > 1615161600000" in call[0][0]
+
+    def test__iter_modified_entities_fileview_watermark(self):
+        """Watermark is moved after the last page"""
+        watermarks = Mock()
+        watermarks.lag = timedelta(milliseconds=1)
+        watermarks.get.return_value = {"modifiedOn": 0, "ids": {"syn0": 0}}
+        with patch.object(self.syn, "tableQuery", side_effect=self._table_query):
+            modified = monitor._iter_modified_entities_fileview(
+                self.syn, "syn44444", watermarks=watermarks, page_size=2
+            )
+            assert next(modified) == "syn1"
+            watermarks.set.assert_not_called()
+            assert list(modified) == ["syn2", "syn3", "syn4"]
+        watermarks.set.assert_called_once_with("syn44444", 4, {"syn3": 3, "syn4": 4})
+
+    def test__iter_modified_entities_fileview_modified_again(self):
+        """Entities at the watermark modified again later are streamed"""
+        watermarks = Mock()
+        watermarks.lag = timedelta(milliseconds=1)
+        watermarks.get.return_value = {"modifiedOn": 0, "ids": {"syn0": 0, "syn4": 0}}
+        with patch.object(self.syn, "tableQuery", side_effect=self._table_query):
+            modified = list(
+                monitor._iter_modified_entities_fileview(
+                    self.syn, "syn44444", watermarks=watermarks, page_size=2
+                )
+            )
+        assert modified == ["syn1", "syn2", "syn3", "syn4"]
+        watermarks.set.assert_called_once_with("syn44444", 4, {"syn3": 3, "syn4": 4})
+
+    def test__find_modified_entities_fileview_paged(self):
+        """Fileview is queried in pages when a page size is set"""
+        with patch.object(
+            self.syn, "tableQuery", side_effect=self._table_query
+        ) as patch_q:
+            modified_list = monitor._find_modified_entities_fileview(
+                self.syn, "syn44444", page_size=10
+            )
+        patch_q.assert_called_once()
+        assert modified_list == [f"syn{i}" for i in range(5)]
+
+
+class TestViewQuery:
+    """Test projections and filters pushed down into fileview queries"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.query = monitor.ViewQuery(
+            columns=["name", "versionNumber", "fileFormat"],
+            filters=[
+                ("fileFormat", "=", "bam"),
+                ("name", "~", "%.bam"),
+                ("versionNumber", ">", 1),
+                ("assay", "!=", "it's"),
+            ],
+        )
+
+    def test_sql(self):
+        """Columns are selected and filters compiled into the where clause"""
+        assert self.query.select() == [
+            "id",
+            "modifiedOn",
+            "name",
+            "currentVersion",
+            "fileFormat",
+        ]
+        assert self.query.view_columns()[-1] == "assay"
+        assert self.query.where("modifiedOn > 0") == (
+            "(modifiedOn > 0) AND fileFormat = 'bam' AND name LIKE '%.bam' "
+            "AND currentVersion > 1 AND assay <> 'it''s'"
+        )
+        assert monitor.ViewQuery().where("modifiedOn > 0") == "modifiedOn > 0"
+
+    @pytest.mark.parametrize(
+        "expression, query_filter",
+        [
+            ("fileFormat=bam", ("fileFormat", "=", "bam")),
+            ("name ~ %.bam", ("name", "~", "%.bam")),
+            ("versionNumber>=2", ("versionNumber", ">=", "2")),
+            ("assay!=a=b", ("assay", "!=", "a=b")),
+        ],
+    )
+    def test_parse_filter(self, expression, query_filter):
+        """Filter expressions are split on the first operator"""
+        assert monitor.ViewQuery.parse_filter(expression) == query_filter
+
+    def test_invalid(self):
+        """Column names and operators are validated"""
+        with pytest.raises(ValueError, match="Invalid filter"):
+            monitor.ViewQuery.parse_filter("fileFormat")
+        with pytest.raises(ValueError, match="Invalid column name"):
+            monitor.ViewQuery(filters=[("a;drop", "=", "b")])
+        with pytest.raises(ValueError, match="Invalid filter operator"):
+            monitor.ViewQuery(filters=[("a", "in", "b")])
+
+    def test_matches(self):
+        """Filters on entity header fields are applied to the listing"""
+        query = monitor.ViewQuery(
+            filters=[("type", "=", "file"), ("name", "~", "%.bam")]
+        )
+        query.check_headers()
+        header = {"name": "a.bam", "type": "org.sagebionetworks.repo.model.FileEntity"}
+        assert query.matches(header)
+        assert not query.matches(dict(header, name="a.bam.bai"))
+        assert monitor.ViewQuery(filters=[("versionNumber", ">", "2")]).matches(
+            {"versionNumber": 10}
+        )
+        with pytest.raises(ValueError, match="fileFormat, assay can only"):
+            self.query.check_headers()
+
+    def test__find_modified_entities_fileview(self):
+        """Only the selected columns of the matching rows are returned"""
+        results = [["syn1", 1000000000, "a.bam", 2, "bam"]]
+        with patch.object(self.syn, "tableQuery", return_value=results) as patch_q:
+            modified_list = monitor._find_modified_entities_fileview(
+                self.syn, "syn44444", query=self.query
+            )
+        query = patch_q.call_args[0][0]
+        assert query.startswith(
+            "select id, modifiedOn, name, currentVersion, fileFormat from syn44444 "
+            "where (modifiedOn > "
+        )
+        assert query.endswith("AND assay <> 'it''s'")
+        assert modified_list == ["syn1"]
+        assert (modified_list[0].name, modified_list[0].version) == ("a.bam", 2)
+        assert modified_list[0].values["fileFormat"] == "bam"
+
+    def test__add_view_columns(self):
+        """Missing annotation columns are added to the fileview"""
+        view = Mock(scopeIds=["123"])
+        annotation = {"name": "fileFormat", "columnType": "STRING"}
+        with patch.object(self.syn, "get", return_value=view), patch.object(
+            self.syn, "getColumns", return_value=[{"name": "id"}, {"name": "name"}]
+        ), patch.object(
+            self.syn, "_get_annotation_view_columns", return_value=[annotation]
+        ), patch.object(
+            self.syn, "store"
+        ) as patch_store:
+            monitor._add_view_columns(self.syn, "syn44444", ["id", "name"])
+            patch_store.assert_not_called()
+            monitor._add_view_columns(self.syn, "syn44444", ["name", "fileFormat"])
+            view.addColumns.assert_called_once_with([annotation])
+            patch_store.assert_called_once_with(view)
+            with pytest.raises(ValueError, match="assay"):
+                monitor._add_view_columns(self.syn, "syn44444", ["assay"])
+
+
 class TestModifiedContainer:
     """Test modifying containers"""
 
@@ -179,62 +559,379 @@ class TestModifiedContainer:
             
     def test__find_modified_entities_folder_modified(self):
         """Find modified entities in a folder"""
-        with patch.object(monitor, "_traverse_root",
-                          return_value=[self.folder["id"]]) as patch_get,\
-            patch.object(monitor, "_find_modified_entities_file",
-                         return_value=[self.folder["id"]]) as patch_child:
+        with patch.object(self.syn, "getChildren",
+                          return_value=[self.file_child]) as patch_child,\
+            patch.object(self.syn, "get") as patch_get:
             modified_list = monitor._find_modified_entities_container(
                 self.syn, self.folder["id"], value=self.days, unit="day"
             )
-            patch_get.assert_called()
-            patch_child.assert_called()
-            assert modified_list == ["syn1"]
+            patch_child.assert_called_once()
+            patch_get.assert_not_called()
+            assert modified_list == ["syn2"]
 
 
     def test__find_modified_entities_project_modified(self):
         """Find modified entities in a project"""
-        with patch.object(monitor, "_traverse_root",
-                          return_value=[self.project["id"]]) as patch_get,\
-            patch.object(monitor, "_find_modified_entities_file",
-                         return_value=[self.project["id"]]) as patch_child:
+        tree = {
+            "syn0": [{"id": "syn1", "type": "org.sagebionetworks.repo.model.Folder",
+                      "modifiedOn": self.past}],
+            "syn1": [self.file_child],
+        }
+        with patch.object(self.syn, "getChildren",
+                          side_effect=lambda parent, includeTypes: tree[parent]) as patch_child,\
+            patch.object(self.syn, "get") as patch_get:
             modified_list = monitor._find_modified_entities_container(
                 self.syn, self.project["id"], value=self.days, unit="day"
             )
-            patch_get.assert_called()
-            patch_child.assert_called()
-            assert modified_list == ["syn0"]
+            assert patch_child.call_count == 2
+            patch_get.assert_not_called()
+            assert modified_list == ["syn2"]
 
     def test__find_modified_entities_folder_not_modified(self):
         """Find no modified entities in a folder"""
-
-        folder = self.folder
-        folder['modifiedOn'] = self.past
-        with patch.object(monitor, "_traverse_root",
-                          return_value=[self.folder["id"]]) as patch_get,\
-            patch.object(monitor, "_find_modified_entities_file",
-                         return_value=[]) as patch_child:
+        file_child = self.file_child
+        file_child['modifiedOn'] = self.past
+        with patch.object(self.syn, "getChildren",
+                          return_value=[file_child]) as patch_child,\
+            patch.object(self.syn, "get") as patch_get:
             modified_list = monitor._find_modified_entities_container(
                 self.syn, "syn234", value=self.days, unit='day'
             )
-            patch_get.assert_called()
-            patch_child.assert_called()
+            patch_child.assert_called_once()
+            patch_get.assert_not_called()
             assert modified_list == []
 
 
-    def test__find_modified_entities_project_not_modified(self):
-        """Find no modified entities in a project"""
-        project = self.project
-        project['modifiedOn'] = self.past
-        with patch.object(monitor, "_traverse_root",
-                          return_value=[self.folder["id"]]) as patch_get,\
-            patch.object(monitor, "_find_modified_entities_file",
-                         return_value=[]) as patch_child:
+    def test__find_modified_entities_container_concurrent(self):
+        """Find modified entities in a folder with concurrent traversal"""
+        old_child = {"id": "syn3", "type": "org.sagebionetworks.repo.model.FileEntity",
+                     "modifiedOn": self.past}
+        with patch.object(self.syn, "getChildren",
+                          return_value=[self.file_child, old_child]):
             modified_list = monitor._find_modified_entities_container(
-                self.syn, "syn234", value=self.days, unit='day'
+                self.syn, "syn234", value=self.days, unit='day', max_workers=2
             )
-            patch_get.assert_called()
-            patch_child.assert_called()
-            assert modified_list == []
+            assert modified_list == ["syn2"]
+
+    def test__find_modified_entities_container_invalid_unit(self):
+        """Invalid time units are rejected before traversing"""
+        with patch.object(self.syn, "getChildren") as patch_child,\
+            pytest.raises(ValueError, match="'week' is not an accepted time unit"):
+            monitor._find_modified_entities_container(
+                self.syn, "syn234", value=self.days, unit='week'
+            )
+        patch_child.assert_not_called()
+
+
+def _get_children_tree(tree):
+    """Build a getChildren side effect from a {parent: [(id, type)]} tree.
+    Children are named after their id unless given as (id, type, name).
+    """
+
+    def _get_children(parent, includeTypes):
+        return [
+            {
+                "id": child[0],
+                "type": f"org.sagebionetworks.repo.model.{child[1]}",
+                "name": child[2] if len(child) > 2 else child[0],
+            }
+            for child in tree.get(parent, [])
+        ]
+
+    return _get_children
+
+
+class TestContainerView:
+    """Test monitoring big containers with File Views"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.views = ViewRegistry(min_entities=100)
+        # syn1 has 50 files and 2 folders, which have 50 files each
+        self.children = {
+            "syn1": {
+                "totalChildCount": 52,
+                "page": [
+                    {"id": "syn2", "type": "org.sagebionetworks.repo.model.Folder"},
+                    {"id": "syn3", "type": "org.sagebionetworks.repo.model.Folder"},
+                ],
+            },
+            "syn2": {"totalChildCount": 50, "page": []},
+            "syn3": {"totalChildCount": 50, "page": []},
+        }
+        self.syn.restPOST.side_effect = lambda uri, body: self.children[
+            json.loads(body)["parentId"]
+        ]
+        self.syn.restGET.return_value = {
+            "path": [{"id": "syn4489"}, {"id": "syn0"}, {"id": "syn1"}]
+        }
+
+    def test__estimate_descendants(self):
+        """Child counts are extrapolated to the folders left to probe"""
+        assert monitor._estimate_descendants(self.syn, "syn1") == 152
+        assert monitor._estimate_descendants(self.syn, "syn1", max_listings=1) == 156
+
+    def test__get_container_view_small(self):
+        """Small containers are traversed"""
+        self.views.min_entities = 1000
+        assert monitor._get_container_view(self.syn, "syn1", self.views) is None
+        self.syn.store.assert_not_called()
+        # The estimate is stored, so small containers aren't probed again
+        self.syn.restPOST.reset_mock()
+        assert monitor._get_container_view(self.syn, "syn1", self.views) is None
+        self.syn.restPOST.assert_not_called()
+        assert self.views.get_estimate("syn1") == {"entities": 152, "folders": 3}
+
+    def test__get_container_view_existing(self):
+        """File Views of the Project scoped to the container are reused"""
+        self.syn.getChildren.return_value = [{"id": "syn5"}]
+        self.syn.get.return_value = EntityViewSchema(
+            id="syn5", parent="syn0", scopes=["syn1"]
+        )
+        assert monitor._get_container_view(self.syn, "syn1", self.views) == "syn5"
+        self.syn.getChildren.assert_called_once_with(
+            "syn0", includeTypes=["entityview"]
+        )
+        self.syn.store.assert_not_called()
+        self.syn.restPOST.reset_mock()
+        assert monitor._get_container_view(self.syn, "syn1", self.views) == "syn5"
+        self.syn.restPOST.assert_not_called()
+
+    def test__get_container_view_created(self):
+        """A File View is created when there is none"""
+        self.syn.getChildren.return_value = []
+        self.syn.store.return_value = EntityViewSchema(id="syn6", parent="syn0")
+        assert monitor._get_container_view(self.syn, "syn1", self.views) == "syn6"
+        view = self.syn.store.call_args[0][0]
+        assert view.scopeIds == ["syn1"]
+        assert self.views.get("syn1") == "syn6"
+
+    def test__get_container_view_forbidden(self):
+        """Containers are traversed when a File View can't be created"""
+        self.syn.getChildren.return_value = []
+        self.syn.store.side_effect = SynapseHTTPError("forbidden")
+        assert monitor._get_container_view(self.syn, "syn1", self.views) is None
+        assert self.views.get("syn1") is None
+
+    def test_find_modified_entities_view(self):
+        """Registered containers are monitored with their File View"""
+        self.views.set("syn1", "syn5")
+        self.syn.get.return_value = Folder(id="syn1", parentId="syn0")
+        with patch.object(
+            monitor, "_find_modified_entities_fileview", return_value=["syn7"]
+        ) as patch_view:
+            modified = monitor.find_modified_entities(
+                self.syn, "syn1", views=self.views
+            )
+        assert modified == ["syn7"]
+        assert patch_view.call_args[1]["syn_id"] == "syn5"
+        self.syn.getChildren.assert_not_called()
+
+
+class TestTraversalRules:
+    """Test pruning traversals"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.tree = {
+            "syn0": [
+                ("syn1", "Folder", "raw"),
+                ("syn2", "Folder", "processed"),
+                ("syn3", "FileEntity", "notes.txt"),
+            ],
+            "syn1": [("syn4", "FileEntity", "a.bam")],
+            "syn2": [("syn5", "FileEntity", "b.bam"), ("syn6", "Folder", "qc")],
+            "syn6": [("syn7", "FileEntity", "c.txt")],
+        }
+
+    def _traverse(self, rules, max_workers=1):
+        with patch.object(
+            self.syn, "getChildren", side_effect=_get_children_tree(self.tree)
+        ) as patch_children:
+            ids = monitor._traverse(
+                self.syn,
+                "syn0",
+                ["file"],
+                max_workers=max_workers,
+                rules=rules,
+            )
+        listed = [call[1]["parent"] for call in patch_children.call_args_list]
+        return sorted(ids), sorted(listed)
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_max_depth(self, max_workers):
+        """Folders at the maximum depth are not listed"""
+        rules = monitor.TraversalRules(max_depth=2)
+        assert self._traverse(rules, max_workers) == (
+            ["syn3", "syn4", "syn5"],
+            ["syn0", "syn1", "syn2"],
+        )
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_exclude(self, max_workers):
+        """Excluded folders are not listed"""
+        rules = monitor.TraversalRules(exclude=["raw", "processed/qc"])
+        assert self._traverse(rules, max_workers) == (
+            ["syn3", "syn5"],
+            ["syn0", "syn2"],
+        )
+
+    def test_include(self):
+        """Only entities matching the patterns are returned"""
+        rules = monitor.TraversalRules(include=["*.bam", "processed/qc/*"])
+        assert self._traverse(rules) == (
+            ["syn4", "syn5", "syn7"],
+            ["syn0", "syn1", "syn2", "syn6"],
+        )
+
+    def test_deep_hierarchy(self):
+        """Deep hierarchies don't hit the recursion limit"""
+        self.tree = {f"syn{i}": [(f"syn{i + 1}", "Folder")] for i in range(5000)}
+        self.tree["syn5000"] = [("syn5001", "FileEntity")]
+        assert self._traverse(None)[0] == ["syn5001"]
+
+    def test_targets_not_nested(self):
+        """Nested containers are traversed on their own with rules"""
+        now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        headers = [
+            {"id": "syn0", "type": "org.sagebionetworks.repo.model.Project"},
+            {"id": "syn2", "type": "org.sagebionetworks.repo.model.Folder"},
+        ]
+        get_children = _get_children_tree(self.tree)
+
+        def _get_children(parent, includeTypes):
+            children = get_children(parent, includeTypes)
+            for child in children:
+                child["modifiedOn"] = now
+            return children
+
+        with patch.object(
+            self.syn, "getChildren", side_effect=_get_children
+        ), patch.object(monitor, "_get_entity_headers", return_value=headers):
+            modified = monitor.find_modified_entities_targets(
+                self.syn,
+                ["syn0", "syn2"],
+                rules=monitor.TraversalRules(max_depth=1),
+            )
+        self.syn.restGET.assert_not_called()
+        assert modified == {"syn0": ["syn3"], "syn2": ["syn5"]}
+
+
+class TestTraverseConcurrent:
+    """Test concurrent traversal"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.tree = {
+            "syn0": [("syn1", "Folder"), ("syn2", "FileEntity")],
+            "syn1": [("syn3", "Folder"), ("syn4", "FileEntity")],
+            "syn3": [("syn5", "FileEntity"), ("syn6", "FileEntity")],
+        }
+
+    @pytest.mark.parametrize("max_workers", [2, 8])
+    def test__traverse_concurrent_same_as_sequential(self, max_workers):
+        """Concurrent traversal finds the same ids as the sequential one"""
+        with patch.object(
+            self.syn, "getChildren", side_effect=_get_children_tree(self.tree)
+        ):
+            sequential = monitor._traverse(self.syn, "syn0", ["file", "folder"])
+            concurrent = monitor._traverse(
+                self.syn, "syn0", ["file", "folder"], max_workers=max_workers
+            )
+        assert sorted(concurrent) == sorted(sequential)
+        assert sorted(concurrent) == ["syn1", "syn2", "syn3", "syn4", "syn5", "syn6"]
+
+    def test__traverse_concurrent_error(self):
+        """Errors raised while listing folders are propagated"""
+        with patch.object(
+            self.syn, "getChildren", side_effect=ValueError("failed")
+        ), pytest.raises(ValueError, match="failed"):
+            monitor._traverse(self.syn, "syn0", max_workers=2)
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test__iter_traverse_headers_early_stop(self, max_workers):
+        """Entities are yielded as folders are listed"""
+        tree = {"syn0": [("syn1", "FileEntity"), ("syn2", "Folder")]}
+        tree.update(
+            {f"syn{i}": [(f"syn{i + 1}", "Folder")] for i in range(2, 1000)}
+        )
+        with patch.object(
+            self.syn, "getChildren", side_effect=_get_children_tree(tree)
+        ) as patch_children:
+            headers = monitor._iter_traverse_headers(
+                self.syn, "syn0", ["file", "folder"], max_workers=max_workers
+            )
+            assert next(headers)["id"] in ["syn1", "syn2"]
+            headers.close()
+        assert patch_children.call_count < 10
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test__traverse_resume(self, tmp_path, max_workers):
+        """Interrupted traversals resume without listing folders again"""
+        checkpoint = TraversalCheckpoint(str(tmp_path / "checkpoint.json"))
+        get_children = _get_children_tree(self.tree)
+
+        def _get_children(parent, includeTypes):
+            if parent == "syn3":
+                raise ValueError("expired")
+            return get_children(parent, includeTypes)
+
+        with patch.object(
+            self.syn, "getChildren", side_effect=_get_children
+        ), pytest.raises(ValueError, match="expired"):
+            monitor._traverse(
+                self.syn, "syn0", max_workers=max_workers, checkpoint=checkpoint
+            )
+        checkpoint.save()
+
+        checkpoint = TraversalCheckpoint(checkpoint.path, resume=True)
+        with patch.object(
+            self.syn, "getChildren", side_effect=get_children
+        ) as patch_children:
+            ids = monitor._traverse(
+                self.syn, "syn0", max_workers=max_workers, checkpoint=checkpoint
+            )
+        assert sorted(ids) == ["syn2", "syn4", "syn5", "syn6"]
+        assert [call[1]["parent"] for call in patch_children.call_args_list] == [
+            "syn3"
+        ]
+        assert checkpoint.get("syn0", ["file"]) is None
+
+    def test__traverse_resume_rules(self, tmp_path):
+        """Traversals saved with other rules are started again"""
+        checkpoint = TraversalCheckpoint(str(tmp_path / "checkpoint.json"))
+        checkpoint.update(
+            "syn0", ["file"], [], [{"id": "syn9"}], {"rules": {}, "predicate": None}
+        )
+        with patch.object(
+            self.syn, "getChildren", side_effect=_get_children_tree(self.tree)
+        ):
+            ids = monitor._traverse(
+                self.syn,
+                "syn0",
+                rules=monitor.TraversalRules(max_depth=1),
+                checkpoint=checkpoint,
+            )
+        assert "syn9" not in ids
+
+
+def test_iter_modified_entities():
+    """Modified entities of a container are yielded during the traversal"""
+    syn = Mock()
+    syn.get.return_value = Folder(id="syn0", parentId="syn9")
+    now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    syn.getChildren.return_value = [
+        {"id": "syn1", "type": "org.sagebionetworks.repo.model.FileEntity",
+         "name": "a.txt", "modifiedOn": now},
+        {"id": "syn2", "type": "org.sagebionetworks.repo.model.FileEntity",
+         "name": "b.txt", "modifiedOn": "2000-01-01T00:00:00.000Z"},
+    ]
+    modified = monitor.iter_modified_entities(syn, "syn0")
+    syn.get.assert_not_called()
+    (entity,) = list(modified)
+    assert entity == "syn1"
+    assert entity.parent_id == "syn0"
+    assert entity.name == "a.txt"
 
 
 def test__find_modified_entities_file_modified():
@@ -283,6 +980,254 @@ def test__find_modified_entities_file_none():
         assert modified_list == []
 
 
+class TestModifiedEntitiesBatch:
+    """Test batched entity header lookups"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")[:-4] + "Z"
+        self.past = (datetime.utcnow() - timedelta(days=3)).strftime(
+            "%Y-%m-%dT%H:%M:%S.%fZ"
+        )[:-4] + "Z"
+        self.headers = [
+            {"id": "syn1", "type": "org.sagebionetworks.repo.model.FileEntity",
+             "modifiedOn": self.now},
+            {"id": "syn2", "type": "org.sagebionetworks.repo.model.FileEntity",
+             "modifiedOn": self.past},
+            {"id": "syn3", "type": "org.sagebionetworks.repo.model.table.TableEntity",
+             "modifiedOn": self.now},
+        ]
+
+    def test__get_entity_headers_chunked(self):
+        """Entity headers are requested in chunks of the batch size"""
+        with patch.object(monitor, "ENTITY_HEADER_BATCH_SIZE", 2), patch.object(
+            self.syn, "restPOST",
+            side_effect=[{"results": self.headers[:2]}, {"results": self.headers[2:]}],
+        ) as patch_post:
+            headers = monitor._get_entity_headers(self.syn, ["syn1", "syn2", "syn3"])
+            assert patch_post.call_count == 2
+            patch_post.assert_called_with(
+                "/entity/header", body='{"references": [{"targetId": "syn3"}]}'
+            )
+            assert headers == self.headers
+
+    def test_find_modified_entities_batch(self):
+        """Files and Schemas are filtered on their header modifiedOn"""
+        with patch.object(
+            self.syn, "restPOST", return_value={"results": self.headers}
+        ) as patch_post, patch.object(self.syn, "get") as patch_get:
+            modified_list = monitor.find_modified_entities_batch(
+                self.syn, ["syn1", "syn2", "syn3"], value=1, unit="day"
+            )
+            patch_post.assert_called_once()
+            patch_get.assert_not_called()
+            assert modified_list == ["syn1", "syn3"]
+
+    def test_find_modified_entities_batch_container(self):
+        """Containers fall back to find_modified_entities"""
+        headers = self.headers + [
+            {"id": "syn4", "type": "org.sagebionetworks.repo.model.Folder",
+             "modifiedOn": self.past}
+        ]
+        with patch.object(
+            self.syn, "restPOST", return_value={"results": headers}
+        ), patch.object(
+            monitor, "find_modified_entities", return_value=["syn5"]
+        ) as patch_find:
+            modified_list = monitor.find_modified_entities_batch(
+                self.syn, ["syn1", "syn2", "syn3", "syn4"], value=1, unit="day"
+            )
+            patch_find.assert_called_once_with(
+                syn=self.syn, syn_id="syn4", value=1, unit="day", max_workers=1,
+                snapshot=None, watermarks=None, page_size=None
+            )
+            assert modified_list == ["syn1", "syn3", "syn5"]
+
+    def test_find_modified_entities_batch_empty(self):
+        """No entities found"""
+        with patch.object(self.syn, "restPOST", return_value={"results": []}):
+            assert monitor.find_modified_entities_batch(self.syn, ["syn1"]) == []
+
+
+class TestModifiedEntitiesTargets:
+    """Test monitoring many entities at once"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        past = (datetime.utcnow() - timedelta(days=3)).strftime(
+            "%Y-%m-%dT%H:%M:%S.%fZ"
+        )
+        folder = "org.sagebionetworks.repo.model.Folder"
+        file = "org.sagebionetworks.repo.model.FileEntity"
+        self.tree = {
+            "syn0": [
+                {"id": "syn1", "type": folder, "modifiedOn": past},
+                {"id": "syn2", "type": file, "modifiedOn": now},
+            ],
+            "syn1": [
+                {"id": "syn3", "type": folder, "modifiedOn": past},
+                {"id": "syn4", "type": file, "modifiedOn": now},
+                {"id": "syn5", "type": file, "modifiedOn": past},
+            ],
+            "syn3": [{"id": "syn6", "type": file, "modifiedOn": now}],
+        }
+        self.headers = {
+            "syn0": {"id": "syn0", "type": "org.sagebionetworks.repo.model.Project"},
+            "syn1": {"id": "syn1", "type": folder},
+            "syn3": {"id": "syn3", "type": folder},
+            "syn4": {
+                "id": "syn4", "type": file, "modifiedOn": now, "etag": "e4",
+                "versionNumber": 2,
+            },
+        }
+        self.paths = {
+            "syn0": ["syn4489", "syn0"],
+            "syn1": ["syn4489", "syn0", "syn1"],
+            "syn3": ["syn4489", "syn0", "syn1", "syn3"],
+        }
+
+    def _get_children(self, parent, includeTypes):
+        return iter([dict(child) for child in self.tree.get(parent, [])])
+
+    def _rest_post(self, uri, body):
+        if uri == "/entity/children":
+            children = self.tree.get(json.loads(body)["parentId"], [])
+            return {"totalChildCount": len(children), "page": children}
+        references = json.loads(body)["references"]
+        return {"results": [self.headers[ref["targetId"]] for ref in references]}
+
+    def _rest_get(self, uri):
+        syn_id = uri.split("/")[2]
+        return {"path": [{"id": path_id} for path_id in self.paths[syn_id]]}
+
+    def test__find_modified_entities_nested(self):
+        """Nested folders get the modified files below them"""
+        with patch.object(
+            self.syn, "getChildren", side_effect=self._get_children
+        ) as patch_child:
+            modified = monitor._find_modified_entities_nested(
+                self.syn, "syn0", ["syn0", "syn3"], value=1, unit="day"
+            )
+        assert patch_child.call_count == 3
+        assert sorted(modified["syn0"]) == ["syn2", "syn4", "syn6"]
+        assert modified["syn3"] == ["syn6"]
+
+    def test_find_modified_entities_targets(self):
+        """Overlapping containers are traversed once"""
+        with patch.object(
+            self.syn, "getChildren", side_effect=self._get_children
+        ) as patch_child, patch.object(
+            self.syn, "restPOST", side_effect=self._rest_post
+        ), patch.object(
+            self.syn, "restGET", side_effect=self._rest_get
+        ):
+            modified = monitor.find_modified_entities_targets(
+                self.syn, ["syn1", "syn4", "syn0", "syn3", "syn1"], value=1, unit="day"
+            )
+        assert patch_child.call_count == 3
+        assert list(modified) == ["syn1", "syn4", "syn0", "syn3"]
+        assert sorted(modified["syn0"]) == ["syn2", "syn4", "syn6"]
+        assert sorted(modified["syn1"]) == ["syn4", "syn6"]
+        assert modified["syn3"] == ["syn6"]
+        assert modified["syn4"] == ["syn4"]
+        # Monitored Files keep the metadata of their header
+        assert modified["syn4"][0].etag == "e4"
+        assert modified["syn4"][0].version == 2
+        assert modified["syn4"][0].modified_on == self.headers["syn4"]["modifiedOn"]
+
+    def test_iter_modified_entities_targets(self):
+        """Modified entities are yielded with their target as they are found"""
+        with patch.object(
+            self.syn, "getChildren", side_effect=self._get_children
+        ) as patch_child, patch.object(
+            self.syn, "restPOST", side_effect=self._rest_post
+        ), patch.object(
+            self.syn, "restGET", side_effect=self._rest_get
+        ):
+            found = monitor.iter_modified_entities_targets(
+                self.syn, ["syn4", "syn3"], value=1, unit="day"
+            )
+            assert next(found) == ("syn4", "syn4")
+            patch_child.assert_not_called()
+            assert list(found) == [("syn3", "syn6")]
+
+    def test_find_modified_entities_targets_metrics(self):
+        """Work shared by targets is split between their metrics"""
+        metrics = RunMetrics()
+        with patch.object(
+            self.syn, "getChildren", side_effect=self._get_children
+        ), patch.object(
+            self.syn, "restPOST", side_effect=self._rest_post
+        ), patch.object(
+            self.syn, "restGET", side_effect=self._rest_get
+        ):
+            monitor.find_modified_entities_targets(
+                self.syn, ["syn1", "syn4", "syn0", "syn3"], value=1, unit="day",
+                metrics=metrics
+            )
+        strategies = {
+            syn_id: target.strategy for syn_id, target in metrics.targets.items()
+        }
+        assert strategies == {
+            "syn0": "walk", "syn1": "nested", "syn3": "nested", "syn4": "headers"
+        }
+        # The 6 descendants of syn0 are visited once for the 3 containers
+        assert metrics.targets["syn0"].visited == metrics.targets["syn3"].visited == 2
+        assert metrics.targets["syn4"].visited == 1
+
+    def test_find_modified_entities_targets_single(self):
+        """A single container doesn't need its path"""
+        with patch.object(
+            self.syn, "getChildren", side_effect=self._get_children
+        ), patch.object(
+            self.syn, "restPOST", side_effect=self._rest_post
+        ), patch.object(self.syn, "restGET") as patch_path:
+            modified = monitor.find_modified_entities_targets(
+                self.syn, ["syn3"], value=1, unit="day"
+            )
+        patch_path.assert_not_called()
+        assert modified == {"syn3": ["syn6"]}
+
+    def test_plan_targets(self):
+        """Containers are probed and planned with the snapshot"""
+        snapshot = Mock()
+        snapshot.is_fresh.return_value = True
+        with patch.object(
+            self.syn, "restPOST", side_effect=self._rest_post
+        ), patch.object(self.syn, "restGET", side_effect=self._rest_get):
+            plans, planning_calls = monitor.plan_targets(
+                self.syn, ["syn0", "syn3", "syn4"], snapshot=snapshot, estimate=True
+            )
+        assert [plan.strategy for plan in plans.values()] == [
+            "snapshot",
+            "nested",
+            "headers",
+        ]
+        # syn0 holds 6 entities in 3 folders, each probed once
+        assert (plans["syn0"].entities, plans["syn0"].rest_calls) == (6, 4)
+        assert plans["syn3"].nested_in == "syn0"
+        # 1 batch of headers, 3 + 1 probes and 2 paths
+        assert planning_calls == 7
+
+    def test_plan_targets_small(self):
+        """Containers too small for a File View are only probed once"""
+        views = ViewRegistry(min_entities=100)
+        with patch.object(
+            self.syn, "restPOST", side_effect=self._rest_post
+        ), patch.object(self.syn, "restGET", side_effect=self._rest_get):
+            plans, planning_calls = monitor.plan_targets(
+                self.syn, ["syn0"], views=views
+            )
+            assert (plans["syn0"].strategy, planning_calls) == ("walk", 4)
+            plans, planning_calls = monitor.plan_targets(
+                self.syn, ["syn0"], views=views
+            )
+        assert (plans["syn0"].strategy, plans["syn0"].entities) == ("walk", 6)
+        # Only the batch of headers
+        assert planning_calls == 1
+
+
 def test__get_user_ids_none():
     """Test getting logged in user profile when no users specified"""
     syn = Mock()
@@ -305,6 +1250,21 @@ def test__get_user_ids():
         assert user_ids == ["111", "111"]
 
 
+def test__get_user_ids_resolved():
+    """Users are only resolved once"""
+    syn = Mock()
+    user_ids = {"username": "222"}
+    with patch.object(
+        syn, "getUserProfile", return_value={"ownerId": "111"}
+    ) as patch_get:
+        assert monitor._get_user_ids(syn, [1, "username", 1], user_ids) == [
+            "111",
+            "222",
+            "111",
+        ]
+    patch_get.assert_called_once_with(1)
+
+
 @pytest.mark.parametrize(
     "entity, entity_type", [(Entity(id="syn12345", parentId="syn3333"), "Entity")]
 )
@@ -321,14 +1281,14 @@ def test_find_modified_entities_supported():
     """Test supported entity types to monitor"""
     entity = EntityViewSchema(id="syn12345", parentId="syn3333")
     syn = Mock()
-    empty = pd.DataFrame()
+    modified = ["syn23333"]
     with patch.object(syn, "get", return_value=entity) as patch_get, patch.object(
-        monitor, "_find_modified_entities_fileview", return_value=empty
+        monitor, "_find_modified_entities_fileview", return_value=modified
     ) as patch_mod:
         value = monitor.find_modified_entities(syn=syn, syn_id="syn12345", value=1, unit="day")
         patch_get.assert_called_once_with("syn12345", downloadFile=False)
         patch_mod.assert_called_once()
-        assert empty.equals(value)
+        assert value == modified
 
 
 class TestMonitoring:
@@ -0,0 +1,63 @@
+"""Test planner module"""
+import pytest
+
+from synapsemonitor import planner
+
+
+@pytest.mark.parametrize(
+    "snapshot_fresh, strategy, rest_calls",
+    [(None, "walk", 25), (False, "snapshot", 25), (True, "snapshot", 5)],
+)
+def test_plan_container_snapshot(snapshot_fresh, strategy, rest_calls):
+    """Fresh snapshots only list changed folders"""
+    plan = planner.plan_container(
+        "syn1", "folder", entities=1000, folders=4, snapshot_fresh=snapshot_fresh
+    )
+    assert plan.strategy == strategy
+    assert plan.rest_calls == rest_calls
+
+
+def test_plan_container_view():
+    """Big containers are monitored with File Views"""
+    plan = planner.plan_container(
+        "syn1", "folder", entities=1000, folders=4, min_view_entities=1000
+    )
+    assert plan.strategy == "view"
+    assert plan.rest_calls == 2 + planner.VIEW_CREATION_CALLS
+    plan = planner.plan_container(
+        "syn1", "folder", entities=999, folders=4, min_view_entities=1000
+    )
+    assert plan.strategy == "walk"
+
+
+def test_plan_container_not_estimated():
+    """Without estimates, registered File Views and snapshots are used"""
+    plan = planner.plan_container(
+        "syn1", "project", snapshot_fresh=False, view_id="syn2", min_view_entities=1
+    )
+    assert (plan.strategy, plan.view_id, plan.rest_calls) == ("view", "syn2", 2)
+    plan = planner.plan_container("syn1", "project", snapshot_fresh=False)
+    assert (plan.strategy, plan.rest_calls) == ("snapshot", None)
+
+
+def test_plan_leaves():
+    """Batched calls are only counted once"""
+    plans = planner.plan_leaves(
+        ["syn1", "syn2", "syn3"], {"syn1": "file", "syn2": "file", "syn3": "table"}
+    )
+    assert [plan.rest_calls for plan in plans] == [1, 0, 0]
+    assert {plan.strategy for plan in plans} == {"headers"}
+
+
+def test_format_plans():
+    """Plans are printed as a table with the estimated REST calls"""
+    plans = [
+        planner.plan_container("syn1", "folder", entities=100, folders=3),
+        planner.plan_fileview("syn2", None),
+    ]
+    assert planner.format_plans(plans, planning_calls=4) == (
+        "synapse_id  type    strategy  entities  rest_calls  note\n"
+        "syn1        folder  walk      ~100      ~6          every folder is listed\n"
+        "syn2        ?       fileview  ?         ?           type checked on run\n"
+        "Estimated REST calls: ~6 (+ unestimated), 4 made while planning\n"
+    )
@@ -0,0 +1,89 @@
+"""Test sinks module"""
+
+import io
+import json
+
+import pytest
+
+from synapsemonitor import sinks
+from synapsemonitor.monitor import ModifiedEntity
+
+ENTITIES = [
+    ModifiedEntity(
+        "syn2", parent_id="syn1", name="a.txt", version=2, values={"assay": "rna"}
+    ),
+    "syn3",
+    ModifiedEntity("syn2", parent_id="syn1", name="a.txt", version=2),
+]
+
+
+def test_csv_sink():
+    """Synapse ids are written once without a header"""
+    output = io.StringIO()
+    with sinks.open_sink(output) as sink:
+        assert sink.write_all(ENTITIES) == 2
+        assert not sink.write("syn3")
+    assert output.getvalue() == "syn2\r\nsyn3\r\n"
+
+
+def test_csv_sink_columns(tmp_path):
+    """Metadata columns are written after a header"""
+    path = str(tmp_path / "out.csv")
+    with sinks.open_sink(path, columns=["name", "versionNumber"]) as sink:
+        sink.write_all(ENTITIES)
+    with open(path) as output:
+        assert output.read() == "id,name,versionNumber\nsyn2,a.txt,2\nsyn3,,\n"
+
+
+def test_csv_sink_view_columns():
+    """File View columns are written after the metadata columns"""
+    output = io.StringIO()
+    with sinks.open_sink(output, columns=["name"], view_columns=["assay"]) as sink:
+        sink.write_all(ENTITIES)
+    assert output.getvalue() == "id,name,assay\r\nsyn2,a.txt,rna\r\nsyn3,,\r\n"
+
+
+def test_jsonl_sink():
+    """Each entity is written as soon as it is found"""
+    output = io.StringIO()
+    sink = sinks.open_sink(output, output_format="jsonl", columns=["parentId"])
+    sink.write(ENTITIES[0])
+    assert json.loads(output.getvalue()) == {"id": "syn2", "parentId": "syn1"}
+    sink.write(ENTITIES[1])
+    sink.close()
+    assert not output.closed
+    assert json.loads(output.getvalue().splitlines()[1]) == {
+        "id": "syn3",
+        "parentId": None,
+    }
+
+
+def test_parquet_sink(tmp_path):
+    """Entities are written in row groups"""
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "out.parquet")
+    sink = sinks.ParquetSink(
+        path, columns=["versionNumber"], view_columns=["assay"], row_group_size=1
+    )
+    with sink:
+        sink.write_all(ENTITIES)
+    parquet_file = pyarrow_parquet.ParquetFile(path)
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.read().to_pylist() == [
+        {"id": "syn2", "versionNumber": 2, "assay": "rna"},
+        {"id": "syn3", "versionNumber": None, "assay": None},
+    ]
+
+
+def test_entity_sink_abstract():
+    """Sinks must write rows"""
+    with pytest.raises(TypeError):
+        sinks.EntitySink(io.StringIO())
+
+
+def test_open_sink_invalid():
+    """Unknown formats and columns are rejected"""
+    with pytest.raises(ValueError, match="output_format"):
+        sinks.open_sink(output_format="xml")
+    with pytest.raises(ValueError, match="Unknown output columns: size"):
+        sinks.open_sink(columns=["size"])
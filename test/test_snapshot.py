@@ -0,0 +1,228 @@
+"""Test snapshot module"""
+from datetime import datetime, timedelta
+import json
+import sqlite3
+from unittest.mock import Mock, patch
+
+import pytest
+
+from synapsemonitor import monitor
+from synapsemonitor.__main__ import _hierarchy_snapshot, build_parser
+from synapsemonitor.snapshot import HierarchySnapshot
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    with HierarchySnapshot(str(tmp_path / "snapshot.db")) as snapshot:
+        yield snapshot
+
+
+HEADERS = [
+    {
+        "id": "syn2",
+        "name": "test_file",
+        "type": "org.sagebionetworks.repo.model.FileEntity",
+        "modifiedOn": "2021-01-01T00:00:00.000Z",
+    },
+    {
+        "id": "syn3",
+        "name": "test_folder",
+        "type": "org.sagebionetworks.repo.model.Folder",
+        "modifiedOn": "2021-01-01T00:00:00.000Z",
+    },
+]
+
+
+def test_put_get_children(snapshot):
+    """Stored listings are returned when the signature matches"""
+    snapshot.put_children("syn1", ["folder", "file"], "2:0:syn3", HEADERS)
+    children = snapshot.get_children("syn1", ["file", "folder"], "2:0:syn3")
+    assert sorted(child["id"] for child in children) == ["syn2", "syn3"]
+    assert children[0]["parentId"] == "syn1"
+    assert children[0]["etag"] is None
+
+
+@pytest.mark.parametrize(
+    "include_types, signature",
+    [(["file", "folder"], "3:0:syn4"), (["file", "folder", "table"], "2:0:syn3")],
+)
+def test_get_children_changed(snapshot, include_types, signature):
+    """Changed signatures or entity types invalidate the stored listing"""
+    snapshot.put_children("syn1", ["file", "folder"], "2:0:syn3", HEADERS)
+    assert snapshot.get_children("syn1", include_types, signature) is None
+
+
+def test_get_children_stale(snapshot):
+    """Listings older than max_age are not reused"""
+    snapshot.max_age = timedelta(seconds=-1)
+    snapshot.put_children("syn1", ["file", "folder"], "2:0:syn3", HEADERS)
+    assert snapshot.get_children("syn1", ["file", "folder"], "2:0:syn3") is None
+
+
+def test_fit_window(snapshot):
+    """max_age is lowered to the window minus the time since the last
+    listing, and not above the configured max_age"""
+    snapshot.fit_window(timedelta(hours=1))
+    assert snapshot.max_age == timedelta(days=1)
+    snapshot.put_children("syn1", ["file", "folder"], "2:0:syn3", HEADERS)
+    snapshot.fit_window(timedelta(hours=1))
+    assert timedelta(minutes=59) < snapshot.max_age <= timedelta(hours=1)
+    snapshot.fit_window(timedelta(days=2))
+    assert snapshot.max_age == timedelta(days=1)
+
+
+def test_fit_window_since(snapshot):
+    """Listings older than the window minus the time since the previous run
+    are not reused"""
+    snapshot.put_children("syn1", ["file", "folder"], "2:0:syn3", HEADERS)
+    snapshot.fit_window(
+        timedelta(hours=1), since=datetime.utcnow() - timedelta(hours=1)
+    )
+    assert snapshot.max_age <= timedelta(0)
+    assert snapshot.get_children("syn1", ["file", "folder"], "2:0:syn3") is None
+
+
+def test_hierarchy_snapshot_window(tmp_path):
+    """The --snapshot_max_age of the command line is fitted to the window"""
+    path = str(tmp_path / "snapshot.db")
+    with HierarchySnapshot(path) as snapshot:
+        snapshot.put_children("syn1", ["file", "folder"], "2:0:syn3", HEADERS)
+    args = build_parser().parse_args(
+        ["monitor", "syn1", "--snapshot", path, "--value", "1", "--unit", "hour"]
+    )
+    with _hierarchy_snapshot(args) as snapshot:
+        assert snapshot.max_age <= timedelta(hours=1)
+
+
+def test_get_children_missing(snapshot):
+    """Containers never listed are not in the snapshot"""
+    assert snapshot.get_children("syn1", ["file"], "") is None
+
+
+def test_put_children_replaces(snapshot):
+    """Storing a listing removes children that are gone"""
+    snapshot.put_children("syn1", ["file", "folder"], "2:0:syn3", HEADERS)
+    snapshot.put_children("syn1", ["file", "folder"], "1:0:syn2", HEADERS[:1])
+    children = snapshot.get_children("syn1", ["file", "folder"], "1:0:syn2")
+    assert [child["id"] for child in children] == ["syn2"]
+
+
+class TestListChildren:
+    """Test listing children with a snapshot"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.response = {
+            "page": HEADERS[:1],
+            "nextPageToken": "token",
+            "totalChildCount": 2,
+            "sumFileSizesBytes": 10,
+        }
+
+    def test__list_children_no_snapshot(self):
+        """Without a snapshot the children are listed"""
+        with patch.object(self.syn, "getChildren", return_value=iter(HEADERS)):
+            children = monitor._list_children(self.syn, "syn1", ["file"])
+        assert children == HEADERS
+
+    def test__list_children_single_page(self, snapshot):
+        """A single page probe is the complete listing"""
+        response = dict(self.response, page=HEADERS, nextPageToken=None)
+        with patch.object(
+            self.syn, "restPOST", return_value=response
+        ) as patch_post, patch.object(self.syn, "getChildren") as patch_child:
+            children = monitor._list_children(
+                self.syn, "syn1", ["file", "folder"], snapshot=snapshot
+            )
+        patch_child.assert_not_called()
+        request = json.loads(patch_post.call_args[1]["body"])
+        assert request["parentId"] == "syn1"
+        assert request["includeTotalChildCount"]
+        assert children == HEADERS
+
+    def test__list_children_unchanged(self, snapshot):
+        """Unchanged containers are not listed again"""
+        with patch.object(
+            self.syn, "restPOST", return_value=self.response
+        ), patch.object(
+            self.syn, "getChildren", return_value=iter(HEADERS)
+        ) as patch_child:
+            monitor._list_children(
+                self.syn, "syn1", ["file", "folder"], snapshot=snapshot
+            )
+            children = monitor._list_children(
+                self.syn, "syn1", ["file", "folder"], snapshot=snapshot
+            )
+        patch_child.assert_called_once()
+        assert sorted(child["id"] for child in children) == ["syn2", "syn3"]
+
+    def test__list_children_changed(self, snapshot):
+        """Containers with new children are listed again"""
+        changed = dict(self.response, totalChildCount=3)
+        with patch.object(
+            self.syn, "restPOST", side_effect=[self.response, changed]
+        ), patch.object(
+            self.syn, "getChildren", side_effect=[iter(HEADERS), iter(HEADERS)]
+        ) as patch_child:
+            monitor._list_children(
+                self.syn, "syn1", ["file", "folder"], snapshot=snapshot
+            )
+            monitor._list_children(
+                self.syn, "syn1", ["file", "folder"], snapshot=snapshot
+            )
+        assert patch_child.call_count == 2
+
+    def test__list_children_first_page_modified(self, snapshot):
+        """Containers whose newest children were modified are listed again"""
+        modified = dict(
+            self.response,
+            page=[dict(HEADERS[0], modifiedOn="2021-02-01T00:00:00.000Z")],
+        )
+        with patch.object(
+            self.syn, "restPOST", side_effect=[self.response, modified]
+        ), patch.object(
+            self.syn, "getChildren", side_effect=[iter(HEADERS), iter(HEADERS)]
+        ) as patch_child:
+            monitor._list_children(
+                self.syn, "syn1", ["file", "folder"], snapshot=snapshot
+            )
+            monitor._list_children(
+                self.syn, "syn1", ["file", "folder"], snapshot=snapshot
+            )
+        assert patch_child.call_count == 2
+
+
+def test_get_children_filtered_fields(snapshot):
+    """Header fields that filters apply to are stored"""
+    header = dict(HEADERS[0], versionNumber=2, createdBy="1", modifiedBy="3")
+    snapshot.put_children("syn1", ["file"], "1:0:syn2", [header])
+    (child,) = snapshot.get_children("syn1", ["file"], "1:0:syn2")
+    assert (child["versionNumber"], child["createdBy"], child["modifiedBy"]) == (
+        2, "1", "3"
+    )
+    query = monitor.ViewQuery(filters=[("modifiedBy", "=", "3")])
+    assert query.matches(child)
+
+
+def test_snapshot_migration(tmp_path):
+    """Snapshots without the filtered header fields are listed again"""
+    path = str(tmp_path / "snapshot.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(
+            "CREATE TABLE entities (id TEXT PRIMARY KEY, parent_id TEXT, "
+            "name TEXT, type TEXT, etag TEXT, modified_on TEXT)"
+        )
+        conn.execute(
+            "CREATE TABLE containers (id TEXT PRIMARY KEY, include_types TEXT, "
+            "signature TEXT, listed_on TEXT)"
+        )
+        conn.execute(
+            "INSERT INTO containers VALUES ('syn1', 'file', '1:0:syn2', ?)",
+            (datetime.utcnow().isoformat(),),
+        )
+    conn.close()
+    with HierarchySnapshot(path) as snapshot:
+        assert not snapshot.is_fresh("syn1")
+        snapshot.put_children("syn1", ["file"], "1:0:syn2", HEADERS[:1])
+        assert snapshot.get_children("syn1", ["file"], "1:0:syn2")[0]["id"] == "syn2"
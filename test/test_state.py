@@ -0,0 +1,216 @@
+"""Test state module"""
+
+from datetime import datetime, timedelta
+import json
+
+from synapsemonitor.monitor import ModifiedEntity
+from synapsemonitor.state import (
+    FeedCache,
+    NotificationStore,
+    TraversalCheckpoint,
+    UserNameCache,
+    ViewRegistry,
+    WatermarkStore,
+)
+
+
+def test_watermark_store_save(tmp_path):
+    """Watermarks are only written on save"""
+    path = str(tmp_path / "watermarks.json")
+    watermarks = WatermarkStore(path)
+    assert watermarks.get("syn1") is None
+    watermarks.set("syn1", 30, {"syn2": 30})
+    assert not (tmp_path / "watermarks.json").exists()
+    watermarks.save()
+    with open(path) as watermark_file:
+        assert json.load(watermark_file) == {
+            "syn1": {"modifiedOn": 30, "ids": {"syn2": 30}}
+        }
+    assert WatermarkStore(path).get("syn1") == {
+        "modifiedOn": 30,
+        "ids": {"syn2": 30},
+    }
+    assert [item.name for item in tmp_path.iterdir()] == ["watermarks.json"]
+
+
+def test_watermark_store_legacy_ids(tmp_path):
+    """Watermarks saved with the list of ids at modifiedOn are read"""
+    path = tmp_path / "watermarks.json"
+    path.write_text(json.dumps({"syn1": {"modifiedOn": 30, "ids": ["syn2"]}}))
+    assert WatermarkStore(str(path)).get("syn1") == {
+        "modifiedOn": 30,
+        "ids": {"syn2": 30},
+    }
+
+
+def test_watermark_store_save_views():
+    """Only the watermarks of the saved File Views move"""
+    watermarks = WatermarkStore()
+    watermarks.set("syn1", 30, {"syn2": 30})
+    watermarks.set("syn3", 40, {"syn4": 40})
+    watermarks.save(["syn1"])
+    assert watermarks.get("syn1") == {"modifiedOn": 30, "ids": {"syn2": 30}}
+    assert watermarks.get("syn3") is None
+    watermarks.save()
+    assert watermarks.get("syn3") == {"modifiedOn": 40, "ids": {"syn4": 40}}
+
+
+def test_user_name_cache(tmp_path):
+    """User names are shared between runs through the cache file"""
+    path = str(tmp_path / "users.json")
+    user_names = UserNameCache(path)
+    assert user_names.get(333333) is None
+    user_names.set(333333, "user")
+    assert user_names.get("333333") == "user"
+    user_names.save()
+    assert UserNameCache(path).get(333333) == "user"
+
+
+def test_user_name_cache_expired(tmp_path):
+    """Expired user names are not returned nor saved"""
+    path = str(tmp_path / "users.json")
+    user_names = UserNameCache(path, ttl=timedelta(seconds=-1))
+    user_names.set(333333, "user")
+    assert user_names.get(333333) is None
+    user_names.save()
+    assert UserNameCache(path).get(333333) is None
+
+
+def test_notification_store(tmp_path):
+    """Each change of an entity is delivered once"""
+    path = str(tmp_path / "notifications.json")
+    notifications = NotificationStore(path)
+    entities = [
+        ModifiedEntity("syn2", etag="a"),
+        ModifiedEntity("syn3", modified_on="2021-01-01T00:00:00.000Z"),
+        "syn4",
+    ]
+    assert notifications.filter("syn1", entities + ["syn4"]) == entities
+    notifications.mark("syn1", entities)
+    notifications.save()
+
+    notifications = NotificationStore(path)
+    assert notifications.filter("syn1", entities) == []
+    # Same entities monitored by another entity
+    assert notifications.filter("syn5", entities) == entities
+    changed = [
+        ModifiedEntity("syn2", etag="b"),
+        ModifiedEntity("syn3", modified_on="2021-01-02T00:00:00.000Z"),
+        "syn4",
+    ]
+    assert notifications.filter("syn1", changed) == changed[:2]
+
+
+def test_notification_store_eviction(tmp_path):
+    """Old and expired deliveries are forgotten"""
+    path = str(tmp_path / "notifications.json")
+    notifications = NotificationStore(path, max_entries=2)
+    notifications.mark("syn1", ["syn2", "syn3"])
+    notifications.mark("syn1", ["syn2", "syn4"])
+    assert notifications.filter("syn1", ["syn2", "syn3", "syn4"]) == ["syn3"]
+
+    notifications.ttl = timedelta(seconds=-1)
+    assert notifications.filter("syn1", ["syn2"]) == ["syn2"]
+    notifications.save()
+    with open(path) as store_file:
+        assert json.load(store_file) == {}
+
+
+def test_view_registry(tmp_path):
+    """File Views are registered by scope"""
+    path = str(tmp_path / "views.json")
+    views = ViewRegistry(path, min_entities=10)
+    assert views.get("syn1") is None
+    views.set("syn1", "syn2")
+    views.save()
+    assert ViewRegistry(path).get("syn1") == "syn2"
+
+
+def test_view_registry_estimate(tmp_path):
+    """Estimates of containers without File View expire"""
+    path = str(tmp_path / "views.json")
+    views = ViewRegistry(path, ttl=timedelta(days=7))
+    views.set_estimate("syn3", 50, 2)
+    views.save()
+    saved = ViewRegistry(path)
+    assert saved.get("syn3") is None
+    assert saved.get_estimate("syn3") == {"entities": 50, "folders": 2}
+    saved.ttl = timedelta(0)
+    assert saved.get_estimate("syn3") is None
+    saved.save()
+    assert ViewRegistry(path).get_estimate("syn3") is None
+
+
+def test_feed_cache(tmp_path):
+    """Interval summaries and File Views are cached per Project"""
+    path = str(tmp_path / "feed.json")
+    cache = FeedCache(path)
+    start = datetime(2021, 3, 1)
+    assert cache.get("syn1", "week", start) is None
+    assert cache.get_view("syn1") is None
+    cache.set_view("syn1", "syn2")
+    cache.set("syn1", "week", start, {"parents": []})
+    cache.save()
+    saved = FeedCache(path)
+    assert saved.get_view("syn1") == "syn2"
+    assert saved.get("syn1", "week", start) == {"parents": []}
+    assert saved.get("syn1", "month", start) is None
+
+
+def test_traversal_checkpoint(tmp_path):
+    """Traversals are saved at intervals and removed once completed"""
+    path = str(tmp_path / "checkpoint.json")
+    clock = iter([0, 10, 70, 70, 80]).__next__
+    checkpoint = TraversalCheckpoint(path, interval=60, clock=clock)
+    checkpoint.update("syn1", ["file"], [("syn2", 1, "a")], [{"id": "syn3"}])
+    assert TraversalCheckpoint(path, resume=True).get("syn1", ["file"]) is None
+    checkpoint.update("syn1", ["file"], [("syn4", 1, "b")], [{"id": "syn3"}])
+    saved = TraversalCheckpoint(path, resume=True)
+    assert saved.get("syn1", ["file"]) == {
+        "folders": [["syn4", 1, "b"]],
+        "headers": [{"id": "syn3"}],
+        "params": None,
+    }
+    assert saved.get("syn1", ["file", "folder"]) is None
+    assert TraversalCheckpoint(path).get("syn1", ["file"]) is None
+    checkpoint.clear("syn1", ["file"])
+    assert TraversalCheckpoint(path, resume=True).get("syn1", ["file"]) is None
+
+
+class CountedFolders(list):
+    """Folders counting how many times they are read"""
+
+    reads = 0
+
+    def __iter__(self):
+        self.reads += 1
+        return super().__iter__()
+
+
+def test_traversal_checkpoint_between_saves(tmp_path):
+    """Folders are only read when the traversal is saved"""
+    path = str(tmp_path / "checkpoint.json")
+    clock = iter([0, 10, 20, 70, 70]).__next__
+    checkpoint = TraversalCheckpoint(path, interval=60, clock=clock)
+    folders = CountedFolders([("syn2", 1, "a")])
+    checkpoint.update("syn1", ["file"], folders, [])
+    folders.append(("syn4", 1, "b"))
+    checkpoint.update("syn1", ["file"], folders, [])
+    assert folders.reads == 0
+    checkpoint.update("syn1", ["file"], folders, [])
+    assert folders.reads == 1
+    saved = TraversalCheckpoint(path, resume=True).get("syn1", ["file"])
+    assert saved["folders"] == [["syn2", 1, "a"], ["syn4", 1, "b"]]
+
+
+def test_traversal_checkpoint_params(tmp_path, caplog):
+    """Traversals saved with other parameters are discarded"""
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = TraversalCheckpoint(path)
+    checkpoint.update("syn1", ["file"], [("syn2", 1, "a")], [], {"cutoff": [1, "day"]})
+    checkpoint.save()
+    saved = TraversalCheckpoint(path, resume=True)
+    assert saved.get("syn1", ["file"], {"cutoff": [1, "day"]}) is not None
+    assert saved.get("syn1", ["file"], {"cutoff": [7, "day"]}) is None
+    assert "Discarding the saved traversal of syn1" in caplog.text
+    assert saved.get("syn1", ["file"], {"cutoff": [1, "day"]}) is None
@@ -0,0 +1,149 @@
+"""Test stats module"""
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from synapsemonitor.__main__ import build_parser
+from synapsemonitor.stats import RestStats, _endpoint
+
+REPO = "https://repo-prod.prod.sagebase.org/repo/v1"
+
+
+@pytest.mark.parametrize(
+    "method,url,expected",
+    [
+        ("GET", f"{REPO}/entity/syn123.4/bundle2?x=1", "GET /entity/{id}/bundle2"),
+        ("GET", f"{REPO}/entity/syn123/bundle2?x=1", "GET /entity/{id}/bundle2"),
+        ("POST", f"{REPO}/entity/children", "POST /entity/children"),
+        ("GET", f"{REPO}/userProfile/3342573", "GET /userProfile/{id}"),
+        (
+            "GET",
+            f"{REPO}/entity/syn9/table/query/async/get/8f2a",
+            "GET /entity/{id}/table/query/async/get/8f2a",
+        ),
+        ("GET", "https://s3.amazonaws.com/bucket/key", "GET s3.amazonaws.com"),
+    ],
+)
+def test__endpoint(method, url, expected):
+    """Endpoints are named after the path without IDs or other hosts"""
+    assert _endpoint(method, url) == expected
+
+
+class FakeClock:
+    """Clock advanced by each request"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRestStats:
+    """Test profiling REST calls"""
+
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.stats = RestStats(clock=self.clock)
+        self.syn = Mock()
+        self.responses = []
+
+        def send(request, **kwargs):
+            self.clock.now += 0.2
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.syn._requests_session.send = send
+        self.stats.install(self.syn)
+
+    def _request(self, method, path, body=None):
+        return Mock(
+            method=method,
+            url=f"https://repo-prod.prod.sagebase.org/repo/v1{path}",
+            body=body,
+        )
+
+    def test_install(self):
+        """Calls, errors, latency and bytes are recorded per endpoint"""
+        self.responses = [
+            Mock(status_code=200, content=b"x" * 100),
+            Mock(status_code=429, content=b"{}"),
+            ConnectionError(),
+        ]
+        send = self.syn._requests_session.send
+        request = self._request("POST", "/entity/children", body=b"{}")
+        assert send(request) is not None
+        send(request)
+        with pytest.raises(ConnectionError):
+            send(self._request("GET", "/entity/syn1"))
+
+        stats = self.stats.endpoints["POST /entity/children"]
+        assert stats.calls == 2
+        assert stats.errors == 1
+        assert stats.seconds == pytest.approx(0.4)
+        assert stats.bytes_sent == 4
+        assert stats.bytes_received == 102
+        assert stats.buckets[2] == 2
+        assert self.stats.endpoints["GET /entity/{id}"].errors == 1
+
+    def test_install_stream(self):
+        """Streamed responses are counted from their Content-Length"""
+        self.responses = [
+            Mock(status_code=200, headers={"Content-Length": "2048"}),
+        ]
+        self.syn._requests_session.send(
+            self._request("GET", "/entity/syn1/file"), stream=True
+        )
+        assert self.stats.endpoints["GET /entity/{id}/file"].bytes_received == 2048
+
+    def test_percentile(self):
+        """Percentiles are bounded by the histogram buckets"""
+        for seconds in [0.01] * 19 + [20]:
+            self.stats.record("GET /a", seconds)
+        assert self.stats.endpoints["GET /a"].percentile(0.95) == 0.05
+        assert self.stats.endpoints["GET /a"].percentile(1) is None
+
+    def test_format_table(self):
+        """Endpoints are listed slowest first, followed by the totals"""
+        self.stats.record("GET /a", 0.1, bytes_received=1024)
+        self.stats.record("POST /b", 3.0, bytes_sent=512, error=True)
+        lines = self.stats.format_table().splitlines()
+        assert lines[0].split()[:3] == ["endpoint", "calls", "errors"]
+        assert lines[1].split()[:5] == ["POST", "/b", "1", "1", "3.00"]
+        assert lines[2].split()[:5] == ["GET", "/a", "1", "0", "0.10"]
+        assert lines[3] == (
+            "Total: 2 calls, 1 errors, 3.10s, 0.5 kB sent, 1.0 kB received"
+        )
+
+    def test_format_table_overflow(self):
+        """Percentiles slower than the last bucket are printed as a minimum"""
+        self.stats.record("GET /a", 20)
+        assert self.stats.format_table().splitlines()[1].split()[6] == ">10000"
+
+    def test_save(self, tmp_path):
+        """Statistics are written to JSON"""
+        self.stats.record("GET /a", 0.3, bytes_received=10)
+        path = tmp_path / "stats.json"
+        self.stats.save(str(path))
+        saved = json.loads(path.read_text())
+        assert saved["endpoints"]["GET /a"]["calls"] == 1
+        assert saved["endpoints"]["GET /a"]["bytes_received"] == 10
+        assert saved["endpoints"]["GET /a"]["latency_buckets"]["0.5"] == 1
+        assert saved["endpoints"]["GET /a"]["latency_buckets"]["+Inf"] == 0
+
+
+@pytest.mark.parametrize(
+    "argv,stats,stats_file",
+    [
+        (["--stats", "monitor", "syn12345"], True, None),
+        (["--stats_file", "stats.json", "monitor", "syn12345"], False, "stats.json"),
+    ],
+)
+def test_stats_options(argv, stats, stats_file):
+    """Profiling options don't take the command as their value"""
+    args = build_parser().parse_args(argv)
+    assert (args.stats, args.stats_file) == (stats, stats_file)
+    assert args.synapse_id == ["syn12345"]
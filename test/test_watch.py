@@ -0,0 +1,113 @@
+"""Test watch module"""
+from unittest.mock import Mock, patch
+
+from synapsemonitor import actions, monitor
+from synapsemonitor.metrics import RunMetrics
+from synapsemonitor.watch import Watcher
+
+
+class FakeClock:
+    """Clock advanced by sleep"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestWatcher:
+    """Test watching targets"""
+
+    def setup_method(self):
+        self.syn = Mock()
+        self.clock = FakeClock()
+        self.watcher = Watcher(
+            self.syn,
+            targets=[
+                {"synapse_id": "syn1", "interval": 1},
+                {"synapse_id": "syn2", "interval": 3},
+            ],
+            clock=self.clock,
+            sleep=self.clock.sleep,
+        )
+
+    def test_run_schedule(self):
+        """Targets are polled on their own interval"""
+        with patch.object(
+            monitor, "find_modified_entities", return_value=[]
+        ) as patch_find, patch.object(actions.ActionPipeline, "run"):
+            self.watcher.run(max_polls=6)
+        polled = [call[1]["syn_id"] for call in patch_find.call_args_list]
+        assert polled == ["syn1", "syn2", "syn1", "syn1", "syn1", "syn2"]
+        assert self.clock.now == 180
+
+    def test_poll_incremental(self):
+        """Later polls look back to the previous poll and skip reported ids"""
+        target = self.watcher._targets[0]
+        with patch.object(
+            monitor, "find_modified_entities", side_effect=[["syn3"], ["syn3", "syn4"]]
+        ) as patch_find, patch.object(actions.ActionPipeline, "run") as patch_action:
+            assert self.watcher.poll(target) == ["syn3"]
+            assert self.watcher.poll(target) == ["syn4"]
+        assert patch_find.call_args_list[0][1]["unit"] == "day"
+        assert patch_find.call_args_list[1][1]["unit"] == "minute"
+        assert patch_find.call_args_list[1][1]["value"] <= 2
+        patch_action.assert_called_with(modified_entities=["syn4"])
+
+    def test_poll_snapshot_fit_window(self):
+        """Later polls fit the snapshot max_age to their window"""
+        target = self.watcher._targets[0]
+        self.watcher.snapshot = Mock()
+        with patch.object(
+            monitor, "find_modified_entities", return_value=[]
+        ), patch.object(actions.ActionPipeline, "run"):
+            self.watcher.poll(target)
+            self.watcher.snapshot.fit_window.assert_not_called()
+            last_poll = target["last_poll"]
+            self.watcher.poll(target)
+        window = self.watcher.snapshot.fit_window.call_args[0][0]
+        assert window.total_seconds() <= 120
+        assert self.watcher.snapshot.fit_window.call_args[1] == {"since": last_poll}
+
+    def test_poll_modified_again(self):
+        """Entities reported by the previous poll are reported again when
+        they were modified again"""
+        target = self.watcher._targets[0]
+        first = monitor.ModifiedEntity("syn3", etag="a")
+        second = monitor.ModifiedEntity("syn3", etag="b")
+        with patch.object(
+            monitor, "find_modified_entities", side_effect=[[first], [first], [second]]
+        ), patch.object(actions.ActionPipeline, "run"):
+            assert self.watcher.poll(target) == ["syn3"]
+            assert self.watcher.poll(target) == []
+            assert self.watcher.poll(target)[0].etag == "b"
+
+    def test_run_poll_error(self):
+        """A failed poll doesn't stop watching"""
+        with patch.object(
+            monitor, "find_modified_entities", side_effect=[ValueError, [], []]
+        ) as patch_find, patch.object(actions.ActionPipeline, "run"):
+            self.watcher.run(max_polls=3)
+        assert patch_find.call_count == 3
+
+    def test_run_metrics(self, tmp_path):
+        """Metrics of the last poll of each target are saved after each poll"""
+        path = tmp_path / "synapsemonitor.prom"
+        self.watcher.metrics = RunMetrics(str(path), wall_clock=lambda: 100.0)
+        with patch.object(
+            monitor, "find_modified_entities", side_effect=[["syn3"], ValueError]
+        ), patch.object(actions.ActionPipeline, "run"):
+            self.watcher.run(max_polls=2)
+        assert self.watcher.metrics.targets["syn1"].modified == 1
+        assert self.watcher.metrics.targets["syn1"].success
+        assert self.watcher.metrics.targets["syn2"].success is False
+        textfile = path.read_text()
+        assert 'synapsemonitor_target_success{target="syn2"} 0\n' in textfile
+        assert (
+            'synapsemonitor_target_last_success_timestamp_seconds{target="syn1"} 100\n'
+            in textfile
+        )